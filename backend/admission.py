@@ -0,0 +1,194 @@
+"""
+Admission control in front of the inference path.
+
+`RateLimiter` is a token bucket per client. `AdmissionController` bounds the
+inference jobs running at once and the jobs queued for a slot; past either
+bound, requests are turned away straight away (with a Retry-After estimate)
+instead of piling up until their clients time out.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+try:
+    from .metrics import Histogram
+    from .batching import WAIT_BUCKETS
+except ImportError:
+    try:
+        from metrics import Histogram
+        from batching import WAIT_BUCKETS
+    except ImportError:
+        from backend.metrics import Histogram
+        from backend.batching import WAIT_BUCKETS
+
+# Weight of the latest job in the running service-time average
+SERVICE_TIME_SMOOTHING = 0.1
+
+
+class Rejected(Exception):
+    """A request turned away; `retry_after` is in seconds."""
+
+    def __init__(self, status_code: int, reason: str, detail: str, retry_after: int = 1):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token bucket per client: `rate` requests per second on average, bursts
+    of up to `burst`. Only the `max_clients` most recently seen clients are
+    tracked (an idle client's bucket would be full again anyway).
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 100_000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self._buckets: OrderedDict = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, client: str, cost: float = 1.0) -> float:
+        """Takes `cost` tokens; returns 0 when allowed, else the seconds until it would be."""
+        if not self.enabled:
+            return 0.0
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        bucket = self._buckets.pop(client, None)
+        tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "clients": len(self._buckets)}
+
+
+class AdmissionController:
+    """
+    At most `max_in_flight` inference jobs hold a slot at once; up to
+    `max_queue` more wait for one in arrival order. A job finding the queue
+    full is rejected with 503 (`queue_full`), and one that waits longer
+    than its timeout with 503 (`queue_timeout`).
+
+    Once `degrade_depth` jobs are queued, `degraded` is true and callers
+    should skip optional work (Grad-CAM) until the queue drains.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, degrade_depth: int = 0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.degrade_depth = degrade_depth
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = {}
+        self.queue_wait = Histogram(WAIT_BUCKETS)
+        self._waiters = deque()
+        self._service_time = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def saturated(self) -> bool:
+        """Every slot is taken and the queue is full: new jobs would be rejected."""
+        return self.in_flight >= self.max_in_flight and len(self._waiters) >= self.max_queue
+
+    @property
+    def degraded(self) -> bool:
+        return self.degrade_depth > 0 and len(self._waiters) >= self.degrade_depth
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained, from the average job time."""
+        backlog = len(self._waiters) + 1
+        return max(1, math.ceil(backlog * self._service_time / self.max_in_flight))
+
+    def count_shed(self, reason: str) -> None:
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+
+    def reject(self, reason: str, detail: str, status_code: int = 503) -> Rejected:
+        self.count_shed(reason)
+        return Rejected(status_code, reason, detail, self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, timeout: float = None, bounded: bool = True):
+        """
+        Holds an inference slot for the body of the block. `timeout` bounds
+        the wait in the queue; `bounded=False` queues even past `max_queue`
+        (for work already admitted as a whole, like a batch upload's images).
+        """
+        await self._acquire(timeout, bounded)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._service_time += SERVICE_TIME_SMOOTHING * (elapsed - self._service_time)
+            self._release()
+
+    async def _acquire(self, timeout: float, bounded: bool) -> None:
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            self.queue_wait.observe(0.0)
+            return
+        if bounded and len(self._waiters) >= self.max_queue:
+            raise self.reject("queue_full", "Server is overloaded; try again later")
+        if timeout is not None and timeout <= 0:
+            raise self.reject("queue_timeout", "Request deadline passed while waiting for inference")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        enqueued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over just as we gave up: pass it on
+                self._release()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                raise self.reject("queue_timeout", "Timed out waiting for an inference slot")
+            raise
+        self.admitted += 1
+        self.queue_wait.observe(time.monotonic() - enqueued_at)
+
+    def _release(self) -> None:
+        # Hand the slot straight to the oldest live waiter, or free it
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "degraded": self.degraded,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "service_time_seconds": self._service_time,
+            "queue_wait_seconds": self.queue_wait.snapshot(),
+        }
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+
+import torch
+
+try:
+    from .metrics import Histogram
+except ImportError:
+    try:
+        from metrics import Histogram
+    except ImportError:
+        from backend.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.015, 0.02, 0.03, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class _PendingItem:
+    __slots__ = ("tensor", "future", "enqueued_at")
+
+    def __init__(self, tensor, future, enqueued_at):
+        self.tensor = tensor
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching in front of the model.
+
+    Concurrent requests submit one preprocessed tensor each. The scheduler
+    waits at most `max_wait_ms` after the first tensor arrives (or until
+    `max_batch_size` tensors are queued), runs them through `run_batch` as a
+    single batch and hands every caller its own row of the result.
+
+    `run_batch` is a blocking callable taking an (N, C, H, W) tensor and
+    returning an (N, num_classes) tensor, or a tuple of N-row outputs in
+    which case every caller receives a tuple of its rows. It runs on `executor` (anything
+    with an async `run(fn, *args)`, e.g. an InferenceExecutor) or in a
+    worker thread, so the event loop stays responsive while the model is
+    busy. Up to `max_concurrent_batches` batches run at the same time.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        executor=None,
+        max_concurrent_batches: int = 1,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.executor = executor
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+
+        self.batch_sizes = Histogram(range(1, self.max_batch_size + 1))
+        self.queue_wait = Histogram(WAIT_BUCKETS)
+        self.batch_latency = Histogram()
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = set()
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._worker = asyncio.create_task(self._serve())
+        logger.info(
+            f"Batch scheduler started (max_batch_size={self.max_batch_size}, "
+            f"max_wait_ms={self.max_wait * 1000:.1f})"
+        )
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+        # Fail anything that was still waiting for a batch
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if not item.future.done():
+                item.future.set_exception(RuntimeError("Batch scheduler stopped"))
+
+    async def submit(self, tensor: torch.Tensor) -> torch.Tensor:
+        """
+        Queues a single preprocessed image (C, H, W) or (1, C, H, W)
+        and returns its output row once the batch it joined has run.
+        """
+        if not self.running:
+            await self.start()
+
+        if tensor.dim() == 4:
+            tensor = tensor[0]
+
+        loop = asyncio.get_running_loop()
+        item = _PendingItem(tensor, loop.create_future(), time.perf_counter())
+        await self._queue.put(item)
+        return await item.future
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_concurrent_batches": self.max_concurrent_batches,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches_in_flight": len(self._in_flight),
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_seconds": self.queue_wait.snapshot(),
+            "batch_latency_seconds": self.batch_latency.snapshot(),
+        }
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued before sleeping
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        # Callers that gave up (e.g. client disconnected) don't need a slot
+        return [item for item in batch if not item.future.done()]
+
+    async def _serve(self) -> None:
+        while True:
+            # Don't start collecting until a batch slot is free, so requests
+            # that arrive meanwhile pile up into the next (larger) batch
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            if not batch:
+                self._slots.release()
+                continue
+
+            task = asyncio.create_task(self._run(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _run(self, batch: list) -> None:
+        started = time.perf_counter()
+        for item in batch:
+            self.queue_wait.observe(started - item.enqueued_at)
+        self.batch_sizes.observe(len(batch))
+
+        try:
+            inputs = torch.stack([item.tensor for item in batch])
+            if self.executor is not None:
+                outputs = await self.executor.run(self.run_batch, inputs)
+            else:
+                outputs = await asyncio.to_thread(self.run_batch, inputs)
+        except Exception as e:
+            logger.error(f"Batch of {len(batch)} failed: {e}")
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        finally:
+            self.batch_latency.observe(time.perf_counter() - started)
+            self._slots.release()
+
+        rows = zip(*outputs) if isinstance(outputs, tuple) else outputs
+        for row, item in zip(rows, batch):
+            if not item.future.done():
+                item.future.set_result(row)
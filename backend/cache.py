@@ -0,0 +1,378 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Rough per-entry overhead of the key, dict and index (bytes)
+ENTRY_OVERHEAD = 256
+# How often stored uploads are swept for expired entries (seconds)
+SWEEP_INTERVAL_SECONDS = 60.0
+
+
+def _entry_size(value: Dict) -> int:
+    """Approximate size of a cached result: its serialized form, nested grids and boxes included."""
+    return ENTRY_OVERHEAD + len(json.dumps(value, separators=(",", ":"), default=str))
+
+
+class PredictionCache:
+    """
+    Content-addressed LRU/TTL cache of prediction results.
+
+    Keys are built from the upload's SHA-256 and the model version, so a
+    re-uploaded photo is answered without decoding or inference, and a new
+    model never serves results produced by an old one. The cache is bounded
+    both by entry count and by approximate size in bytes (heatmaps dominate),
+    evicting least recently used entries first. Entries older than
+    `ttl_seconds` are dropped on access (0 disables expiry).
+
+    With `persist_path` set, `load()` / `save()` keep the cache across
+    restarts as a JSON snapshot.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 256 * 1024 * 1024,
+                 ttl_seconds: float = 0, persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path or None
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(file_hash: str, model_version: str) -> str:
+        return f"{model_version}:{file_hash}"
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key: str, *fallbacks: str, count: bool = True) -> Optional[Dict]:
+        """
+        Value of the first of `key` and `fallbacks` with a live entry. The
+        lookup counts as one hit or one miss however many keys it tries;
+        `count=False` leaves a miss uncounted, for callers that look again.
+        """
+        with self._lock:
+            for k in (key,) + fallbacks:
+                entry = self._entries.get(k)
+                if entry is None:
+                    continue
+                value, stored_at, size = entry
+                if self._expired(stored_at):
+                    self._remove(k)
+                    self.expirations += 1
+                    continue
+                self._entries.move_to_end(k)
+                self.hits += 1
+                return dict(value)
+
+            if count:
+                self.misses += 1
+            return None
+
+    def __contains__(self, key: str) -> bool:
+        """Whether `key` holds a live entry; unlike `get()`, not counted as a hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry[1])
+
+    def put(self, key: str, value: Dict, stored_at: float = None) -> None:
+        if not self.enabled:
+            return
+        size = _entry_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (dict(value), stored_at or time.time(), size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "persistent": self.persist_path is not None,
+            }
+
+    # =============================================================
+    # PERSISTENCE
+    # =============================================================
+    def load(self) -> int:
+        """Restores a snapshot written by `save()`. Returns the number of entries loaded."""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return 0
+        try:
+            with open(self.persist_path, "r") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load prediction cache from {self.persist_path}: {e}")
+            return 0
+
+        loaded = 0
+        # Snapshot is oldest-first, so replaying it restores the LRU order
+        for key, value, stored_at in snapshot.get("entries", []):
+            if self._expired(stored_at):
+                continue
+            self.put(key, value, stored_at)
+            loaded += 1
+        logger.info(f"Loaded {loaded} cached predictions from {self.persist_path}")
+        return loaded
+
+    def save(self) -> None:
+        """Writes the cache to `persist_path` atomically."""
+        if not self.persist_path:
+            return
+        with self._lock:
+            entries = [[key, value, stored_at] for key, (value, stored_at, _) in self._entries.items()]
+
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.persist_path)), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({"entries": entries}, f)
+            os.replace(tmp_path, self.persist_path)
+            logger.info(f"Saved {len(entries)} cached predictions to {self.persist_path}")
+        except OSError as e:
+            logger.error(f"Failed to save prediction cache to {self.persist_path}: {e}")
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - stored_at > self.ttl_seconds
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+
+class UploadStore:
+    """
+    Content-addressed store of recent upload bytes.
+
+    Uploads are kept here so `/explain/{hash}` can compute the heatmap and
+    severity of a classify-only request later, and `/heatmap/{hash}` can
+    render an overlay, without a re-upload. Memory is bounded by `max_bytes`
+    (LRU). With `directory` set, uploads are also written there as
+    `<sha256>` files, which outlive memory eviction and restarts but are
+    bounded too: by `max_disk_bytes`, least recently used files are deleted
+    first. Entries older than `ttl_seconds` expire from both (0 disables).
+
+    Disk reads and writes run in a thread, so `get()` and `put()` are
+    coroutines; `has()` only consults the index.
+    """
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024, directory: Optional[str] = None,
+                 max_disk_bytes: int = 1024 * 1024 * 1024, ttl_seconds: float = 0):
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+
+        # hash -> (contents, stored_at) in memory, hash -> (size, stored_at) on disk
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._files: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._writing = set()
+        self._swept_at = time.time()
+        self._lock = threading.Lock()
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def load(self) -> int:
+        """Indexes the files a previous run left in `directory`, pruning what is over budget or expired."""
+        if not self.directory:
+            return 0
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith(".tmp"):
+                    # Interrupted write
+                    os.remove(path)
+                elif _is_hash(name):
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, name, stat.st_size))
+            except OSError as e:
+                logger.error(f"Failed to index stored upload {path}: {e}")
+
+        with self._lock:
+            # Oldest first, so the LRU order follows the files' age
+            for stored_at, file_hash, size in sorted(found):
+                self._files[file_hash] = (size, stored_at)
+                self._disk_bytes += size
+            doomed = self._sweep(time.time()) + self._trim_disk()
+        self._delete(doomed)
+        logger.info(f"Indexed {len(self._files)} stored uploads in {self.directory}")
+        return len(self._files)
+
+    async def put(self, file_hash: str, contents: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            doomed = self._sweep(now)
+            if len(contents) <= self.max_bytes:
+                if file_hash in self._entries:
+                    self._bytes -= len(self._entries.pop(file_hash)[0])
+                self._entries[file_hash] = (contents, now)
+                self._bytes += len(contents)
+                while self._bytes > self.max_bytes:
+                    _, (evicted, _) = self._entries.popitem(last=False)
+                    self._bytes -= len(evicted)
+
+            write = False
+            if self.directory and len(contents) <= self.max_disk_bytes:
+                if file_hash in self._files:
+                    self._files[file_hash] = (self._files.pop(file_hash)[0], now)
+                elif file_hash not in self._writing:
+                    self._writing.add(file_hash)
+                    write = True
+
+        if write:
+            try:
+                await asyncio.to_thread(self._write, file_hash, contents)
+                with self._lock:
+                    self._files[file_hash] = (len(contents), now)
+                    self._disk_bytes += len(contents)
+                    doomed += self._trim_disk()
+            except OSError as e:
+                logger.error(f"Failed to store upload {file_hash}: {e}")
+            finally:
+                with self._lock:
+                    self._writing.discard(file_hash)
+        if doomed:
+            await asyncio.to_thread(self._delete, doomed)
+
+    def has(self, file_hash: str) -> bool:
+        """Whether the upload is still stored (in memory or on disk)."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(file_hash) or self._files.get(file_hash)
+            return entry is not None and not self._expired(entry[1], now)
+
+    async def get(self, file_hash: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(file_hash)
+            if entry is not None and not self._expired(entry[1], now):
+                self._entries.move_to_end(file_hash)
+                return entry[0]
+            entry = self._files.get(file_hash)
+            if entry is None:
+                return None
+            if self._expired(entry[1], now):
+                doomed = self._sweep(now, force=True)
+            else:
+                self._files.move_to_end(file_hash)
+                doomed = None
+
+        if doomed is not None:
+            await asyncio.to_thread(self._delete, doomed)
+            return None
+        try:
+            return await asyncio.to_thread(self._read, file_hash)
+        except OSError:
+            # Deleted behind our back
+            with self._lock:
+                if file_hash in self._files:
+                    self._disk_bytes -= self._files.pop(file_hash)[0]
+            return None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "directory": self.directory,
+                "files": len(self._files),
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+            }
+
+    # Caller holds the lock for the index helpers below; the hashes they
+    # return are handed to `_delete()` outside of it
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - stored_at > self.ttl_seconds
+
+    def _sweep(self, now: float, force: bool = False) -> List[str]:
+        """Drops expired entries (at most once a minute unless forced); returns files to delete."""
+        if self.ttl_seconds <= 0 or (not force and now - self._swept_at < SWEEP_INTERVAL_SECONDS):
+            return []
+        self._swept_at = now
+        for file_hash in [h for h, (_, stored_at) in self._entries.items() if self._expired(stored_at, now)]:
+            self._bytes -= len(self._entries.pop(file_hash)[0])
+        doomed = [h for h, (_, stored_at) in self._files.items() if self._expired(stored_at, now)]
+        for file_hash in doomed:
+            self._disk_bytes -= self._files.pop(file_hash)[0]
+        return doomed
+
+    def _trim_disk(self) -> List[str]:
+        doomed = []
+        while self._disk_bytes > self.max_disk_bytes:
+            file_hash, (size, _) = self._files.popitem(last=False)
+            self._disk_bytes -= size
+            doomed.append(file_hash)
+        return doomed
+
+    def _write(self, file_hash: str, contents: bytes) -> None:
+        path = self._path(file_hash)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(contents)
+        os.replace(tmp_path, path)
+
+    def _read(self, file_hash: str) -> bytes:
+        with open(self._path(file_hash), "rb") as f:
+            return f.read()
+
+    def _delete(self, hashes: List[str]) -> None:
+        for file_hash in hashes:
+            try:
+                os.remove(self._path(file_hash))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Failed to delete stored upload {file_hash}: {e}")
+
+    def _path(self, file_hash: str) -> str:
+        # Hashes come from URLs, so never let them escape the directory
+        if not _is_hash(file_hash):
+            raise ValueError("Invalid hash")
+        return os.path.join(self.directory, file_hash)
+
+
+def _is_hash(name: str) -> bool:
+    return bool(name) and all(c in "0123456789abcdef" for c in name)
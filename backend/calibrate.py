@@ -0,0 +1,195 @@
+"""
+Calibrates the confidence threshold of a two-stage cascade on a validation set.
+
+    python -m backend.calibrate --first <version> --images data/val
+    python -m backend.calibrate --first <version> --images data/val --max-accuracy-drop 0.002 --apply
+
+Both models score every image once. For each candidate threshold the
+report gives the share of images the first stage would decide, the
+cascade's accuracy (images filed under a class folder) and its agreement
+with the second stage alone, plus the expected cost per image. The
+recommended threshold is the lowest one whose accuracy loss (or, without
+labels, disagreement) stays within `--max-accuracy-drop`. `--apply`
+writes it to the registry's routing, which running servers pick up.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+try:
+    from .model import load_model
+    from .registry import ModelRegistry, diseased_classes
+    from .pipeline import decode_image, to_input_tensor
+    from .export import find_images
+except ImportError:
+    try:
+        from model import load_model
+        from registry import ModelRegistry, diseased_classes
+        from pipeline import decode_image, to_input_tensor
+        from export import find_images
+    except ImportError:
+        from backend.model import load_model
+        from backend.registry import ModelRegistry, diseased_classes
+        from backend.pipeline import decode_image, to_input_tensor
+        from backend.export import find_images
+
+logger = logging.getLogger(__name__)
+
+
+def score_images(model, batches, class_names):
+    """Top label, its probability and the milliseconds per image of `model` over preloaded batches."""
+    labels, confidences = [], []
+    elapsed = 0.0
+    images = 0
+    with torch.no_grad():
+        for batch in batches:
+            started = time.perf_counter()
+            probabilities = torch.softmax(model(batch).float(), dim=1)
+            elapsed += time.perf_counter() - started
+            images += len(batch)
+            top_prob, top_idx = probabilities.max(dim=1)
+            labels.extend(class_names[i] for i in top_idx.tolist())
+            confidences.extend(top_prob.tolist())
+    return labels, np.array(confidences), 1000 * elapsed / max(images, 1)
+
+
+def sweep(first, second, truth, first_ms: float, second_ms: float, escalate=(), thresholds=None) -> list:
+    """
+    Cascade outcome at each threshold. `first` and `second` are (labels,
+    confidences) of each stage; `truth` holds the true label or None.
+    """
+    first_labels, first_conf = np.asarray(first[0], dtype=object), np.asarray(first[1])
+    second_labels = np.asarray(second[0], dtype=object)
+    truth = np.asarray(truth, dtype=object)
+    if thresholds is None:
+        thresholds = np.round(np.arange(0.0, 1.0, 0.01), 2).tolist() + [1.0]
+
+    eligible = ~np.isin(first_labels, list(escalate))
+    stages_agree = first_labels == second_labels
+    labelled = np.array([label is not None for label in truth], dtype=bool)
+    first_correct = (first_labels == truth)[labelled]
+    second_correct = (second_labels == truth)[labelled]
+
+    rows = []
+    for threshold in thresholds:
+        decided = eligible & (first_conf >= threshold)
+        coverage = float(decided.mean()) if len(decided) else 0.0
+        row = {
+            "threshold": threshold,
+            "first_stage_share": coverage,
+            # Escalated images take the second stage's label, so only decided ones can disagree
+            "agreement": float((stages_agree | ~decided).mean()) if len(decided) else 0.0,
+            # The first stage always runs; the second only for escalated images
+            "expected_ms_per_image": first_ms + (1 - coverage) * second_ms,
+        }
+        if labelled.any():
+            row["accuracy"] = float(np.where(decided[labelled], first_correct, second_correct).mean())
+        rows.append(row)
+    return rows
+
+
+def recommend(rows, second_accuracy, max_drop: float):
+    """Lowest threshold (most work kept on the first stage) whose loss stays within `max_drop`."""
+    for row in rows:
+        if second_accuracy is not None:
+            loss = second_accuracy - row["accuracy"]
+        else:
+            loss = 1.0 - row["agreement"]
+        if loss <= max_drop:
+            return row
+    return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Calibrate the confidence threshold of the model cascade.")
+    parser.add_argument("--first", required=True, help="Registered version of the fast first-stage model")
+    parser.add_argument("--second", help="Registered version of the full model (default: the active one)")
+    parser.add_argument("--images", required=True, help="Validation images, filed under class folders for accuracy")
+    parser.add_argument("--max-images", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.005,
+                        help="Accuracy (or, without labels, agreement) the cascade may lose against the full model")
+    parser.add_argument("--escalate", default="", help="Comma-separated classes always sent to the full model")
+    parser.add_argument("--escalate-diseased", action="store_true", help="Also escalate every non-healthy class")
+    parser.add_argument("--output", help="Write the full report (every threshold) as JSON here")
+    parser.add_argument("--apply", action="store_true", help="Set the recommended cascade in the registry routing")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    torch.set_num_threads(os.cpu_count() or 1)
+    registry = ModelRegistry()
+    try:
+        first_spec = registry.spec(args.first)
+        second_spec = registry.spec(args.second) if args.second else registry.active_spec()
+    except (KeyError, ValueError) as e:
+        parser.error(str(e))
+
+    escalate = [name.strip() for name in args.escalate.split(",") if name.strip()]
+    if args.escalate_diseased:
+        escalate += [name for name in diseased_classes(first_spec.class_names) if name not in escalate]
+
+    # Folders named after a class either model knows are ground truth
+    known = set(first_spec.class_names) | set(second_spec.class_names)
+    images = find_images(args.images, args.max_images, known)
+    if not images:
+        parser.error(f"No images found under {args.images}")
+    truth = [label for _, label in images]
+
+    # Decode once; both models see the same inputs
+    tensors = []
+    for path, _ in images:
+        with open(path, "rb") as f:
+            tensors.append(to_input_tensor(decode_image(f.read())))
+    batches = [torch.cat(tensors[i:i + args.batch_size]) for i in range(0, len(tensors), args.batch_size)]
+
+    device = torch.device("cpu")
+    first_model = load_model(first_spec.path, device, len(first_spec.class_names), first_spec.arch)
+    second_model = load_model(second_spec.path, device, len(second_spec.class_names), second_spec.arch)
+    first_labels, first_conf, first_ms = score_images(first_model, batches, first_spec.class_names)
+    second_labels, second_conf, second_ms = score_images(second_model, batches, second_spec.class_names)
+
+    rows = sweep((first_labels, first_conf), (second_labels, second_conf), truth, first_ms, second_ms, escalate)
+    labelled = [i for i, label in enumerate(truth) if label is not None]
+    second_accuracy = (
+        sum(second_labels[i] == truth[i] for i in labelled) / len(labelled) if labelled else None
+    )
+    best = recommend(rows, second_accuracy, args.max_accuracy_drop)
+
+    report = {
+        "first": first_spec.version,
+        "second": second_spec.version,
+        "images": len(images),
+        "labelled_images": len(labelled),
+        "first_ms_per_image": first_ms,
+        "second_ms_per_image": second_ms,
+        "second_accuracy": second_accuracy,
+        "first_accuracy": (
+            sum(first_labels[i] == truth[i] for i in labelled) / len(labelled) if labelled else None
+        ),
+        "escalate": escalate,
+        "max_accuracy_drop": args.max_accuracy_drop,
+        "recommended": best,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({**report, "thresholds": rows}, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+    if best is None:
+        logger.error("No threshold keeps the cascade within the allowed accuracy drop")
+        return 1
+    if args.apply:
+        cascade = {"version": first_spec.version, "threshold": best["threshold"], "escalate": escalate}
+        registry.update_routing(cascade=cascade)
+        logger.info(f"Cascade set: {first_spec.version} decides at confidence >= {best['threshold']:g}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    """Reads an integer setting from the environment."""
+    return int(os.getenv(name, default))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Reads a boolean setting (1/true/yes/on) from the environment."""
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_float(name: str, default: float) -> float:
+    """Reads a float setting from the environment."""
+    return float(os.getenv(name, default))
+
+
+# =============================================================
+# MICRO-BATCHING
+# =============================================================
+# Largest number of images run through the model in one forward pass
+BATCH_MAX_SIZE = _env_int("AGRIGUARD_BATCH_MAX_SIZE", 8)
+# How long the first request in a batch waits for company (milliseconds)
+BATCH_MAX_WAIT_MS = _env_float("AGRIGUARD_BATCH_MAX_WAIT_MS", 10.0)
+
+# =============================================================
+# EXECUTION BACKEND
+# =============================================================
+# "thread" or "process"; every worker holds its own model replica
+WORKER_KIND = os.getenv("AGRIGUARD_WORKER_KIND", "thread")
+# Number of pool workers (defaults to one per CPU core)
+WORKERS = _env_int("AGRIGUARD_WORKERS", os.cpu_count() or 1)
+
+# =============================================================
+# PREDICTION CACHE
+# =============================================================
+# Entries and approximate memory the result cache may hold (0 disables it)
+CACHE_MAX_ENTRIES = _env_int("AGRIGUARD_CACHE_MAX_ENTRIES", 1024)
+CACHE_MAX_MB = _env_float("AGRIGUARD_CACHE_MAX_MB", 256.0)
+# Seconds before a cached result is recomputed (0 keeps entries until evicted)
+CACHE_TTL_SECONDS = _env_float("AGRIGUARD_CACHE_TTL_SECONDS", 7 * 24 * 3600)
+# JSON snapshot that keeps the cache across restarts (empty disables persistence)
+CACHE_PATH = os.getenv("AGRIGUARD_CACHE_PATH", "")
+
+# =============================================================
+# DEFERRED EXPLANATIONS
+# =============================================================
+# Memory kept for classify-only uploads awaiting /explain/{hash}
+UPLOAD_STORE_MAX_MB = _env_float("AGRIGUARD_UPLOAD_STORE_MAX_MB", 128.0)
+# Directory that also keeps those uploads on disk (empty keeps them in memory only)
+UPLOAD_STORE_DIR = os.getenv("AGRIGUARD_UPLOAD_STORE_DIR", "")
+# Disk those files may take; least recently used ones are deleted beyond it
+UPLOAD_STORE_DISK_MAX_MB = _env_float("AGRIGUARD_UPLOAD_STORE_DISK_MAX_MB", 1024.0)
+# Seconds a stored upload is kept after its last upload (0 keeps it until evicted)
+UPLOAD_STORE_TTL_SECONDS = _env_float("AGRIGUARD_UPLOAD_STORE_TTL_SECONDS", CACHE_TTL_SECONDS)
+
+# =============================================================
+# BATCH UPLOADS
+# =============================================================
+# Most images accepted by one /predict/batch request (files + archive members)
+BATCH_UPLOAD_MAX_IMAGES = _env_int("AGRIGUARD_BATCH_UPLOAD_MAX_IMAGES", 1000)
+# Images of one batch request in flight at once (decoding, inference, overlay)
+BATCH_UPLOAD_CONCURRENCY = _env_int("AGRIGUARD_BATCH_UPLOAD_CONCURRENCY", 32)
+
+# =============================================================
+# ADMISSION CONTROL
+# =============================================================
+# Inference jobs (uploads that miss the cache) running at once
+ADMISSION_MAX_IN_FLIGHT = _env_int("AGRIGUARD_ADMISSION_MAX_IN_FLIGHT", WORKERS * BATCH_MAX_SIZE * 2)
+# Jobs waiting for a slot; beyond this requests get 503 with Retry-After
+ADMISSION_MAX_QUEUE = _env_int("AGRIGUARD_ADMISSION_MAX_QUEUE", 64)
+# Longest a job waits in that queue before giving up with 503 (seconds)
+ADMISSION_QUEUE_TIMEOUT_SECONDS = _env_float("AGRIGUARD_ADMISSION_QUEUE_TIMEOUT_SECONDS", 10.0)
+# Queue depth from which /predict skips Grad-CAM and answers like /classify
+# (plus an explain_url for later); 0 never degrades
+DEGRADE_QUEUE_DEPTH = _env_int("AGRIGUARD_DEGRADE_QUEUE_DEPTH", 16)
+# Deadline of an inference request (seconds); clients may ask for less with
+# an X-Request-Timeout header. Work past it, or for a client that went away,
+# is cancelled
+REQUEST_TIMEOUT_SECONDS = _env_float("AGRIGUARD_REQUEST_TIMEOUT_SECONDS", 30.0)
+# Per-client token bucket: sustained requests per second (0 disables) and burst
+RATE_LIMIT_PER_SECOND = _env_float("AGRIGUARD_RATE_LIMIT_PER_SECOND", 0.0)
+RATE_LIMIT_BURST = _env_float("AGRIGUARD_RATE_LIMIT_BURST", 20.0)
+# Header identifying a client (e.g. X-API-Key or X-Forwarded-For behind a
+# proxy); empty uses the peer address
+RATE_LIMIT_KEY_HEADER = os.getenv("AGRIGUARD_RATE_LIMIT_KEY_HEADER", "")
+
+# =============================================================
+# CAMERA STREAMS
+# =============================================================
+# WebSocket camera feeds (/stream) connected at once; more are refused
+STREAM_MAX_CONNECTIONS = _env_int("AGRIGUARD_STREAM_MAX_CONNECTIONS", 64)
+# Weight of the newest frame when smoothing class probabilities over time
+# (1 reports every frame as is; clients may pick their own with ?smoothing=)
+STREAM_SMOOTHING = _env_float("AGRIGUARD_STREAM_SMOOTHING", 0.3)
+
+# =============================================================
+# UPLOAD LIMITS
+# =============================================================
+# Largest single image upload (larger bodies are refused before being read)
+UPLOAD_MAX_MB = _env_float("AGRIGUARD_UPLOAD_MAX_MB", 20.0)
+# Largest /predict/batch request body, and most bytes extracted from its archives
+BATCH_UPLOAD_MAX_MB = _env_float("AGRIGUARD_BATCH_UPLOAD_MAX_MB", 512.0)
+# Uploads are read and hashed in chunks of this size (KiB)
+UPLOAD_CHUNK_KB = _env_int("AGRIGUARD_UPLOAD_CHUNK_KB", 64)
+
+# =============================================================
+# DECODING
+# =============================================================
+# Longest side of the decoded working image (0 decodes at full resolution).
+# Segmentation, severity and the overlay all run at this size.
+DECODE_MAX_SIDE = _env_int("AGRIGUARD_DECODE_MAX_SIDE", 1024)
+# Images whose header declares more pixels than this are refused before
+# decoding, which bounds the memory a single request can take (0 disables)
+MAX_IMAGE_PIXELS = _env_int("AGRIGUARD_MAX_IMAGE_PIXELS", 50_000_000)
+
+# =============================================================
+# HEATMAP DELIVERY
+# =============================================================
+# Format of the overlay linked from responses (webp | jpg | png)
+HEATMAP_FORMAT = os.getenv("AGRIGUARD_HEATMAP_FORMAT", "webp")
+# Default longest side of /heatmap/{hash} images, and the most a client may ask for
+HEATMAP_MAX_SIDE = _env_int("AGRIGUARD_HEATMAP_MAX_SIDE", 512)
+HEATMAP_MAX_SIDE_LIMIT = _env_int("AGRIGUARD_HEATMAP_MAX_SIDE_LIMIT", 1024)
+# Default encoder quality (1-100) for webp and jpg overlays
+HEATMAP_QUALITY = _env_int("AGRIGUARD_HEATMAP_QUALITY", 80)
+# Cache-Control max-age of overlay images (seconds)
+HEATMAP_CACHE_SECONDS = _env_int("AGRIGUARD_HEATMAP_CACHE_SECONDS", 86400)
+# Memory for rendered overlays kept for repeat requests
+HEATMAP_STORE_MAX_MB = _env_float("AGRIGUARD_HEATMAP_STORE_MAX_MB", 64.0)
+
+# =============================================================
+# INFERENCE ENGINE
+# =============================================================
+# eager | torchscript | compile | onnx | int8-dynamic | onnx-int8
+# (int8-dynamic only quantizes the classifier head; onnx-int8 the whole model)
+# (exported engines are produced with `python -m backend.export <engine>`)
+ENGINE = os.getenv("AGRIGUARD_ENGINE", "eager")
+# Artifact for exported engines (empty uses the default next to the checkpoint)
+ENGINE_PATH = os.getenv("AGRIGUARD_ENGINE_PATH", "")
+
+# =============================================================
+# MODEL REGISTRY
+# =============================================================
+# Versioned checkpoints and routing.json (see backend/registry.py); with no
+# active version there, the legacy models/plant_disease_model.pth is served
+MODEL_REGISTRY_DIR = os.getenv(
+    "AGRIGUARD_MODEL_REGISTRY_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "registry"),
+)
+# How often routing.json is checked for a new active or candidate model (0 disables)
+MODEL_WATCH_SECONDS = _env_float("AGRIGUARD_MODEL_WATCH_SECONDS", 5.0)
+# How long a replaced model keeps serving requests that were routed to it
+MODEL_DRAIN_SECONDS = _env_float("AGRIGUARD_MODEL_DRAIN_SECONDS", 60.0)
+# Pool workers of a canary/shadow candidate (it runs beside the active pool)
+CANDIDATE_WORKERS = _env_int("AGRIGUARD_CANDIDATE_WORKERS", 1)
+# Shadow comparisons running at once; more are skipped rather than queued
+SHADOW_MAX_PENDING = _env_int("AGRIGUARD_SHADOW_MAX_PENDING", 16)
+# Pool workers of the cascade's first-stage model (set with `backend.registry cascade`)
+CASCADE_WORKERS = _env_int("AGRIGUARD_CASCADE_WORKERS", WORKERS)
+
+# =============================================================
+# INTEGRITY LEDGER
+# =============================================================
+# Append-only record of every diagnosis served, for GET /verify/{hash}
+# (see backend/ledger.py; empty disables it)
+LEDGER_PATH = os.getenv(
+    "AGRIGUARD_LEDGER_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ledger.jsonl"),
+)
+# Group commit: records queued within this window share one write and fsync (milliseconds)
+LEDGER_COMMIT_MS = _env_float("AGRIGUARD_LEDGER_COMMIT_MS", 20.0)
+# Most records written per commit
+LEDGER_COMMIT_MAX = _env_int("AGRIGUARD_LEDGER_COMMIT_MAX", 4096)
+# Records waiting for the disk before new ones are dropped (and counted)
+LEDGER_MAX_PENDING = _env_int("AGRIGUARD_LEDGER_MAX_PENDING", 100_000)
+# fsync every commit (off trades crash durability for less disk traffic)
+LEDGER_FSYNC = _env_bool("AGRIGUARD_LEDGER_FSYNC", True)
+
+# =============================================================
+# STARTUP
+# =============================================================
+# Load the model in the background so the server accepts connections (and
+# liveness probes) immediately; /health/ready reports 503 until it is done
+MODEL_BACKGROUND_LOAD = _env_bool("AGRIGUARD_MODEL_BACKGROUND_LOAD", False)
+
+# =============================================================
+# OBSERVABILITY
+# =============================================================
+# Start the sampling profiler at boot (it can also be toggled at runtime
+# with POST /debug/profiler)
+PROFILER_ENABLED = _env_bool("AGRIGUARD_PROFILER_ENABLED", False)
+# Time between stack samples (milliseconds)
+PROFILER_INTERVAL_MS = _env_float("AGRIGUARD_PROFILER_INTERVAL_MS", 5.0)
+# Requests slower than this get their sampled stacks kept (milliseconds)
+PROFILER_SLOW_MS = _env_float("AGRIGUARD_PROFILER_SLOW_MS", 1000.0)
+
+# =============================================================
+# ADMIN
+# =============================================================
+# Token expected in the X-Admin-Token header of admin/debug endpoints.
+# Empty leaves the debug and ledger endpoints open, like the rest of the MVP
+# API, and disables model management (/admin/models*)
+ADMIN_TOKEN = os.getenv("AGRIGUARD_ADMIN_TOKEN", "")
@@ -0,0 +1,212 @@
+"""
+Pre-decoded training data: every image resized once and packed into a
+memory-mapped uint8 array.
+
+    python -m backend.dataset data/PlantVillage/train packed/train
+    python -m backend.dataset data/PlantVillage/valid packed/val --workers 8
+
+The source is an ImageFolder-style directory (one sub-folder per class).
+Images are decoded and resized with the serving pipeline's own functions
+(`decode_image`, `resize_input`), so a model trained on the store sees
+exactly the pixels the API will feed it. A store is a directory holding:
+
+    images.u8   N x size x size x 3 uint8 (raw, memory-mapped)
+    labels.npy  N int16 class indices (-1 for images that failed to decode)
+    meta.json   classes, size, count, source
+
+`PackedImageDataset` reads batches straight out of the page cache: no
+decoding, no resizing, and one gather per batch.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, default_collate
+
+try:
+    from .pipeline import decode_image, resize_input, INPUT_SIZE
+    from .utils import IMAGE_EXTENSIONS
+except ImportError:
+    try:
+        from pipeline import decode_image, resize_input, INPUT_SIZE
+        from utils import IMAGE_EXTENSIONS
+    except ImportError:
+        from backend.pipeline import decode_image, resize_input, INPUT_SIZE
+        from backend.utils import IMAGE_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+IMAGES_NAME = "images.u8"
+LABELS_NAME = "labels.npy"
+META_NAME = "meta.json"
+
+
+def scan_image_folder(directory: str, classes=None):
+    """(path, class index) pairs and the class list of an ImageFolder-style directory."""
+    if classes is None:
+        classes = sorted(entry.name for entry in os.scandir(directory) if entry.is_dir())
+    samples = []
+    for index, name in enumerate(classes):
+        folder = os.path.join(directory, name)
+        if not os.path.isdir(folder):
+            continue
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            samples.extend(
+                (os.path.join(root, file), index) for file in sorted(files) if file.lower().endswith(IMAGE_EXTENSIONS)
+            )
+    return samples, list(classes)
+
+
+def _load_resized(task):
+    index, path, size = task
+    try:
+        with open(path, "rb") as f:
+            # Dataset images are trusted: no pixel limit
+            return index, resize_input(decode_image(f.read(), max_pixels=0), size)
+    except Exception as e:
+        logger.warning(f"Skipping {path}: {e}")
+        return index, None
+
+
+def pack(source: str, output: str, size: int = INPUT_SIZE, workers: int = None, classes=None) -> dict:
+    """Decodes and resizes every image under `source` once, into a store at `output`."""
+    samples, classes = scan_image_folder(source, classes)
+    if not samples:
+        raise ValueError(f"No images found under {source}")
+    os.makedirs(output, exist_ok=True)
+    meta_path = os.path.join(output, META_NAME)
+    if os.path.exists(meta_path):
+        # Readers trust a store with meta.json; it is rewritten last
+        os.remove(meta_path)
+
+    images = np.memmap(os.path.join(output, IMAGES_NAME), dtype=np.uint8, mode="w+",
+                       shape=(len(samples), size, size, 3))
+    labels = np.array([label for _, label in samples], dtype=np.int16)
+
+    started = time.perf_counter()
+    failed = 0
+    tasks = ((index, path, size) for index, (path, _) in enumerate(samples))
+    with Pool(workers or os.cpu_count() or 1) as pool:
+        for done, (index, image) in enumerate(pool.imap_unordered(_load_resized, tasks, chunksize=64), 1):
+            if image is None:
+                labels[index] = -1
+                failed += 1
+            else:
+                images[index] = image
+            if done % 5000 == 0:
+                logger.info(f"Packed {done}/{len(samples)} images ({done / (time.perf_counter() - started):.0f}/s)")
+    images.flush()
+    del images
+
+    np.save(os.path.join(output, LABELS_NAME), labels)
+    meta = {
+        "classes": classes,
+        "size": size,
+        "count": len(samples),
+        "failed": failed,
+        "source": os.path.abspath(source),
+        "created": time.time(),
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    logger.info(
+        f"Packed {len(samples) - failed} images ({failed} failed) of {len(classes)} classes into {output} "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    return meta
+
+
+def read_meta(store: str) -> dict:
+    path = os.path.join(store, META_NAME)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{store} is not a packed dataset (no {META_NAME}); run python -m backend.dataset first")
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class PackedImageDataset(Dataset):
+    """
+    Images and labels of a packed store, as (size, size, 3) uint8 tensors.
+
+    The array is memory-mapped copy-on-write, so tensors are views of the
+    page cache. A DataLoader with automatic batching calls `__getitems__`,
+    which gathers the whole batch in one fancy-indexing copy; pass
+    `collate_fn=collate_packed`. Convert on the device with `to_model_input`.
+    """
+
+    def __init__(self, store: str):
+        self.store = store
+        meta = read_meta(store)
+        self.classes = meta["classes"]
+        self.size = meta["size"]
+        self.count = meta["count"]
+        labels = np.load(os.path.join(store, LABELS_NAME))
+        # Images that failed to decode stay in the file but are never served
+        self.indices = np.flatnonzero(labels >= 0)
+        self.labels = labels.astype(np.int64)
+        self._images = None
+
+    @property
+    def images(self) -> np.ndarray:
+        # Opened lazily so each DataLoader worker maps the file itself
+        if self._images is None:
+            self._images = np.memmap(os.path.join(self.store, IMAGES_NAME), dtype=np.uint8, mode="c",
+                                     shape=(self.count, self.size, self.size, 3))
+        return self._images
+
+    def __getstate__(self):
+        return {**self.__dict__, "_images": None}
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        position = self.indices[index]
+        return torch.from_numpy(self.images[position]), int(self.labels[position])
+
+    def __getitems__(self, indices):
+        positions = self.indices[np.asarray(indices)]
+        return torch.from_numpy(self.images[positions]), torch.from_numpy(self.labels[positions])
+
+
+def collate_packed(batch):
+    """Batches from `__getitems__` are already collated."""
+    if isinstance(batch, tuple):
+        return batch
+    return default_collate(batch)
+
+
+def to_model_input(images: torch.Tensor, device, channels_last: bool = False) -> torch.Tensor:
+    """(B, H, W, 3) uint8 -> (B, 3, H, W) float in [0, 1] on `device`, as `to_input_tensor` builds it."""
+    images = images.to(device, non_blocking=True).permute(0, 3, 1, 2)
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    return images.float().div_(255.0).contiguous(memory_format=memory_format)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Pack an image-folder dataset into a memory-mapped training store.")
+    parser.add_argument("source", help="Directory with one sub-folder of images per class")
+    parser.add_argument("output", help="Store directory to write")
+    parser.add_argument("--size", type=int, default=INPUT_SIZE, help="Side of the square model input")
+    parser.add_argument("--workers", type=int, default=None, help="Decoding processes (default: one per core)")
+    parser.add_argument("--classes-from", help="Reuse the class list (and indices) of another store, e.g. the train split")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    classes = read_meta(args.classes_from)["classes"] if args.classes_from else None
+    try:
+        pack(args.source, args.output, args.size, args.workers, classes)
+    except ValueError as e:
+        parser.error(str(e))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import copy
+import json
+import logging
+import os
+
+import torch
+import torch.nn as nn
+
+try:
+    from .model import MODEL_PATH, CLASS_NAMES
+except ImportError:
+    try:
+        from model import MODEL_PATH, CLASS_NAMES
+    except ImportError:
+        from backend.model import MODEL_PATH, CLASS_NAMES
+
+logger = logging.getLogger(__name__)
+
+# Selectable with AGRIGUARD_ENGINE. Grad-CAM always runs on the eager model;
+# the engine serves the classification tier (/classify, explain=false, batches).
+ENGINES = ("eager", "torchscript", "compile", "onnx", "int8-dynamic", "onnx-int8")
+
+# Engines that need an artifact written by `python -m backend.export`
+EXPORTED_ENGINES = {
+    "torchscript": ".ts.pt",
+    "onnx": ".onnx",
+    "onnx-int8": ".int8.onnx",
+}
+
+CLASS_NAMES_KEY = "class_names"
+
+
+def default_engine_path(kind: str, model_path: str = MODEL_PATH) -> str:
+    """Where `backend.export` writes the artifact for `kind` by default."""
+    root, _ = os.path.splitext(model_path)
+    return root + EXPORTED_ENGINES[kind]
+
+
+def _check_class_names(class_names, source: str, expected=None) -> None:
+    expected = CLASS_NAMES if expected is None else expected
+    if class_names is not None and list(class_names) != list(expected):
+        raise ValueError(
+            f"{source} was exported with {len(class_names)} classes that don't match the model's; re-export it"
+        )
+
+
+class EagerEngine:
+    """Today's behaviour: the PyTorch module in eager mode, fp32."""
+
+    name = "eager"
+
+    def __init__(self, model: nn.Module, device: torch.device):
+        self.model = model
+        self.device = device
+
+    def __call__(self, inputs: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.model(inputs.to(self.device))
+
+
+class CompiledEngine(EagerEngine):
+    """torch.compile'd copy of the model. The first batch of each new shape pays for compilation."""
+
+    name = "compile"
+
+    def __init__(self, model: nn.Module, device: torch.device):
+        super().__init__(torch.compile(copy.deepcopy(model), dynamic=True), device)
+
+
+class DynamicInt8Engine(EagerEngine):
+    """
+    Dynamic INT8 quantization of the Linear layers (CPU only). PyTorch has no
+    dynamic quantization for convolutions, so on EfficientNet/MobileNet this
+    only covers the classifier head and the backbone stays fp32: expect a
+    small speedup at best. `onnx-int8` quantizes the whole network.
+    """
+
+    name = "int8-dynamic"
+
+    def __init__(self, model: nn.Module, device: torch.device):
+        quantized = torch.ao.quantization.quantize_dynamic(
+            copy.deepcopy(model).cpu(), {nn.Linear}, dtype=torch.qint8
+        )
+        super().__init__(quantized, torch.device("cpu"))
+
+
+class TorchScriptEngine(EagerEngine):
+    """Frozen TorchScript module written by `backend.export torchscript`."""
+
+    name = "torchscript"
+
+    def __init__(self, path: str, device: torch.device, class_names=None):
+        extra_files = {f"{CLASS_NAMES_KEY}.json": ""}
+        module = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+        raw = extra_files[f"{CLASS_NAMES_KEY}.json"]
+        _check_class_names(json.loads(raw) if raw else None, path, class_names)
+        super().__init__(module, device)
+
+
+class OnnxEngine:
+    """ONNX Runtime session (fp32 or INT8) written by `backend.export onnx` / `onnx-int8`."""
+
+    name = "onnx"
+
+    def __init__(self, path: str, device: torch.device, threads: int = 1, class_names=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("The onnx engines need onnxruntime: pip install onnxruntime")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Parallelism comes from the worker pool, like torch.set_num_threads(1)
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+
+        providers = ["CPUExecutionProvider"]
+        if device.type == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+
+        self.session = ort.InferenceSession(path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        raw = metadata.get(CLASS_NAMES_KEY)
+        _check_class_names(json.loads(raw) if raw else None, path, class_names)
+
+    def __call__(self, inputs: torch.Tensor) -> torch.Tensor:
+        outputs = self.session.run(None, {self.input_name: inputs.cpu().numpy()})
+        return torch.from_numpy(outputs[0])
+
+
+def load_engine(kind: str, model: nn.Module, device: torch.device, path: str = None, model_path: str = MODEL_PATH,
+                class_names=None):
+    """
+    Builds the inference engine `kind` for an already loaded eager `model`.
+    Exported artifacts must carry `class_names` (CLASS_NAMES by default).
+    """
+    if kind not in ENGINES:
+        raise ValueError(f"Unknown engine '{kind}', expected one of {ENGINES}")
+
+    if kind in EXPORTED_ENGINES:
+        path = path or default_engine_path(kind, model_path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No {kind} artifact at {path}; run `python -m backend.export {kind}` first")
+
+    if kind == "eager":
+        return EagerEngine(model, device)
+    if kind == "compile":
+        return CompiledEngine(model, device)
+    if kind == "int8-dynamic":
+        return DynamicInt8Engine(model, device)
+    if kind == "torchscript":
+        return TorchScriptEngine(path, device, class_names)
+    engine = OnnxEngine(path, device, class_names=class_names)
+    engine.name = kind
+    return engine
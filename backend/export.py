@@ -0,0 +1,260 @@
+"""
+Offline export and accuracy-parity check for the optimized inference engines.
+
+    python -m backend.export torchscript
+    python -m backend.export onnx
+    python -m backend.export onnx-int8 --calibration-dir data/calibration
+    python -m backend.export check --engine onnx-int8 --images data/holdout
+    python -m backend.export onnx --version 20261018-120000-1a2b3c4d
+
+Exports read the trained checkpoint (`plant_disease_model.pth`, or a
+registered `--version`) and embed its class list in the artifact, so a
+server never pairs weights with the wrong label list. `check` runs a held-out image set through the eager model and
+the candidate engine and fails (exit code 1) when top-1 agreement drops
+below `--min-agreement`.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+try:
+    from .model import MODEL_PATH, CLASS_NAMES, DEFAULT_ARCH, load_model
+    from .engines import ENGINES, CLASS_NAMES_KEY, default_engine_path, load_engine, EagerEngine
+    from .pipeline import decode_image, to_input_tensor, INPUT_SIZE
+    from .utils import IMAGE_EXTENSIONS
+    from .registry import ModelRegistry
+except ImportError:
+    try:
+        from model import MODEL_PATH, CLASS_NAMES, DEFAULT_ARCH, load_model
+        from engines import ENGINES, CLASS_NAMES_KEY, default_engine_path, load_engine, EagerEngine
+        from pipeline import decode_image, to_input_tensor, INPUT_SIZE
+        from utils import IMAGE_EXTENSIONS
+        from registry import ModelRegistry
+    except ImportError:
+        from backend.model import MODEL_PATH, CLASS_NAMES, DEFAULT_ARCH, load_model
+        from backend.engines import ENGINES, CLASS_NAMES_KEY, default_engine_path, load_engine, EagerEngine
+        from backend.pipeline import decode_image, to_input_tensor, INPUT_SIZE
+        from backend.utils import IMAGE_EXTENSIONS
+        from backend.registry import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+
+def find_images(directory: str, limit: int = None, class_names=CLASS_NAMES):
+    """
+    Image files under `directory` (sorted, recursive), with the class label
+    from the parent folder if it is one of `class_names` (the model's list).
+    """
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            label = os.path.basename(root)
+            found.append((os.path.join(root, name), label if label in class_names else None))
+            if limit and len(found) >= limit:
+                return found
+    return found
+
+
+def _load_batches(paths, batch_size: int):
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        tensors = []
+        for path in chunk:
+            with open(path, "rb") as f:
+                tensors.append(to_input_tensor(decode_image(f.read())))
+        yield torch.cat(tensors)
+
+
+# =============================================================
+# EXPORTS
+# =============================================================
+def export_torchscript(model, output_path: str, class_names=CLASS_NAMES) -> None:
+    example = torch.rand(1, 3, INPUT_SIZE, INPUT_SIZE)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model.cpu(), example))
+    torch.jit.save(traced, output_path, _extra_files={f"{CLASS_NAMES_KEY}.json": json.dumps(class_names)})
+
+
+def export_onnx(model, output_path: str, opset: int = 17, class_names=CLASS_NAMES) -> None:
+    import onnx
+
+    example = torch.rand(1, 3, INPUT_SIZE, INPUT_SIZE)
+    export_kwargs = dict(
+        input_names=["input"],
+        output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+    )
+    with torch.no_grad():
+        try:
+            torch.onnx.export(model.cpu(), example, output_path, dynamo=False, **export_kwargs)
+        except TypeError:
+            # Older torch without the dynamo switch
+            torch.onnx.export(model.cpu(), example, output_path, **export_kwargs)
+
+    onnx_model = onnx.load(output_path)
+    entry = onnx_model.metadata_props.add()
+    entry.key = CLASS_NAMES_KEY
+    entry.value = json.dumps(class_names)
+    onnx.save(onnx_model, output_path)
+
+
+def quantize_onnx_int8(fp32_path: str, output_path: str, calibration_images, batch_size: int = 16,
+                       class_names=CLASS_NAMES) -> None:
+    """Static INT8 (QDQ) quantization calibrated on real leaf images."""
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class LeafCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self._batches = _load_batches(calibration_images, batch_size)
+
+        def get_next(self):
+            batch = next(self._batches, None)
+            return None if batch is None else {"input": batch.numpy()}
+
+    quantize_static(
+        fp32_path,
+        output_path,
+        LeafCalibrationReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+
+    # quantize_static drops custom metadata; put the label list back
+    onnx_model = onnx.load(output_path)
+    entry = onnx_model.metadata_props.add()
+    entry.key = CLASS_NAMES_KEY
+    entry.value = json.dumps(class_names)
+    onnx.save(onnx_model, output_path)
+
+
+# =============================================================
+# PARITY CHECK
+# =============================================================
+def parity_check(reference, candidate, images, batch_size: int = 16, class_names=CLASS_NAMES) -> dict:
+    """
+    Compares two engines on the same images.
+
+    Reports top-1 agreement, the largest probability difference, per-engine
+    latency and, for images filed under a `class_names` folder, accuracy.
+    """
+    paths = [path for path, _ in images]
+    labels = [label for _, label in images]
+
+    agree = 0
+    max_prob_diff = 0.0
+    correct = {"reference": 0, "candidate": 0}
+    labelled = 0
+    timings = {"reference": 0.0, "candidate": 0.0}
+
+    offset = 0
+    for batch in _load_batches(paths, batch_size):
+        started = time.perf_counter()
+        ref_probs = torch.softmax(reference(batch).float(), dim=1)
+        timings["reference"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        cand_probs = torch.softmax(candidate(batch).float(), dim=1)
+        timings["candidate"] += time.perf_counter() - started
+
+        ref_top = ref_probs.argmax(dim=1)
+        cand_top = cand_probs.argmax(dim=1)
+        agree += (ref_top == cand_top).sum().item()
+        max_prob_diff = max(max_prob_diff, (ref_probs - cand_probs).abs().max().item())
+
+        for i, label in enumerate(labels[offset:offset + len(batch)]):
+            if label is None or label not in class_names:
+                continue
+            labelled += 1
+            target = class_names.index(label)
+            correct["reference"] += int(ref_top[i].item() == target)
+            correct["candidate"] += int(cand_top[i].item() == target)
+        offset += len(batch)
+
+    total = len(paths)
+    report = {
+        "images": total,
+        "top1_agreement": agree / total if total else 0.0,
+        "max_probability_diff": max_prob_diff,
+        "reference_ms_per_image": 1000 * timings["reference"] / total if total else 0.0,
+        "candidate_ms_per_image": 1000 * timings["candidate"] / total if total else 0.0,
+        "labelled_images": labelled,
+    }
+    if labelled:
+        report["reference_accuracy"] = correct["reference"] / labelled
+        report["candidate_accuracy"] = correct["candidate"] / labelled
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export optimized inference engines and check their accuracy.")
+    parser.add_argument("command", choices=["torchscript", "onnx", "onnx-int8", "check"])
+    parser.add_argument("--checkpoint", default=MODEL_PATH, help="Trained state_dict (.pth)")
+    parser.add_argument("--version", help="Registered model version to use instead of --checkpoint")
+    parser.add_argument("--output", help="Artifact path (defaults next to the checkpoint)")
+    parser.add_argument("--calibration-dir", help="Images used to calibrate onnx-int8")
+    parser.add_argument("--calibration-images", type=int, default=256)
+    parser.add_argument("--engine", choices=ENGINES, help="Engine to compare against eager (check)")
+    parser.add_argument("--engine-path", help="Artifact for --engine (defaults next to the checkpoint)")
+    parser.add_argument("--images", help="Held-out image directory (check)")
+    parser.add_argument("--max-images", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    torch.set_num_threads(os.cpu_count() or 1)
+    device = torch.device("cpu")
+    class_names, arch = CLASS_NAMES, DEFAULT_ARCH
+    if args.version:
+        try:
+            spec = ModelRegistry().spec(args.version)
+        except (KeyError, ValueError) as e:
+            parser.error(str(e))
+        args.checkpoint, class_names, arch = spec.path, spec.class_names, spec.arch
+    model = load_model(args.checkpoint, device, len(class_names), arch)
+
+    if args.command == "check":
+        if not args.engine or not args.images:
+            parser.error("check needs --engine and --images")
+        images = find_images(args.images, args.max_images, class_names)
+        if not images:
+            parser.error(f"No images found under {args.images}")
+        candidate = load_engine(args.engine, model, device, args.engine_path, args.checkpoint, class_names)
+        report = parity_check(EagerEngine(model, device), candidate, images, args.batch_size, class_names)
+        report["engine"] = args.engine
+        print(json.dumps(report, indent=2))
+        return 0 if report["top1_agreement"] >= args.min_agreement else 1
+
+    output = args.output or default_engine_path(args.command, args.checkpoint)
+    if args.command == "torchscript":
+        export_torchscript(model, output, class_names)
+    elif args.command == "onnx":
+        export_onnx(model, output, class_names=class_names)
+    else:
+        if not args.calibration_dir:
+            parser.error("onnx-int8 needs --calibration-dir with representative leaf images")
+        calibration = [path for path, _ in find_images(args.calibration_dir, args.calibration_images)]
+        fp32_path = default_engine_path("onnx", args.checkpoint)
+        if not os.path.exists(fp32_path):
+            export_onnx(model, fp32_path, class_names=class_names)
+        quantize_onnx_int8(fp32_path, output, calibration, args.batch_size, class_names)
+
+    logger.info(f"Wrote {args.command} engine to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
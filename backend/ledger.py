@@ -0,0 +1,428 @@
+"""
+Append-only integrity ledger of every diagnosis served.
+
+Each line of the ledger file is one JSON record: sequence number, time,
+upload SHA-256, model version, prediction, confidence, severity, tier and
+`chain`, the SHA-256 of the previous record's chain and this record, so
+rewriting any past record breaks every chain value after it.
+
+    python -m backend.ledger verify [--path backend/data/ledger.jsonl]
+    python -m backend.ledger stats
+
+Appends never touch the disk on the caller's thread: the record is
+indexed in memory and queued, and a writer thread commits queued records
+in groups (one write and one fsync per group), so a burst of requests
+shares a single disk sync.
+
+The chain head and the indexes live in the writing process's memory, so a
+ledger file has exactly one writer: `open()` takes an exclusive lock on it
+and fails if another process (a second uvicorn worker or replica) holds
+it. Give each such process its own AGRIGUARD_LEDGER_PATH.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows: the single-writer lock is skipped there
+    fcntl = None
+
+try:
+    from .metrics import Histogram
+    from . import config
+except ImportError:
+    try:
+        from metrics import Histogram
+        import config
+    except ImportError:
+        from backend.metrics import Histogram
+        from backend import config
+
+logger = logging.getLogger(__name__)
+
+GENESIS = "0" * 64
+COMMIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+COMMIT_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+def _chain(previous: str, record: Dict) -> str:
+    body = json.dumps(record, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256((previous + body).encode("utf-8")).hexdigest()
+
+
+class IntegrityLedger:
+    """
+    Append-only, hash-chained ledger file with in-memory indexes.
+
+    `append()` assigns each record its sequence number and file offset
+    up front, so it is immediately visible to `lookup()` and `scan()`
+    (served from the pending buffer until committed). Indexes: upload
+    hash -> records (O(1) `/verify`), time (records are appended in time
+    order, so ranges are a bisect) and label -> records for range scans
+    and counts. They are rebuilt from the file by `open()`.
+
+    With more than `max_pending` records waiting for the disk, new records
+    are dropped (and counted) rather than slowing requests down.
+    """
+
+    def __init__(self, path: str, commit_interval_ms: float = 20.0, commit_max_records: int = 4096,
+                 max_pending: int = 100_000, fsync: bool = True):
+        self.path = path
+        self.commit_interval = max(0.0, commit_interval_ms) / 1000.0
+        self.commit_max_records = max(1, commit_max_records)
+        self.max_pending = max_pending
+        self.fsync = fsync
+
+        self._offsets = array("q")
+        self._times = array("d")
+        self._label_ids = array("H")
+        self._label_names: List[str] = []
+        self._label_index: Dict[str, int] = {}
+        self._by_label: Dict[str, array] = {}
+        # 32-byte digest -> sequence number, or a list of them for re-uploads
+        self._by_hash: Dict[bytes, object] = {}
+
+        self._end = 0
+        # Bytes of the file known to be fully written (a failed commit is cut back to this)
+        self._durable_end = 0
+        self._last_chain = GENESIS
+        self._last_time = 0.0
+
+        self._pending: Dict[int, bytes] = {}
+        self._queue: deque = deque()
+        self._committed = 0
+        self._fd = None
+        self._writer: Optional[threading.Thread] = None
+        self._closing = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+
+        self.commits = 0
+        self.dropped = 0
+        self.write_errors = 0
+        self.commit_latency = Histogram(COMMIT_BUCKETS)
+        self.commit_sizes = Histogram(COMMIT_SIZE_BUCKETS)
+
+    @property
+    def running(self) -> bool:
+        return self._writer is not None and self._writer.is_alive()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    # =============================================================
+    # LIFECYCLE
+    # =============================================================
+    def open(self, read_only: bool = False) -> None:
+        """
+        Rebuilds the indexes from the file and starts the writer thread.
+        Raises RuntimeError if another process is writing the same file.
+        `read_only` only indexes the file (e.g. for inspecting a ledger a
+        server is writing): no lock, no repair of a torn tail, no appends.
+        """
+        if self.running:
+            return
+        if read_only:
+            self._fd = os.open(self.path, os.O_RDONLY)
+            self._load(repair=False)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(self._fd)
+                self._fd = None
+                raise RuntimeError(
+                    f"Ledger {self.path} is already open in another process; "
+                    f"give every server process its own AGRIGUARD_LEDGER_PATH"
+                )
+        started = time.perf_counter()
+        self._load()
+        logger.info(
+            f"Ledger {self.path}: {len(self)} records indexed in {time.perf_counter() - started:.2f}s"
+        )
+        self._closing = False
+        self._writer = threading.Thread(target=self._write_loop, name="agriguard-ledger", daemon=True)
+        self._writer.start()
+
+    def close(self) -> None:
+        """Commits everything still queued and closes the file."""
+        if self._writer is not None:
+            with self._wakeup:
+                self._closing = True
+                self._wakeup.notify()
+            self._writer.join()
+            self._writer = None
+        if self._fd is not None:
+            # Closing the descriptor also releases the lock
+            os.close(self._fd)
+            self._fd = None
+
+    def _load(self, repair: bool = True) -> None:
+        size = os.fstat(self._fd).st_size
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Torn write from a crash: the record never committed
+                    if repair:
+                        logger.warning(f"Ledger {self.path}: dropping {size - offset} byte partial record at the end")
+                        os.ftruncate(self._fd, offset)
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    raise ValueError(f"Ledger {self.path} is corrupt at byte {offset}")
+                self._index(record, offset)
+                self._last_chain = record["chain"]
+                self._last_time = record["ts"]
+                offset += len(line)
+        self._end = self._durable_end = offset
+        self._committed = len(self._offsets)
+
+    # =============================================================
+    # WRITES
+    # =============================================================
+    def append(self, file_hash: str, model_version: str, prediction: str, confidence: float,
+               severity: float = None, tier: str = None) -> Optional[Dict]:
+        """Records one served diagnosis. Returns the record, or None if it had to be dropped."""
+        with self._lock:
+            if not self.running:
+                return None
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return None
+
+            # Clamped so the time index stays sorted even if the clock steps back
+            self._last_time = max(time.time(), self._last_time)
+            record = {
+                "seq": len(self._offsets),
+                "ts": round(self._last_time, 6),
+                "hash": file_hash,
+                "model_version": model_version,
+                "prediction": prediction,
+                "confidence": round(float(confidence), 6),
+                "severity": None if severity is None else round(float(severity), 4),
+                "tier": tier,
+            }
+            self._last_chain = record["chain"] = _chain(self._last_chain, record)
+            line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+
+            self._index(record, self._end)
+            self._end += len(line)
+            self._pending[record["seq"]] = line
+            self._queue.append(line)
+            self._wakeup.notify()
+        return record
+
+    def _index(self, record: Dict, offset: int) -> None:
+        seq = len(self._offsets)
+        self._offsets.append(offset)
+        self._times.append(record["ts"])
+
+        label = record["prediction"]
+        label_id = self._label_index.get(label)
+        if label_id is None:
+            label_id = self._label_index[label] = len(self._label_names)
+            self._label_names.append(label)
+            self._by_label[label] = array("q")
+        self._label_ids.append(label_id)
+        self._by_label[label].append(seq)
+
+        key = bytes.fromhex(record["hash"])
+        existing = self._by_hash.get(key)
+        if existing is None:
+            self._by_hash[key] = seq
+        elif isinstance(existing, list):
+            existing.append(seq)
+        else:
+            self._by_hash[key] = [existing, seq]
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._wakeup:
+                self._wakeup.wait_for(lambda: self._queue or self._closing)
+                if not self._queue and self._closing:
+                    return
+                # Group commit: give concurrent requests a moment to join
+                if not self._closing:
+                    self._wakeup.wait_for(
+                        lambda: len(self._queue) >= self.commit_max_records or self._closing,
+                        timeout=self.commit_interval,
+                    )
+                count = min(len(self._queue), self.commit_max_records)
+                batch = [self._queue.popleft() for _ in range(count)]
+
+            started = time.perf_counter()
+            data = b"".join(batch)
+            try:
+                written = 0
+                while written < len(data):
+                    written += os.write(self._fd, data[written:])
+                if self.fsync:
+                    os.fsync(self._fd)
+            except OSError as e:
+                logger.error(f"Ledger write failed, retrying: {e}")
+                self.write_errors += 1
+                try:
+                    # Drop whatever part of the group did reach the file, so the retry doesn't duplicate it
+                    os.ftruncate(self._fd, self._durable_end)
+                except OSError as truncate_error:
+                    logger.error(f"Ledger could not be cut back to {self._durable_end} bytes: {truncate_error}")
+                with self._wakeup:
+                    self._queue.extendleft(reversed(batch))
+                    if self._closing:
+                        return
+                time.sleep(0.5)
+                continue
+
+            self._durable_end += len(data)
+            self.commit_latency.observe(time.perf_counter() - started)
+            self.commit_sizes.observe(len(batch))
+            with self._lock:
+                for seq in range(self._committed, self._committed + len(batch)):
+                    self._pending.pop(seq, None)
+                self._committed += len(batch)
+                self.commits += 1
+
+    # =============================================================
+    # READS
+    # =============================================================
+    def _read(self, seq: int) -> Dict:
+        with self._lock:
+            line = self._pending.get(seq)
+            start = self._offsets[seq]
+            end = self._offsets[seq + 1] if seq + 1 < len(self._offsets) else self._end
+        if line is None:
+            line = os.pread(self._fd, end - start, start)
+        record = json.loads(line)
+        record["committed"] = seq not in self._pending
+        return record
+
+    def lookup(self, file_hash: str, limit: int = 20) -> List[Dict]:
+        """Every record of an upload hash, newest first."""
+        try:
+            key = bytes.fromhex(file_hash)
+        except ValueError:
+            return []
+        with self._lock:
+            found = self._by_hash.get(key)
+        if found is None:
+            return []
+        seqs = found if isinstance(found, list) else [found]
+        return [self._read(seq) for seq in reversed(seqs[-limit:])]
+
+    def count(self, file_hash: str) -> int:
+        with self._lock:
+            found = self._by_hash.get(bytes.fromhex(file_hash))
+            if isinstance(found, list):
+                return len(found)
+        return 0 if found is None else 1
+
+    def _time_range(self, since: float = None, until: float = None):
+        start = 0 if since is None else bisect_left(self._times, since)
+        stop = len(self._times) if until is None else bisect_right(self._times, until)
+        return start, stop
+
+    def scan(self, since: float = None, until: float = None, label: str = None, after: int = None,
+             limit: int = None) -> Iterator[Dict]:
+        """Records in time order between `since` and `until` (unix seconds), optionally of one label."""
+        with self._lock:
+            start, stop = self._time_range(since, until)
+            if after is not None:
+                start = max(start, after + 1)
+            if label is None:
+                seqs = range(start, stop)
+            else:
+                seqs = self._by_label.get(label, array("q"))
+                seqs = seqs[bisect_left(seqs, start):bisect_left(seqs, stop)]
+        for produced, seq in enumerate(seqs):
+            if limit is not None and produced >= limit:
+                return
+            yield self._read(seq)
+
+    def counts(self, since: float = None, until: float = None) -> Dict[str, int]:
+        """Diagnoses per label between `since` and `until`, straight from the index."""
+        with self._lock:
+            start, stop = self._time_range(since, until)
+            label_ids = np.frombuffer(self._label_ids, dtype=np.uint16)[start:stop].copy()
+            names = list(self._label_names)
+        totals = np.bincount(label_ids, minlength=len(names))
+        return {names[i]: int(n) for i, n in enumerate(totals) if n}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "path": self.path,
+                "records": len(self._offsets),
+                "bytes": self._end,
+                "pending": len(self._pending),
+                "commits": self.commits,
+                "dropped": self.dropped,
+                "write_errors": self.write_errors,
+                "labels": len(self._label_names),
+                "commit_latency_seconds": self.commit_latency.snapshot(),
+                "commit_size": self.commit_sizes.snapshot(),
+            }
+
+
+def verify_chain(path: str) -> Dict:
+    """Recomputes every chain value; reports the first record that doesn't match."""
+    previous = GENESIS
+    checked = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            record = json.loads(line)
+            chain = record.pop("chain")
+            if _chain(previous, record) != chain:
+                return {"ok": False, "records": checked, "first_bad_seq": record.get("seq")}
+            previous = chain
+            checked += 1
+    return {"ok": True, "records": checked, "head": previous}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect the integrity ledger.")
+    parser.add_argument("command", choices=["verify", "stats"])
+    parser.add_argument("--path", default=config.LEDGER_PATH)
+    args = parser.parse_args(argv)
+
+    if not args.path or not os.path.exists(args.path):
+        parser.error(f"No ledger at {args.path!r}")
+    if args.command == "verify":
+        report = verify_chain(args.path)
+        print(json.dumps(report, indent=2))
+        return 0 if report["ok"] else 1
+
+    ledger = IntegrityLedger(args.path)
+    # Works beside a running server: the file is only read
+    ledger.open(read_only=True)
+    try:
+        report = {**ledger.stats(), "counts": ledger.counts()}
+        report.pop("commit_latency_seconds")
+        report.pop("commit_size")
+        print(json.dumps(report, indent=2))
+    finally:
+        ledger.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
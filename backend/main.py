@@ -1,31 +1,190 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import asyncio
+import base64
+import json
+import math
+import time
+from typing import List, Literal
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from pydantic import BaseModel
-from PIL import Image
-import io
 import logging
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
 import numpy as np
-import cv2
-import base64
+import torch
 
 torch.set_num_threads(1)
 torch.set_num_interop_threads(1)
 try:
-    from .utils import calculate_sha256, get_recommendation
+    from .utils import (
+        calculate_sha256, get_recommendation, is_archive, extract_images, read_upload, sniff_image_format,
+        UploadRejected, UploadTooLarge, UnsupportedUpload,
+    )
+    from .metrics import Registry, Counter, Gauge, LabeledHistogram, Callback, SamplingProfiler, CONTENT_TYPE
+    from .cache import PredictionCache, UploadStore
+    from .ledger import IntegrityLedger
+    from .admission import AdmissionController, RateLimiter, Rejected
+    from .streaming import FrameStream
+    from .registry import ModelRegistry, ROUTING_MODES
+    from .serving import ModelDeployment, ModelRouter
+    from .pipeline import (
+        transform, GradCAM, segment_leaf, calculate_severity, overlay_heatmap, OVERLAY_FORMATS, OVERLAY_MEDIA_TYPES
+    )
+    from .workers import prepare, render_heatmap
+    from . import config
 except ImportError:
     try:
-        from utils import calculate_sha256, get_recommendation
+        from utils import (
+            calculate_sha256, get_recommendation, is_archive, extract_images, read_upload, sniff_image_format,
+            UploadRejected, UploadTooLarge, UnsupportedUpload,
+        )
+        from metrics import Registry, Counter, Gauge, LabeledHistogram, Callback, SamplingProfiler, CONTENT_TYPE
+        from cache import PredictionCache, UploadStore
+        from ledger import IntegrityLedger
+        from admission import AdmissionController, RateLimiter, Rejected
+        from streaming import FrameStream
+        from registry import ModelRegistry, ROUTING_MODES
+        from serving import ModelDeployment, ModelRouter
+        from pipeline import (
+            transform, GradCAM, segment_leaf, calculate_severity, overlay_heatmap, OVERLAY_FORMATS, OVERLAY_MEDIA_TYPES
+        )
+        from workers import prepare, render_heatmap
+        import config
     except ImportError:
-        from backend.utils import calculate_sha256, get_recommendation
+        from backend.utils import (
+            calculate_sha256, get_recommendation, is_archive, extract_images, read_upload, sniff_image_format,
+            UploadRejected, UploadTooLarge, UnsupportedUpload,
+        )
+        from backend.metrics import Registry, Counter, Gauge, LabeledHistogram, Callback, SamplingProfiler, CONTENT_TYPE
+        from backend.cache import PredictionCache, UploadStore
+        from backend.ledger import IntegrityLedger
+        from backend.admission import AdmissionController, RateLimiter, Rejected
+        from backend.streaming import FrameStream
+        from backend.registry import ModelRegistry, ROUTING_MODES
+        from backend.serving import ModelDeployment, ModelRouter
+        from backend.pipeline import (
+            transform, GradCAM, segment_leaf, calculate_severity, overlay_heatmap, OVERLAY_FORMATS, OVERLAY_MEDIA_TYPES
+        )
+        from backend.workers import prepare, render_heatmap
+        from backend import config
+
+try:
+    import orjson
+except ImportError:
+    # Optional: responses fall back to the standard json module
+    orjson = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Agriguard API", description="Plant Disease Detection API")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed."""
+
+    def render(self, content) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def _dumps_line(record: dict) -> bytes:
+    """One NDJSON line."""
+    if orjson is None:
+        return (json.dumps(record) + "\n").encode("utf-8")
+    return orjson.dumps(record, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+
+
+async def _start_inference():
+    """Loads the active model and warms up every worker; the app is ready once this finishes."""
+    try:
+        await _apply_routing()
+        logger.info("Agriguard API is ready")
+    except Exception as e:
+        logger.error(f"❌ Failed to start inference workers: {e}")
+        _record_load_error(e)
+
+
+async def _apply_routing() -> dict:
+    """
+    Brings the served models in line with the registry's routing.json:
+    hot-swaps the active model and loads, re-weights or drops the candidate
+    and the cascade's first stage.
+    """
+    global ready, model_error, MODEL_VERSION, _routing_stamp
+    _routing_stamp = await asyncio.to_thread(registry.routing_stamp)
+    routing = await asyncio.to_thread(registry.routing)
+
+    await router.activate(await asyncio.to_thread(registry.active_spec))
+    MODEL_VERSION = router.active.version
+    ready, model_error = True, None
+
+    if routing["candidate"] is not None:
+        spec = await asyncio.to_thread(registry.spec, routing["candidate"])
+        await router.set_candidate(spec, routing["percent"], routing["mode"])
+    elif router.candidate is not None:
+        await router.clear_candidate()
+
+    cascade = routing["cascade"]
+    if cascade is not None:
+        spec = await asyncio.to_thread(registry.spec, cascade["version"])
+        await router.set_cascade(spec, cascade["threshold"], cascade["escalate"])
+    elif router.first_stage is not None:
+        await router.clear_cascade()
+    return routing
+
+
+async def _watch_registry():
+    """Polls routing.json and applies it whenever it is rewritten (CLI, admin API or another replica)."""
+    while True:
+        await asyncio.sleep(config.MODEL_WATCH_SECONDS)
+        stamp = await asyncio.to_thread(registry.routing_stamp)
+        if stamp == _routing_stamp:
+            continue
+        logger.info("Model routing changed; applying it")
+        try:
+            await _apply_routing()
+        except Exception as e:
+            logger.error(f"Failed to apply model routing: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global _startup_task, _watch_task
+    cache.load()
+    await asyncio.to_thread(uploads.load)
+    if ledger is not None:
+        try:
+            await asyncio.to_thread(ledger.open)
+        except Exception as e:
+            # Diagnoses are still served; /verify answers 503 until this is fixed
+            logger.error(f"❌ Integrity ledger unavailable: {e}")
+    if config.PROFILER_ENABLED:
+        profiler.start()
+    if config.MODEL_BACKGROUND_LOAD:
+        _startup_task = asyncio.create_task(_start_inference())
+    else:
+        await _start_inference()
+    if config.MODEL_WATCH_SECONDS > 0:
+        _watch_task = asyncio.create_task(_watch_registry())
+    yield
+    for task in (_startup_task, _watch_task):
+        if task is not None and not task.done():
+            task.cancel()
+    await router.stop()
+    profiler.stop()
+    cache.save()
+    if ledger is not None:
+        await asyncio.to_thread(ledger.close)
+
+
+app = FastAPI(
+    title="Agriguard API",
+    description="Plant Disease Detection API",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
+)
 
 # CORS Setup
 app.add_middleware(
@@ -36,185 +195,306 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-import os
-
-# =============================================================
-# MODEL SETUP (EfficientNetV2-S)
-# =============================================================
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_PATH = os.path.join(BASE_DIR, "models", "plant_disease_model.pth")
-CLASS_NAMES = [
-    'Apple___Apple_scab', 'Apple___Black_rot', 'Apple___Cedar_apple_rust', 'Apple___healthy',
-    'Blueberry___healthy', 'Cherry_(including_sour)___Powdery_mildew', 'Cherry_(including_sour)___healthy',
-    'Corn_(maize)___Cercospora_leaf_spot Gray_leaf_spot', 'Corn_(maize)___Common_rust_', 'Corn_(maize)___Northern_Leaf_Blight', 'Corn_(maize)___healthy',
-    'Grape___Black_rot', 'Grape___Esca_(Black_Measles)', 'Grape___Leaf_blight_(Isariopsis_Leaf_Spot)', 'Grape___healthy',
-    'Orange___Haunglongbing_(Citrus_greening)', 'Peach___Bacterial_spot', 'Peach___healthy',
-    'Pepper,_bell___Bacterial_spot', 'Pepper,_bell___healthy',
-    'Potato___Early_blight', 'Potato___Late_blight', 'Potato___healthy',
-    'Raspberry___healthy',
-    'Soybean___healthy',
-    'Squash___Powdery_mildew',
-    'Strawberry___Leaf_scorch', 'Strawberry___healthy',
-    'Tomato___Bacterial_spot', 'Tomato___Early_blight', 'Tomato___Late_blight', 'Tomato___Leaf_Mold',
-    'Tomato___Septoria_leaf_spot', 'Tomato___Spider_mites_Two-spotted_spider_mite', 'Tomato___Target_Spot',
-    'Tomato___Tomato_Yellow_Leaf_Curl_Virus', 'Tomato___Tomato_mosaic_virus', 'Tomato___healthy'
-]
-
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 logger.info(f"Using device: {device}")
 
-try:
-    logger.info(f"Loading model from {MODEL_PATH}...")
-    
-    # Instantiate Architecture
-    model = models.efficientnet_v2_s(weights=None)
-    # Adjust Classifier Head
-    model.classifier[1] = nn.Linear(model.classifier[1].in_features, len(CLASS_NAMES))
-    
-    # Load Weights
-    model.load_state_dict(torch.load(MODEL_PATH, map_location=device))
-    model.to(device)
-    model.eval()
-    
-    logger.info("✅ Custom Model loaded successfully.")
-except Exception as e:
-    logger.error(f"❌ Failed to load model: {e}")
+# Set once the active model is loaded during startup (see lifespan)
+MODEL_VERSION = None
+model_error = None
+ready = False
+_startup_task = None
+_watch_task = None
+_routing_stamp = None
+
+
+def _record_load_error(e):
+    global model_error
+    model_error = str(e)
     with open("backend_error.log", "w") as f:
         f.write(str(e))
-    model = None
-
-# Preprocessing Transform
-transform = transforms.Compose([
-    transforms.Resize((160, 160)),
-    transforms.ToTensor()
-])
-
-# Grad-CAM Implementation
-class GradCAM:
-    def __init__(self, model, target_layer):
-        self.model = model
-        self.target_layer = target_layer
-        self.gradients = None
-        self.activations = None
-        
-        self.target_layer.register_forward_hook(self.save_activation)
-        self.target_layer.register_full_backward_hook(self.save_gradient)
-
-    def save_activation(self, module, input, output):
-        self.activations = output
-
-    def save_gradient(self, module, grad_input, grad_output):
-        self.gradients = grad_output[0]
-
-    def generate_heatmap(self, input_tensor, class_idx):
-        # Zero grads
-        self.model.zero_grad()
-        
-        # Forward pass
-        output = self.model(input_tensor)
-        
-        # Backward pass
-        target = output[0][class_idx]
-        target.backward()
-        
-        # Pool gradients
-        pooled_gradients = torch.mean(self.gradients, dim=[0, 2, 3])
-        
-        # Weight activations
-        activations = self.activations.detach().cpu().numpy()[0]
-        for i in range(activations.shape[0]):
-            activations[i, :, :] *= pooled_gradients[i].item()
-            
-        # Average heatmap
-        heatmap = np.mean(activations, axis=0)
-        heatmap = np.maximum(heatmap, 0) # ReLU
-        
-        # Normalize
-        if np.max(heatmap) != 0:
-            heatmap /= np.max(heatmap)
-            
-        return heatmap
-
-def segment_leaf(image_np):
-    """
-    Segments the leaf from the background using HSV color space.
-    Returns a binary mask (0 or 1) where 1 is the leaf.
-    """
-    # Convert to HSV
-    hsv = cv2.cvtColor(image_np, cv2.COLOR_RGB2HSV)
-    
-    # Define range for greens (healthy)
-    lower_green = np.array([25, 40, 40])
-    upper_green = np.array([90, 255, 255])
-    mask_green = cv2.inRange(hsv, lower_green, upper_green)
-    
-    # Define range for browns/yellows (diseased)
-    lower_brown = np.array([10, 40, 40])
-    upper_brown = np.array([25, 255, 255])
-    mask_brown = cv2.inRange(hsv, lower_brown, upper_brown)
-    
-    # Combine masks
-    mask = cv2.bitwise_or(mask_green, mask_brown)
-    
-    # Morphological operations to close holes and remove noise
-    kernel = np.ones((5,5), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-    
-    # Normalize to 0-1
-    return mask // 255
-
-def calculate_severity(heatmap, leaf_mask, threshold=0.5):
-    """
-    Estimate severity based on the percentage of the LEAF area 
-    that has activation above the threshold.
-    """
-    # Resize leaf mask to match heatmap if needed (though heatmap is usually resized to img)
-    if leaf_mask.shape != heatmap.shape:
-        leaf_mask = cv2.resize(leaf_mask, (heatmap.shape[1], heatmap.shape[0]), interpolation=cv2.INTER_NEAREST)
-    
-    # Binarize heatmap
-    disease_mask = (heatmap > threshold).astype(np.float32)
-    
-    # Intersect disease with leaf (ignore background activations)
-    valid_disease = disease_mask * leaf_mask
-    
-    leaf_area = np.sum(leaf_mask)
-    disease_area = np.sum(valid_disease)
-    
-    if leaf_area == 0:
-        return 0.0
-        
-    severity_score = disease_area / leaf_area
-    return float(min(severity_score, 1.0)) # Cap at 100%
-
-def overlay_heatmap(image_bytes, heatmap, leaf_mask=None):
-    # Convert bytes to numpy array
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    # Resize heatmap to image size
-    heatmap = cv2.resize(heatmap, (img.shape[1], img.shape[0]))
-    
-    # Convert to RGB heatmap
-    heatmap = np.uint8(255 * heatmap)
-    heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-    
-    # Apply leaf mask to heatmap if provided (optional, makes it look cleaner)
-    if leaf_mask is not None:
-        leaf_mask_resized = cv2.resize(leaf_mask, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_NEAREST)
-        # Expand dims for broadcasting
-        leaf_mask_3ch = np.stack([leaf_mask_resized]*3, axis=-1)
-        heatmap = heatmap * leaf_mask_3ch
-    
-    # Overlay
-    superimposed_img = heatmap * 0.4 + img
-    superimposed_img = np.clip(superimposed_img, 0, 255).astype(np.uint8)
-    
-    # Encode back to base64
-    _, buffer = cv2.imencode('.jpg', superimposed_img)
-    img_str = base64.b64encode(buffer).decode('utf-8')
-    return img_str
+
+
+def _require_ready():
+    if ready and router.active is not None:
+        return
+    if model_error is None:
+        MODEL_NOT_LOADED.inc(reason="loading")
+        raise HTTPException(status_code=503, detail="Model is loading", headers={"Retry-After": "5"})
+    MODEL_NOT_LOADED.inc(reason="failed")
+    raise HTTPException(status_code=503, detail="Model not loaded")
+
+
+def _require_admin(token, required: bool = False):
+    """
+    Checks the X-Admin-Token header. Endpoints that change what is served
+    pass `required`: they stay disabled until a token is configured.
+    """
+    if required and not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Disabled; set AGRIGUARD_ADMIN_TOKEN to enable it")
+    if config.ADMIN_TOKEN and token != config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+# Versioned checkpoints and the routing.json that says which of them serve
+registry = ModelRegistry(config.MODEL_REGISTRY_DIR)
+
+
+def _deploy(spec, role: str) -> ModelDeployment:
+    """
+    A worker pool and batch schedulers for one model version. Decoding,
+    inference and Grad-CAM run on the pool, never on the event loop.
+    """
+    deployment = ModelDeployment(
+        spec,
+        kind=config.WORKER_KIND,
+        workers={"active": config.WORKERS, "first_stage": config.CASCADE_WORKERS}.get(role, config.CANDIDATE_WORKERS),
+        device=device,
+        engine=config.ENGINE,
+        # AGRIGUARD_ENGINE_PATH names the legacy checkpoint's artifact;
+        # registered versions keep their exported engines beside their weights
+        engine_path=config.ENGINE_PATH if spec.legacy else None,
+        max_batch_size=config.BATCH_MAX_SIZE,
+        max_wait_ms=config.BATCH_MAX_WAIT_MS,
+    )
+    _register_batch_metrics(deployment)
+    return deployment
+
+
+def _retire(deployment: ModelDeployment) -> None:
+    metrics.unregister(*deployment.metrics)
+
+
+# Requests are routed to the active model (or a canary candidate); swaps
+# load the new model beside the old one and drain the old one afterwards
+router = ModelRouter(_deploy, _retire, drain_seconds=config.MODEL_DRAIN_SECONDS)
+
+# Re-uploads of the same photo are answered from here without inference
+cache = PredictionCache(
+    max_entries=config.CACHE_MAX_ENTRIES,
+    max_bytes=int(config.CACHE_MAX_MB * 1024 * 1024),
+    ttl_seconds=config.CACHE_TTL_SECONDS,
+    persist_path=config.CACHE_PATH,
+)
+
+# Uploads wait here until someone asks for their explanation or overlay image
+uploads = UploadStore(
+    max_bytes=int(config.UPLOAD_STORE_MAX_MB * 1024 * 1024),
+    directory=config.UPLOAD_STORE_DIR,
+    max_disk_bytes=int(config.UPLOAD_STORE_DISK_MAX_MB * 1024 * 1024),
+    ttl_seconds=config.UPLOAD_STORE_TTL_SECONDS,
+)
+
+# Every diagnosis served, for checking an integrity hash against what was
+# actually diagnosed (GET /verify/{hash}) and for outbreak reports (GET /ledger)
+ledger = IntegrityLedger(
+    config.LEDGER_PATH,
+    commit_interval_ms=config.LEDGER_COMMIT_MS,
+    commit_max_records=config.LEDGER_COMMIT_MAX,
+    max_pending=config.LEDGER_MAX_PENDING,
+    fsync=config.LEDGER_FSYNC,
+) if config.LEDGER_PATH else None
+
+# Bounds the inference jobs running and queued; uploads beyond that are
+# turned away with Retry-After instead of waiting until their clients give up
+admission = AdmissionController(
+    max_in_flight=config.ADMISSION_MAX_IN_FLIGHT,
+    max_queue=config.ADMISSION_MAX_QUEUE,
+    degrade_depth=config.DEGRADE_QUEUE_DEPTH,
+)
+rate_limiter = RateLimiter(config.RATE_LIMIT_PER_SECOND, config.RATE_LIMIT_BURST)
+
+# Explanations currently being computed, so concurrent requests share one run
+_explaining = {}
+
+# Camera feeds connected to /stream
+_streams = set()
+
+# Rendered heatmap overlays, keyed by model version, hash, format, size and quality
+overlays = UploadStore(max_bytes=int(config.HEATMAP_STORE_MAX_MB * 1024 * 1024))
+
+# How a response carries the heatmap: a URL to the binary overlay, the raw
+# low-resolution grid and leaf mask (for client-side rendering), or the legacy base64 JPEG
+HeatmapMode = Literal["url", "grid", "b64"]
+
+# Upload limits (bytes); bodies declaring more are refused before being read
+UPLOAD_MAX_BYTES = int(config.UPLOAD_MAX_MB * 1024 * 1024)
+BATCH_UPLOAD_MAX_BYTES = int(config.BATCH_UPLOAD_MAX_MB * 1024 * 1024)
+UPLOAD_CHUNK_SIZE = config.UPLOAD_CHUNK_KB * 1024
+# Room for the multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
+UPLOAD_ROUTES = {
+    "/predict": UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD,
+    "/classify": UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD,
+    "/predict/batch": BATCH_UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD,
+}
+# Endpoints that may run inference: rate limited, shed under overload and given a deadline
+ADMISSION_ROUTES = ("/predict", "/classify", "/predict/batch")
+ADMISSION_PREFIXES = ("/explain/", "/heatmap/")
+
+# =============================================================
+# METRICS (Prometheus text on /metrics)
+# =============================================================
+metrics = Registry()
+
+STAGE_SECONDS = metrics.register(
+    "agriguard_stage_duration_seconds", "Time spent in each pipeline stage.", LabeledHistogram("stage")
+)
+REQUEST_SECONDS = metrics.register(
+    "agriguard_request_duration_seconds", "Request latency by endpoint.", LabeledHistogram("endpoint")
+)
+REQUESTS_IN_FLIGHT = metrics.register(
+    "agriguard_requests_in_flight", "Requests currently being handled, by endpoint.", Gauge(["endpoint"])
+)
+MODEL_NOT_LOADED = metrics.register(
+    "agriguard_model_not_loaded_total", "Requests rejected because the model was loading or failed to load.",
+    Counter(["reason"]),
+)
+XAI_FAILURES = metrics.register(
+    "agriguard_xai_failures_total", "Heatmap overlays that failed to render.", Counter()
+)
+PREDICTIONS = metrics.register(
+    "agriguard_predictions_total", "Predictions served, by predicted label, tier and model version.",
+    Counter(["label", "tier", "model_version"]),
+)
+SHADOW_PREDICTIONS = metrics.register(
+    "agriguard_shadow_predictions_total",
+    "Shadow runs of the candidate model, by whether its label agreed with the active model's.",
+    Counter(["model_version", "outcome"]),
+)
+DEGRADED_RESPONSES = metrics.register(
+    "agriguard_degraded_responses_total", "Predictions served without Grad-CAM because the queue was deep.",
+    Counter(),
+)
+CASCADE_DECISIONS = metrics.register(
+    "agriguard_cascade_decisions_total", "Cascade results, by the stage that decided them and tier.",
+    Counter(["stage", "tier"]),
+)
+STREAM_FRAMES = metrics.register(
+    "agriguard_stream_frames_total",
+    "Camera stream frames, by outcome (processed, dropped as stale, rejected, failed).",
+    Counter(["outcome"]),
+)
+STREAM_EXPLANATIONS = metrics.register(
+    "agriguard_stream_explanations_total",
+    "Grad-CAM runs on camera stream frames, by trigger (client request or change to a disease).",
+    Counter(["trigger"]),
+)
+metrics.register("agriguard_stream_connections", "Camera streams connected.", Callback(lambda: len(_streams)))
+metrics.register("agriguard_model_ready", "1 once the model and every worker are loaded.", Callback(lambda: int(ready)))
+metrics.register(
+    "agriguard_model_info", "Model versions being served, by role.",
+    Callback(
+        lambda: {
+            (deployment.version, role): 1
+            for role, deployment in (
+                ("active", router.active), ("candidate", router.candidate), ("first_stage", router.first_stage)
+            )
+            if deployment is not None
+        },
+        labelnames=("model_version", "role"),
+    ),
+)
+metrics.register("agriguard_model_swaps_total", "Active model hot-swaps.", Callback(lambda: router.swaps, "counter"))
+
+
+def _register_batch_metrics(deployment: ModelDeployment) -> None:
+    """Batching metrics of one model version; `_retire` drops them again."""
+    for name, scheduler in (("explain", deployment.batcher), ("classify", deployment.classify_batcher)):
+        labels = dict(batcher=name, model_version=deployment.version)
+        deployment.metrics += [
+            metrics.register("agriguard_batch_size", "Images per forward pass.", scheduler.batch_sizes, **labels),
+            metrics.register(
+                "agriguard_batch_queue_wait_seconds", "Time an image waited for its batch.", scheduler.queue_wait,
+                **labels,
+            ),
+            metrics.register(
+                "agriguard_batch_duration_seconds", "Time to run one batch on a worker.", scheduler.batch_latency,
+                **labels,
+            ),
+            metrics.register(
+                "agriguard_batch_queue_depth", "Images waiting for a batch.",
+                Callback(lambda s=scheduler: s.stats()["queue_depth"]), **labels,
+            ),
+        ]
+
+
+metrics.register("agriguard_cache_hits_total", "Prediction cache hits.", Callback(lambda: cache.hits, "counter"))
+metrics.register("agriguard_cache_misses_total", "Prediction cache misses.", Callback(lambda: cache.misses, "counter"))
+metrics.register(
+    "agriguard_cache_entries", "Entries in the prediction cache.", Callback(lambda: cache.stats()["entries"])
+)
+metrics.register(
+    "agriguard_cache_bytes", "Approximate size of the prediction cache.", Callback(lambda: cache.stats()["bytes"])
+)
+metrics.register(
+    "agriguard_admission_in_flight", "Inference jobs holding an admission slot.",
+    Callback(lambda: admission.in_flight),
+)
+metrics.register(
+    "agriguard_admission_queue_depth", "Inference jobs waiting for an admission slot.",
+    Callback(lambda: admission.queue_depth),
+)
+metrics.register(
+    "agriguard_admission_admitted_total", "Inference jobs admitted.", Callback(lambda: admission.admitted, "counter")
+)
+metrics.register(
+    "agriguard_admission_shed_total", "Requests turned away or cancelled, by reason.",
+    Callback(lambda: {(reason,): n for reason, n in admission.shed.items()}, "counter", labelnames=("reason",)),
+)
+metrics.register(
+    "agriguard_admission_queue_wait_seconds", "Time an inference job waited for a slot.", admission.queue_wait
+)
+metrics.register(
+    "agriguard_admission_degraded", "1 while the queue is deep enough that Grad-CAM is skipped.",
+    Callback(lambda: int(admission.degraded)),
+)
+if ledger is not None:
+    metrics.register("agriguard_ledger_records", "Records in the integrity ledger.", Callback(lambda: len(ledger)))
+    metrics.register(
+        "agriguard_ledger_pending_records", "Ledger records waiting to be committed to disk.",
+        Callback(lambda: ledger.stats()["pending"]),
+    )
+    metrics.register(
+        "agriguard_ledger_dropped_total", "Ledger records dropped because the disk fell too far behind.",
+        Callback(lambda: ledger.dropped, "counter"),
+    )
+    metrics.register(
+        "agriguard_ledger_write_errors_total", "Failed ledger commits (retried).",
+        Callback(lambda: ledger.write_errors, "counter"),
+    )
+    metrics.register(
+        "agriguard_ledger_commit_duration_seconds", "Time to write and fsync one ledger commit.",
+        ledger.commit_latency,
+    )
+    metrics.register("agriguard_ledger_commit_size", "Records per ledger commit.", ledger.commit_sizes)
+
+# Off unless enabled in config or via POST /debug/profiler
+profiler = SamplingProfiler(
+    interval=config.PROFILER_INTERVAL_MS / 1000,
+    slow_seconds=config.PROFILER_SLOW_MS / 1000,
+)
+
+# Endpoints whose latency isn't worth tracking
+UNTRACKED_ENDPOINTS = ("/metrics", "/health", "/health/live", "/health/ready", "/debug/profiler")
+
+
+def _observe_stages(timings: dict) -> None:
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def _respond(result: BaseModel) -> JSONResponse:
+    """Serializes a response model, timed as the "serialize" stage."""
+    with STAGE_SECONDS.labels("serialize").time():
+        return FastJSONResponse(result.model_dump())
+
+
+def _route_path(scope) -> str:
+    """The route template a request matches (e.g. /explain/{file_hash}), so metrics stay low-cardinality."""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return None
 
 
 class PredictionResult(BaseModel):
@@ -223,91 +503,1030 @@ class PredictionResult(BaseModel):
     prediction: str
     confidence: float
     recommendation: str
+    model_version: str = None
+    # Set when Grad-CAM was skipped under load; the heatmap is at explain_url
+    degraded: bool = None
+    explain_url: str = None
     heatmap_b64: str = None
+    heatmap_url: str = None
+    heatmap_grid: List[List[float]] = None
+    leaf_mask: List[List[int]] = None
     severity: float = None
 
 
+class ClassificationResult(BaseModel):
+    filename: str
+    integrity_hash: str
+    prediction: str
+    confidence: float
+    recommendation: str
+    explain_url: str
+    model_version: str = None
+
+
+class ExplanationResult(BaseModel):
+    integrity_hash: str
+    prediction: str
+    confidence: float
+    model_version: str = None
+    heatmap_b64: str = None
+    heatmap_url: str = None
+    heatmap_grid: List[List[float]] = None
+    leaf_mask: List[List[int]] = None
+    severity: float = None
+
+
+# Shadow runs in progress (bounded by SHADOW_MAX_PENDING)
+_shadowing = set()
+
+
+def _shadow(file_hash: str, input_tensor, label: str) -> None:
+    """Re-runs an upload on the shadow candidate in the background and counts whether it agrees."""
+    candidate = router.shadow(file_hash)
+    if candidate is None:
+        return
+    if len(_shadowing) >= config.SHADOW_MAX_PENDING:
+        SHADOW_PREDICTIONS.inc(model_version=candidate.version, outcome="skipped")
+        return
+    task = asyncio.create_task(_run_shadow(candidate, input_tensor, label))
+    _shadowing.add(task)
+    task.add_done_callback(_shadowing.discard)
+
+
+async def _run_shadow(candidate: ModelDeployment, input_tensor, label: str) -> None:
+    async with candidate.serving():
+        try:
+            output = await candidate.classify(input_tensor)
+            outcome = "agree" if output.prediction == label else "disagree"
+        except Exception as e:
+            logger.warning(f"Shadow prediction on model {candidate.version} failed: {e}")
+            outcome = "failed"
+    SHADOW_PREDICTIONS.inc(model_version=candidate.version, outcome=outcome)
+
+
+def _observe_output(output, tier: str) -> None:
+    _observe_stages(output.timings)
+    if output.stage is not None:
+        CASCADE_DECISIONS.inc(stage=output.stage, tier=tier)
+
+
+def _record_diagnosis(result: dict, tier: str, deployment: ModelDeployment) -> None:
+    """Counts a served diagnosis, fresh or from the cache."""
+    model_version = result.get("model_version", deployment.version)
+    PREDICTIONS.inc(label=result["prediction"], tier=tier, model_version=model_version)
+
+
+def _ledger_diagnosis(result: dict, tier: str) -> None:
+    """
+    Queues a freshly computed diagnosis for the integrity ledger (never waits
+    for the disk). Answers served from the cache are not recorded again, so
+    ledger counts are diagnoses made, not responses sent.
+    """
+    if ledger is not None:
+        ledger.append(
+            result["integrity_hash"], result["model_version"], result["prediction"], result["confidence"],
+            severity=result.get("severity"), tier=tier,
+        )
+
+
+def _rejection(e: Rejected) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+async def _infer(request: Request, work, bounded: bool = True):
+    """
+    Runs `work()`, a coroutine function doing inference, under an admission
+    slot. Gives up with 504 at the request's deadline and cancels the work,
+    queued or running, as soon as the client disconnects.
+    """
+    deadline = getattr(request.state, "deadline", None) or time.monotonic() + config.REQUEST_TIMEOUT_SECONDS
+
+    async def admitted():
+        timeout = min(config.ADMISSION_QUEUE_TIMEOUT_SECONDS, deadline - time.monotonic())
+        async with admission.slot(timeout, bounded):
+            return await work()
+
+    task = asyncio.ensure_future(admitted())
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait(
+            {task, disconnected}, timeout=max(0.0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+        )
+        if task in done:
+            try:
+                return task.result()
+            except Rejected as e:
+                raise _rejection(e)
+        if disconnected in done:
+            admission.count_shed("disconnected")
+            # Nobody reads this; 499 is nginx's "client closed request", for the logs
+            raise HTTPException(status_code=499, detail="Client disconnected")
+        admission.count_shed("deadline")
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    finally:
+        for pending in (task, disconnected):
+            if not pending.done():
+                pending.cancel()
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    """Returns once the client has gone away (the upload has been read, so nothing else is received)."""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _run_prediction(deployment: ModelDeployment, contents: bytes, file_hash: str) -> dict:
+    """
+    Full pipeline: classification, Grad-CAM and severity. Caches the result
+    with the raw heatmap grid; the overlay image is rendered on request
+    (/heatmap/{hash}.webp) from the stored upload.
+    """
+    # 2. Decode once & Preprocess (on a pool worker)
+    input_tensor, _, timings = await deployment.executor.run(prepare, contents, False)
+    _observe_stages(timings)
+    return await _explain_input(deployment, input_tensor, contents, file_hash)
+
+
+async def _explain_input(deployment: ModelDeployment, input_tensor, contents: bytes, file_hash: str) -> dict:
+    """Steps 3-4 of `_run_prediction`, for an upload that is already preprocessed."""
+    # 3. Inference + Grad-CAM + Severity in one pass (batched with other in-flight requests)
+    output = await deployment.explain(input_tensor)
+    _observe_output(output, "explain")
+    _shadow(file_hash, input_tensor, output.prediction)
+
+    # 4. Recommendation
+    recommendation = get_recommendation(output.prediction)
+
+    result = dict(
+        integrity_hash=file_hash,
+        prediction=output.prediction,
+        confidence=output.confidence,
+        recommendation=recommendation,
+        model_version=output.model_version,
+        heatmap_grid=np.round(output.heatmap, 4).tolist(),
+        # Model-resolution leaf mask, so clients drawing the grid mask it like the server's overlay
+        leaf_mask=np.asarray(output.leaf_mask, dtype=np.uint8).tolist(),
+        severity=float(output.severity)
+    )
+
+    cache.put(PredictionCache.make_key(file_hash, deployment.version), result)
+    await uploads.put(file_hash, contents)
+    _ledger_diagnosis(result, "explain")
+    return result
+
+
+def _cached_prediction(deployment: ModelDeployment, file_hash: str, count: bool = True):
+    """Cached full result for an upload, ignoring entries from before heatmap grids were stored."""
+    cached = cache.get(PredictionCache.make_key(file_hash, deployment.version), count=count)
+    if cached is None or "heatmap_grid" not in cached:
+        return None
+    return cached
+
+
+def _heatmap_url(file_hash: str) -> str:
+    return f"/heatmap/{file_hash}.{config.HEATMAP_FORMAT}"
+
+
+def _overlay_key(deployment: ModelDeployment, file_hash: str, fmt: str, max_side: int, quality: int) -> str:
+    return f"{deployment.version}:{file_hash}:{fmt}:{max_side}:{quality}"
+
+
+async def _explained_overlay(deployment: ModelDeployment, file_hash: str, fmt: str, quality: int, max_side: int):
+    """Overlay for a stored upload, running Grad-CAM first if it has only been classified."""
+    cached = _cached_prediction(deployment, file_hash)
+    if cached is None:
+        cached = await _explain_hash(deployment, file_hash)
+    return await _render_overlay(deployment, file_hash, cached["heatmap_grid"], fmt, quality, max_side)
+
+
+async def _render_overlay(deployment: ModelDeployment, file_hash: str, heatmap_grid, fmt: str, quality: int,
+                          max_side: int):
+    """Encoded overlay for a stored upload (memoized), or None if the upload is gone or rendering fails."""
+    key = _overlay_key(deployment, file_hash, fmt, max_side, quality)
+    body = await overlays.get(key)
+    if body is not None:
+        return body
+
+    contents = await uploads.get(file_hash)
+    if contents is None:
+        return None
+    try:
+        with STAGE_SECONDS.labels("overlay").time():
+            body = await deployment.executor.run(render_heatmap, contents, heatmap_grid, fmt, quality, max_side)
+    except Exception as e:
+        logger.error(f"Grad-CAM overlay failed: {e}")
+        XAI_FAILURES.inc()
+        return None
+    await overlays.put(key, body)
+    return body
+
+
+async def _heatmap_fields(deployment: ModelDeployment, result: dict, heatmap: str, contents: bytes = None) -> dict:
+    """
+    Severity and heatmap fields of a response, with the heatmap in the
+    requested form. Overlays are rendered from the stored upload, so when
+    the caller has the upload's bytes (`contents`) they are stored again:
+    a cached answer then never links to an upload that was evicted.
+    """
+    if "heatmap_grid" not in result:
+        return {}
+    if contents is not None:
+        await uploads.put(result["integrity_hash"], contents)
+    fields = dict(severity=result["severity"], heatmap_url=_heatmap_url(result["integrity_hash"]))
+    if heatmap == "grid":
+        fields["heatmap_grid"] = result["heatmap_grid"]
+        # Missing from results cached before masks were kept; clients then use heatmap_url
+        fields["leaf_mask"] = result.get("leaf_mask")
+    elif heatmap == "b64":
+        # Legacy form: full working resolution JPEG, embedded in the JSON
+        body = await _render_overlay(deployment, result["integrity_hash"], result["heatmap_grid"], "jpg", 95, 0)
+        fields["heatmap_b64"] = base64.b64encode(body).decode("utf-8") if body is not None else None
+    return fields
+
+
+def _base_fields(result: dict, deployment: ModelDeployment) -> dict:
+    fields = {key: result[key] for key in ("integrity_hash", "prediction", "confidence", "recommendation")}
+    # Under a cascade the deciding model is either stage; entries cached
+    # before versions were recorded came from the deployment itself
+    fields["model_version"] = result.get("model_version", deployment.version)
+    return fields
+
+
+async def _run_classification(deployment: ModelDeployment, contents: bytes, file_hash: str) -> dict:
+    """Label, confidence and recommendation only. Keeps the upload for a later /explain."""
+    input_tensor, _, timings = await deployment.executor.run(prepare, contents, False)
+    _observe_stages(timings)
+    output = await deployment.classify(input_tensor)
+    _observe_output(output, "classify")
+    _shadow(file_hash, input_tensor, output.prediction)
+
+    result = dict(
+        integrity_hash=file_hash,
+        prediction=output.prediction,
+        confidence=output.confidence,
+        recommendation=get_recommendation(output.prediction),
+        model_version=output.model_version,
+    )
+    cache.put(PredictionCache.make_key(file_hash, deployment.version) + ":classify", result)
+    await uploads.put(file_hash, contents)
+    _ledger_diagnosis(result, "classify")
+    return result
+
+
+async def _classified(request: Request, deployment: ModelDeployment, contents: bytes, file_hash: str) -> dict:
+    """Cached (full or classification-only) result, or a fresh classification."""
+    key = PredictionCache.make_key(file_hash, deployment.version)
+    cached = cache.get(key, key + ":classify")
+    if cached is None:
+        cached = await _infer(request, lambda: _run_classification(deployment, contents, file_hash))
+    return cached
+
+
+async def _explain_hash(deployment: ModelDeployment, file_hash: str) -> dict:
+    """Computes (once, even under concurrent requests) the full result for a stored upload."""
+    key = PredictionCache.make_key(file_hash, deployment.version)
+    pending = _explaining.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    contents = await uploads.get(file_hash)
+    if contents is None:
+        raise HTTPException(status_code=404, detail="Unknown image hash; upload it again via /classify or /predict")
+
+    task = asyncio.ensure_future(_run_prediction(deployment, contents, file_hash))
+    _explaining[key] = task
+    task.add_done_callback(lambda _: _explaining.pop(key, None))
+    return await asyncio.shield(task)
+
+
+async def _batch_item(work, timeout: float):
+    """
+    Runs the inference of one batch image under an admission slot. The batch
+    as a whole was admitted, so its images queue without a bound, but each
+    one gives up (504) once its own deadline has passed.
+    """
+    deadline = time.monotonic() + timeout
+    async with admission.slot(timeout, bounded=False):
+        try:
+            return await asyncio.wait_for(work(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise admission.reject("deadline", "Image deadline exceeded", status_code=504)
+
+
+async def _predict_one(filename: str, contents: bytes, explain: bool = True, heatmap: str = "url",
+                       timeout: float = config.REQUEST_TIMEOUT_SECONDS) -> dict:
+    """Prediction for one image of a batch request, as a PredictionResult dict."""
+    with STAGE_SECONDS.labels("hash").time():
+        file_hash = calculate_sha256(contents)
+    deployment = router.route(file_hash)
+    async with deployment.serving():
+        key = PredictionCache.make_key(file_hash, deployment.version)
+        # A degraded lookup falls back to the classify entry below, which counts the miss
+        result = _cached_prediction(deployment, file_hash, count=not admission.degraded) if explain else None
+        degraded = explain and result is None and admission.degraded
+        if explain and not degraded:
+            if result is None:
+                result = await _batch_item(lambda: _run_prediction(deployment, contents, file_hash), timeout)
+            fields = await _heatmap_fields(deployment, result, heatmap, contents)
+        else:
+            result = cache.get(key, key + ":classify")
+            if result is None:
+                result = await _batch_item(lambda: _run_classification(deployment, contents, file_hash), timeout)
+            fields = dict(degraded=True, explain_url=f"/explain/{file_hash}") if degraded else {}
+    if degraded:
+        DEGRADED_RESPONSES.inc()
+    _record_diagnosis(result, "explain" if explain and not degraded else "classify", deployment)
+    return PredictionResult(filename=filename, **_base_fields(result, deployment), **fields).model_dump()
+
+
 @app.get("/")
 async def root():
     return {"message": "Agriguard API is running (Custom Model)"}
 
+@app.get("/health/live")
+async def liveness():
+    """The process is up and serving requests (model may still be loading)."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """200 once the model and every worker replica are loaded, 503 until then."""
+    if not ready:
+        status = "loading" if model_error is None else "failed"
+        return JSONResponse(
+            status_code=503,
+            content={"status": status, "error": model_error},
+            headers={"Retry-After": "5"},
+        )
+    return {"status": "ready", "model_version": MODEL_VERSION}
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "model_loaded": model is not None, "device": str(device)}
+    active = router.active
+    return {
+        "status": "healthy",
+        "ready": ready,
+        "model_loaded": active is not None,
+        "device": str(device),
+        "model_version": MODEL_VERSION,
+        "workers": active.executor.stats() if active is not None else None,
+        "batching": active.batcher.stats() if active is not None else None,
+        "classify_batching": active.classify_batcher.stats() if active is not None else None,
+        "models": router.stats(),
+        "cache": cache.stats(),
+        "uploads": uploads.stats(),
+        "ledger": ledger.stats() if ledger is not None else None,
+        "admission": admission.stats(),
+        "rate_limit": rate_limiter.stats() if rate_limiter.enabled else None,
+        "streams": len(_streams),
+    }
 
 @app.post("/predict", response_model=PredictionResult)
-async def predict(file: UploadFile = File(...)):
-    if not model:
-        raise HTTPException(status_code=503, detail="Model not loaded")
+async def predict(request: Request, file: UploadFile = File(...), explain: bool = True, heatmap: HeatmapMode = "url"):
+    """
+    Classification, severity and Grad-CAM heatmap. The heatmap comes as
+    `heatmap_url` (a binary overlay image), plus the raw grid and leaf mask
+    with `heatmap=grid` or the legacy embedded JPEG with `heatmap=b64`. While the
+    inference queue is deep, Grad-CAM is skipped (`degraded`) and can be
+    fetched later from `explain_url`.
+    """
+    if not explain:
+        result = await _classify(request, file)
+        return _respond(PredictionResult(**result.model_dump(exclude={"explain_url"})))
+
+    _require_ready()
 
     try:
-        # Read file content
-        contents = await file.read()
-        
-        # 1. Integrity Check
-        file_hash = calculate_sha256(contents)
+        # Stream the upload in chunks; 1. Integrity Check (hashed as it arrives)
+        with STAGE_SECONDS.labels("read").time():
+            contents, file_hash = await read_upload(file, UPLOAD_MAX_BYTES, chunk_size=UPLOAD_CHUNK_SIZE)
         logger.info(f"File hash: {file_hash}")
 
-        # 2. Load & Preprocess Image
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-        # Keep original numpy for segmentation
-        image_np = np.array(image)
-        
-        input_tensor = transform(image).unsqueeze(0).to(device) # Add batch dimension
-
-        # 3. Inference
-        with torch.no_grad():
-            outputs = model(input_tensor)
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            top_prob, top_idx = probabilities.max(1)
-            
-            score = top_prob.item()
-            label_idx = top_idx.item()
-            label = CLASS_NAMES[label_idx]
-
-        # 4. Grad-CAM & Severity
-        heatmap_b64 = None
-        severity = 0.0
-        
-        try:
-            # Initialize GradCAM with the last feature layer
-            # EfficientNetV2-S features are in model.features
-            target_layer = model.features[-1] 
-            grad_cam = GradCAM(model, target_layer)
-            
-            # Generate Heatmap
-            heatmap = grad_cam.generate_heatmap(input_tensor, label_idx)
-            
-            # Segment Leaf
-            leaf_mask = segment_leaf(image_np)
-            
-            # Calculate Severity (Relative to Leaf Area)
-            severity = calculate_severity(heatmap, leaf_mask)
-            
-            # Create Overlay
-            heatmap_b64 = overlay_heatmap(contents, heatmap, leaf_mask)
-            
-        except Exception as e:
-            logger.error(f"Grad-CAM/Severity failed: {e}")
-            # Don't fail the whole request if XAI fails
+        deployment = router.route(file_hash)
+        async with deployment.serving():
+            cached = _cached_prediction(deployment, file_hash, count=not admission.degraded)
+            degraded = cached is None and admission.degraded
+            if degraded:
+                # Answer like /classify now; the heatmap is computed if someone asks for it
+                cached = await _classified(request, deployment, contents, file_hash)
+                fields = dict(degraded=True, explain_url=f"/explain/{file_hash}")
+            else:
+                if cached is None:
+                    cached = await _infer(request, lambda: _run_prediction(deployment, contents, file_hash))
+                fields = await _heatmap_fields(deployment, cached, heatmap, contents)
+
+        if degraded:
+            DEGRADED_RESPONSES.inc()
+        _record_diagnosis(cached, "classify" if degraded else "explain", deployment)
+        return _respond(PredictionResult(filename=file.filename, **_base_fields(cached, deployment), **fields))
+
+    except HTTPException:
+        raise
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error processing image: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/classify", response_model=ClassificationResult)
+async def classify(request: Request, file: UploadFile = File(...)):
+    """Fast path: label, confidence and recommendation without Grad-CAM or severity."""
+    return _respond(await _classify(request, file))
+
+async def _classify(request: Request, file: UploadFile) -> ClassificationResult:
+    _require_ready()
+
+    try:
+        with STAGE_SECONDS.labels("read").time():
+            contents, file_hash = await read_upload(file, UPLOAD_MAX_BYTES, chunk_size=UPLOAD_CHUNK_SIZE)
+        logger.info(f"File hash: {file_hash}")
 
-        # 5. Recommendation
-        recommendation = get_recommendation(label)
+        deployment = router.route(file_hash)
+        async with deployment.serving():
+            cached = await _classified(request, deployment, contents, file_hash)
 
-        return PredictionResult(
+        _record_diagnosis(cached, "classify", deployment)
+        return ClassificationResult(
             filename=file.filename,
+            explain_url=f"/explain/{file_hash}",
+            **_base_fields(cached, deployment),
+        )
+
+    except HTTPException:
+        raise
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error processing image: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request, files: List[UploadFile] = File(...), explain: bool = True,
+                        heatmap: HeatmapMode = "url"):
+    """
+    Many images in one request: plain image files and/or zip/tar archives of them.
+    Results stream back as NDJSON, one PredictionResult per line (plus its
+    `index` in upload order) as soon as each image finishes. Every image
+    gets the request timeout (or X-Request-Timeout) as its own deadline.
+    """
+    _require_ready()
+
+    images = []
+    budget = BATCH_UPLOAD_MAX_BYTES
+    for file in files:
+        try:
+            with STAGE_SECONDS.labels("read").time():
+                contents, _ = await read_upload(file, budget, allow_archives=True, chunk_size=UPLOAD_CHUNK_SIZE)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+
+        if is_archive(file.filename, contents):
+            try:
+                members = await asyncio.to_thread(
+                    extract_images, file.filename, contents, config.BATCH_UPLOAD_MAX_IMAGES,
+                    UPLOAD_MAX_BYTES, budget,
+                )
+            except UploadRejected as e:
+                raise HTTPException(status_code=e.status_code, detail=str(e))
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Could not read archive {file.filename}: {e}")
+            # The archive itself is no longer needed once its members are out
+            del contents
+            budget -= sum(len(data) for _, data in members)
+            images.extend(members)
+        else:
+            if len(contents) > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"{file.filename} exceeds {UPLOAD_MAX_BYTES} bytes")
+            budget -= len(contents)
+            images.append((file.filename, contents))
+
+        if len(images) > config.BATCH_UPLOAD_MAX_IMAGES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"At most {config.BATCH_UPLOAD_MAX_IMAGES} images per batch request",
+            )
+
+    if not images:
+        raise HTTPException(status_code=400, detail="No images found in upload")
+
+    timeout = getattr(request.state, "timeout", config.REQUEST_TIMEOUT_SECONDS)
+    # Bounds decoded images held at once; the scheduler still batches across them
+    slots = asyncio.Semaphore(config.BATCH_UPLOAD_CONCURRENCY)
+
+    async def run(index, filename, contents):
+        async with slots:
+            try:
+                record = await _predict_one(filename, contents, explain, heatmap, timeout)
+            except Exception as e:
+                logger.error(f"Error processing {filename}: {e}")
+                record = {"filename": filename, "error": str(e)}
+        record["index"] = index
+        return record
+
+    async def stream():
+        tasks = [asyncio.create_task(run(i, name, data)) for i, (name, data) in enumerate(images)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield _dumps_line(await finished)
+        finally:
+            # Client went away: don't keep computing results nobody will read
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def _upload_gone(deployment: ModelDeployment, file_hash: str) -> HTTPException:
+    """410 for an upload that was diagnosed but has since been evicted, 404 for one never seen."""
+    key = PredictionCache.make_key(file_hash, deployment.version)
+    if key in cache or key + ":classify" in cache:
+        return HTTPException(
+            status_code=410,
+            detail="The upload behind this heatmap is no longer stored; send the image to /predict again",
+        )
+    return HTTPException(status_code=404, detail="Unknown image hash; upload it via /predict or /classify")
+
+def _parse_hash(file_hash: str) -> str:
+    file_hash = file_hash.lower()
+    if len(file_hash) != 64 or not all(c in "0123456789abcdef" for c in file_hash):
+        raise HTTPException(status_code=400, detail="Expected a SHA-256 hex digest")
+    return file_hash
+
+@app.get("/explain/{file_hash}", response_model=ExplanationResult)
+async def explain_prediction(request: Request, file_hash: str, heatmap: HeatmapMode = "url"):
+    """Heatmap and severity for an image previously sent to /classify, computed on demand."""
+    _require_ready()
+    file_hash = _parse_hash(file_hash)
+
+    try:
+        deployment = router.route(file_hash)
+        async with deployment.serving():
+            cached = _cached_prediction(deployment, file_hash)
+            if cached is None:
+                cached = await _infer(request, lambda: _explain_hash(deployment, file_hash))
+            fields = await _heatmap_fields(deployment, cached, heatmap)
+
+        _record_diagnosis(cached, "explain", deployment)
+        return _respond(ExplanationResult(
             integrity_hash=file_hash,
+            prediction=cached["prediction"],
+            confidence=cached["confidence"],
+            model_version=cached.get("model_version", deployment.version),
+            **fields,
+        ))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error explaining image: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/heatmap/{file_hash}.{fmt}")
+async def heatmap_image(request: Request, file_hash: str, fmt: str, max_side: int = None, quality: int = None):
+    """
+    Grad-CAM overlay of a predicted (or classified) upload as a binary image
+    (webp, jpg or png), at most `max_side` pixels on its longest side.
+    """
+    _require_ready()
+    file_hash = _parse_hash(file_hash)
+    if fmt not in OVERLAY_FORMATS:
+        raise HTTPException(status_code=404, detail=f"Unknown heatmap format; expected one of {list(OVERLAY_FORMATS)}")
+
+    max_side = min(max(16, max_side or config.HEATMAP_MAX_SIDE), config.HEATMAP_MAX_SIDE_LIMIT)
+    quality = min(max(1, quality or config.HEATMAP_QUALITY), 100)
+
+    # Same upload, model, format, size and quality always render the same bytes
+    deployment = router.route(file_hash)
+    etag = f'"{deployment.version}-{file_hash[:16]}-{fmt}-{max_side}-{quality}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={config.HEATMAP_CACHE_SECONDS}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    async with deployment.serving():
+        body = await overlays.get(_overlay_key(deployment, file_hash, fmt, max_side, quality))
+        if body is None:
+            if not uploads.has(file_hash):
+                raise _upload_gone(deployment, file_hash)
+            # Rendering (and Grad-CAM, if it never ran) is inference work like any other
+            body = await _infer(request, lambda: _explained_overlay(deployment, file_hash, fmt, quality, max_side))
+    if body is None:
+        if not uploads.has(file_hash):
+            raise _upload_gone(deployment, file_hash)
+        raise HTTPException(status_code=500, detail="Heatmap rendering failed")
+    return Response(body, media_type=OVERLAY_MEDIA_TYPES[fmt], headers=headers)
+
+@app.websocket("/stream")
+async def stream_frames(websocket: WebSocket, smoothing: float = config.STREAM_SMOOTHING):
+    """
+    Continuous scanning of a camera feed. Send every frame as a binary
+    message (JPEG); each scored frame is answered with a compact JSON
+    message: its `seq` (1-based, in sending order), the smoothed prediction
+    and the frame's own. Frames sent faster than they can be scored are
+    dropped, the newest one wins. Grad-CAM and severity (`explanation`) are
+    only computed when the smoothed label changes to a disease, or for the
+    next frame after a `{"explain": true}` text message; `{"reset": true}`
+    forgets the smoothing history.
+    """
+    await websocket.accept()
+    if not (ready and router.active is not None):
+        await websocket.close(code=1013, reason="Model is loading" if model_error is None else "Model not loaded")
+        return
+    if len(_streams) >= config.STREAM_MAX_CONNECTIONS:
+        await websocket.close(code=1013, reason="Too many camera streams")
+        return
+
+    stream = FrameStream(smoothing)
+    _streams.add(stream)
+    receiver = asyncio.create_task(_receive_frames(websocket, stream))
+    scorer = asyncio.create_task(_score_frames(websocket, stream))
+    try:
+        # The client went away (nothing left to score for) or can't be sent to
+        done, _ = await asyncio.wait({receiver, scorer}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                logger.error(f"Camera stream failed: {error}")
+    finally:
+        for task in (receiver, scorer):
+            task.cancel()
+        _streams.discard(stream)
+    logger.info(f"Camera stream closed: {stream.stats()}")
+
+async def _receive_frames(websocket: WebSocket, stream: FrameStream) -> None:
+    """Hands frames to the stream and applies control messages until the client disconnects."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+        if message.get("bytes") is not None:
+            if stream.put(message["bytes"]):
+                STREAM_FRAMES.inc(outcome="dropped")
+        elif message.get("text"):
+            try:
+                control = json.loads(message["text"])
+            except ValueError:
+                continue
+            if not isinstance(control, dict):
+                continue
+            if control.get("reset"):
+                stream.reset()
+            if control.get("explain"):
+                stream.explain_requested = True
+
+async def _score_frames(websocket: WebSocket, stream: FrameStream) -> None:
+    """Scores the newest frame, one at a time, and sends back the result."""
+    while True:
+        seq, contents = await stream.next_frame()
+        started = time.perf_counter()
+        try:
+            message = await _score_frame(stream, seq, contents)
+            STREAM_FRAMES.inc(outcome="processed")
+        except Rejected as e:
+            STREAM_FRAMES.inc(outcome="rejected")
+            message = {"seq": seq, "error": str(e), "retry_after": e.retry_after}
+        except UploadRejected as e:
+            STREAM_FRAMES.inc(outcome="rejected")
+            message = {"seq": seq, "error": str(e)}
+        except Exception as e:
+            logger.error(f"Error scoring stream frame: {e}")
+            STREAM_FRAMES.inc(outcome="failed")
+            message = {"seq": seq, "error": str(e)}
+        REQUEST_SECONDS.labels("/stream").observe(time.perf_counter() - started)
+        message["dropped"] = stream.dropped
+        await websocket.send_text(json.dumps(message))
+
+async def _score_frame(stream: FrameStream, seq: int, contents: bytes) -> dict:
+    """Smoothed prediction for one frame, with Grad-CAM and severity when they are due."""
+    if len(contents) > UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(f"Frame is {len(contents)} bytes; the limit is {UPLOAD_MAX_BYTES}")
+    if sniff_image_format(contents[:16]) is None:
+        raise UnsupportedUpload("Frame is not a JPEG, PNG, WebP, BMP or TIFF image")
+
+    deployment = router.route(stream.key)
+    async with deployment.serving():
+        # Classification tier: batched with the frames of every other stream
+        async with admission.slot(config.ADMISSION_QUEUE_TIMEOUT_SECONDS):
+            input_tensor, _, timings = await deployment.executor.run(prepare, contents, False)
+            _observe_stages(timings)
+            output = await deployment.classify(input_tensor)
+        _observe_output(output, "stream")
+        PREDICTIONS.inc(label=output.prediction, tier="stream", model_version=output.model_version)
+
+        label, confidence = stream.update(output.probabilities, deployment.class_names)
+        message = dict(
+            seq=seq,
             prediction=label,
-            confidence=score,
-            recommendation=recommendation,
-            heatmap_b64=heatmap_b64,
-            severity=severity
+            confidence=round(confidence, 4),
+            frame_prediction=output.prediction,
+            frame_confidence=round(output.confidence, 4),
+            model_version=output.model_version,
         )
+        trigger = stream.explain_trigger(label, deployment.class_names)
+        if trigger is not None:
+            message["explanation"] = await _explain_frame(deployment, input_tensor, contents, trigger)
+    return message
+
+async def _explain_frame(deployment: ModelDeployment, input_tensor, contents: bytes, trigger: str) -> dict:
+    """Grad-CAM and severity of one frame, stored and ledgered like a /predict upload."""
+    with STAGE_SECONDS.labels("hash").time():
+        file_hash = calculate_sha256(contents)
+    # A still camera repeats frames byte for byte; those are answered like a cached /predict
+    result = _cached_prediction(deployment, file_hash)
+    if result is not None:
+        # The overlay is rendered from the stored frame, so keep it for heatmap_url
+        await uploads.put(file_hash, contents)
+    elif admission.degraded:
+        # Keep the frame so the explanation can still be fetched later
+        await uploads.put(file_hash, contents)
+        DEGRADED_RESPONSES.inc()
+        return dict(trigger=trigger, integrity_hash=file_hash, degraded=True, explain_url=f"/explain/{file_hash}")
+    else:
+        async with admission.slot(config.ADMISSION_QUEUE_TIMEOUT_SECONDS):
+            result = await _explain_input(deployment, input_tensor, contents, file_hash)
+    STREAM_EXPLANATIONS.inc(trigger=trigger)
+    _record_diagnosis(result, "explain", deployment)
+    return dict(
+        trigger=trigger,
+        **_base_fields(result, deployment),
+        severity=result["severity"],
+        heatmap_url=_heatmap_url(file_hash),
+    )
+
+def _require_ledger():
+    if ledger is None:
+        raise HTTPException(status_code=404, detail="The integrity ledger is disabled")
+    if not ledger.running:
+        raise HTTPException(status_code=503, detail="The integrity ledger is unavailable")
+
+@app.get("/verify/{file_hash}")
+async def verify_hash(file_hash: str, limit: int = Query(20, ge=1, le=1000)):
+    """
+    What the server diagnosed for an upload's SHA-256 (as computed by the
+    frontend's IntegrityVerifier), newest first. 404 if it never saw it.
+    """
+    _require_ledger()
+    file_hash = _parse_hash(file_hash)
+    records = await asyncio.to_thread(ledger.lookup, file_hash, limit)
+    if not records:
+        raise HTTPException(status_code=404, detail="No diagnosis recorded for this hash")
+    return {"integrity_hash": file_hash, "verified": True, "count": ledger.count(file_hash), "records": records}
+
+@app.get("/ledger")
+async def ledger_records(since: float = None, until: float = None, label: str = None, after: int = None,
+                         limit: int = Query(10000, ge=1), x_admin_token: str = Header(None)):
+    """
+    Ledger records between `since` and `until` (unix seconds), optionally of
+    one predicted label, as NDJSON in time order. Page with `after=<last seq>`.
+    """
+    _require_admin(x_admin_token)
+    _require_ledger()
+    records = ledger.scan(since, until, label, after, limit)
+
+    async def stream():
+        # Disk reads happen on a thread, a page of records at a time
+        while True:
+            page = await asyncio.to_thread(lambda: [record for _, record in zip(range(256), records)])
+            if not page:
+                return
+            yield b"".join(_dumps_line(record) for record in page)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/ledger/summary")
+async def ledger_summary(since: float = None, until: float = None, x_admin_token: str = Header(None)):
+    """Diagnoses per predicted label between `since` and `until` (unix seconds), for outbreak reports."""
+    _require_admin(x_admin_token)
+    _require_ledger()
+    counts = await asyncio.to_thread(ledger.counts, since, until)
+    return {"since": since, "until": until, "total": sum(counts.values()), "counts": counts}
+
+class UploadSizeLimit:
+    """
+    Refuses oversized uploads with 413 while their body is still arriving.
+
+    A declared Content-Length over the route's limit is refused before
+    anything is read; otherwise the body bytes are counted as the app
+    receives them, so chunked requests without a Content-Length are cut
+    off as soon as they pass the limit too (before the multipart parser
+    has spooled the rest).
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = None
+        if scope["type"] == "http" and scope["method"] == "POST":
+            limit = self.limits.get(scope["path"])
+        if limit is None:
+            return await self.app(scope, receive, send)
 
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None:
+            try:
+                declared = int(declared)
+            except ValueError:
+                return await JSONResponse(status_code=400, content={"detail": "Invalid Content-Length"})(
+                    scope, receive, send
+                )
+            if declared > limit:
+                detail = f"Request body is {declared} bytes; the limit is {limit}"
+                return await self._refuse(scope, receive, send, detail)
 
+        received = 0
+        exceeded = False
+        started = False
+
+        async def counted_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge(f"Request body exceeds the limit of {limit} bytes")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded:
+                # Whatever the app made of the aborted body, the answer is 413
+                return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counted_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not started:
+            await self._refuse(scope, receive, send, f"Request body exceeds the limit of {limit} bytes")
+
+    @staticmethod
+    async def _refuse(scope, receive, send, detail: str):
+        await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+
+
+app.add_middleware(UploadSizeLimit, limits=UPLOAD_ROUTES)
+
+def _client_key(request: Request) -> str:
+    """Who a request counts against for rate limiting."""
+    if config.RATE_LIMIT_KEY_HEADER:
+        value = request.headers.get(config.RATE_LIMIT_KEY_HEADER)
+        if value:
+            # X-Forwarded-For lists the original client first
+            return value.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """
+    Rate limits and sheds inference requests before their upload is read,
+    and stamps each admitted one with its deadline.
+    """
+    path = request.url.path
+    if not (path in ADMISSION_ROUTES or path.startswith(ADMISSION_PREFIXES)):
+        return await call_next(request)
+
+    wait = rate_limiter.acquire(_client_key(request))
+    if wait > 0:
+        admission.count_shed("rate_limited")
+        return JSONResponse(
+            status_code=429, content={"detail": "Rate limit exceeded"}, headers={"Retry-After": str(math.ceil(wait))}
+        )
+    if admission.saturated:
+        rejected = admission.reject("queue_full", "Server is overloaded; try again later")
+        return JSONResponse(
+            status_code=rejected.status_code, content={"detail": str(rejected)},
+            headers={"Retry-After": str(rejected.retry_after)},
+        )
+
+    timeout = config.REQUEST_TIMEOUT_SECONDS
+    requested = request.headers.get("x-request-timeout")
+    if requested:
+        try:
+            timeout = min(timeout, max(0.0, float(requested)))
+        except ValueError:
+            return JSONResponse(status_code=400, content={"detail": "Invalid X-Request-Timeout"})
+    request.state.timeout = timeout
+    request.state.deadline = time.monotonic() + timeout
+    return await call_next(request)
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Per-endpoint latency and in-flight gauges; hands slow requests to the profiler."""
+    endpoint = _route_path(request.scope)
+    if endpoint is None or endpoint in UNTRACKED_ENDPOINTS:
+        return await call_next(request)
+
+    started = time.perf_counter()
+    with REQUESTS_IN_FLIGHT.track(endpoint=endpoint):
+        try:
+            return await call_next(request)
+        finally:
+            finished = time.perf_counter()
+            REQUEST_SECONDS.labels(endpoint).observe(finished - started)
+            dump = profiler.record(f"{request.method} {request.url.path}", started, finished)
+            if dump is not None:
+                logger.warning(
+                    f"Slow request {dump['request']} took {dump['duration_ms']:.0f} ms; "
+                    f"{dump['samples']} stack samples kept at /debug/profiler"
+                )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition of stage latencies, counters, gauges and batching stats."""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+@app.get("/debug/profiler")
+async def profiler_status(x_admin_token: str = Header(None)):
+    """Profiler state and the folded stacks of recent slow requests."""
+    _require_admin(x_admin_token)
+    return {**profiler.stats(), "recent": list(profiler.slow_requests)}
+
+@app.post("/debug/profiler")
+async def configure_profiler(enabled: bool, interval_ms: float = None, slow_ms: float = None,
+                             x_admin_token: str = Header(None)):
+    """Switches the sampling profiler on or off at runtime."""
+    _require_admin(x_admin_token)
+    if enabled:
+        profiler.start(
+            interval=interval_ms / 1000 if interval_ms is not None else None,
+            slow_seconds=slow_ms / 1000 if slow_ms is not None else None,
+        )
+    else:
+        await asyncio.to_thread(profiler.stop)
+    return profiler.stats()
+
+@app.get("/admin/models")
+async def list_models(x_admin_token: str = Header(None)):
+    """Registered model versions, the routing in the registry and what this replica is serving."""
+    _require_admin(x_admin_token, required=True)
+    versions = await asyncio.to_thread(registry.versions)
+    routing = await asyncio.to_thread(registry.routing)
+    return {"versions": versions, "routing": routing, "serving": router.stats()}
+
+@app.post("/admin/models/activate")
+async def activate_model(version: str, x_admin_token: str = Header(None)):
+    """
+    Hot-swaps to `version`: it is loaded and warmed up beside the current
+    model, then takes all new requests while the old one drains. Replicas
+    watching the same registry follow within AGRIGUARD_MODEL_WATCH_SECONDS.
+    """
+    _require_admin(x_admin_token, required=True)
+    return await _update_routing(active=version)
+
+@app.post("/admin/models/candidate")
+async def set_candidate_model(version: str, percent: float = 10.0, mode: Literal[ROUTING_MODES] = "canary",
+                              x_admin_token: str = Header(None)):
+    """Routes `percent` of uploads to `version` (canary) or also runs them on it for comparison (shadow)."""
+    _require_admin(x_admin_token, required=True)
+    return await _update_routing(candidate=version, percent=percent, mode=mode)
+
+@app.delete("/admin/models/candidate")
+async def clear_candidate_model(x_admin_token: str = Header(None)):
+    """Ends a canary or shadow run; all traffic goes to the active model."""
+    _require_admin(x_admin_token, required=True)
+    return await _update_routing(candidate=None, percent=0.0)
+
+@app.post("/admin/models/cascade")
+async def set_cascade_model(version: str, threshold: float = 0.9, escalate: List[str] = Query(None),
+                            x_admin_token: str = Header(None)):
+    """
+    Scores every image with `version` first; its answer stands at or above
+    `threshold` confidence unless the label is in `escalate`, otherwise the
+    active model decides. Calibrate the threshold with `backend.calibrate`.
+    """
+    _require_admin(x_admin_token, required=True)
+    return await _update_routing(cascade={"version": version, "threshold": threshold, "escalate": escalate or []})
+
+@app.delete("/admin/models/cascade")
+async def clear_cascade_model(x_admin_token: str = Header(None)):
+    """Sends every image straight to the active model again."""
+    _require_admin(x_admin_token, required=True)
+    return await _update_routing(cascade=None)
+
+async def _update_routing(**changes) -> dict:
+    """Writes new routing to the registry and applies it; restores the old routing if a model fails to load."""
+    previous = await asyncio.to_thread(registry.routing)
+    try:
+        routing = await asyncio.to_thread(registry.update_routing, **changes)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e).strip("'\""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        await _apply_routing()
     except Exception as e:
-        logger.error(f"Error processing image: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Failed to apply model routing {routing}: {e}")
+        await asyncio.to_thread(registry.update_routing, **previous)
+        await _apply_routing()
+        raise HTTPException(status_code=500, detail=f"Model failed to load; routing left unchanged: {e}")
+    return {"routing": routing, "serving": router.stats()}
 
 if __name__ == "__main__":
     import uvicorn
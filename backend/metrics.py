@@ -0,0 +1,406 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Default buckets for latencies measured in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """
+    Thread-safe histogram with fixed upper bounds.
+    Values above the last bucket land in an implicit +Inf bucket.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket that contains it."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for upper, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return upper
+        return float("inf")
+
+    @contextmanager
+    def time(self):
+        """Observes the wall time of the `with` block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            value_sum = self._sum
+
+        cumulative = {}
+        seen = 0
+        for upper, count in zip(self.buckets, counts):
+            seen += count
+            cumulative[str(upper)] = seen
+        cumulative["+Inf"] = total
+
+        return {
+            "count": total,
+            "sum": value_sum,
+            "mean": value_sum / total if total else 0.0,
+            # None means the quantile falls past the last bucket
+            "p50": _finite(self.quantile(0.50)),
+            "p95": _finite(self.quantile(0.95)),
+            "p99": _finite(self.quantile(0.99)),
+            "buckets": cumulative,
+        }
+
+    def samples(self, name: str, labels: Tuple = ()) -> List[str]:
+        """Prometheus text lines (_bucket, _sum, _count) for this histogram."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            value_sum = self._sum
+
+        lines = []
+        seen = 0
+        for upper, count in zip(self.buckets, counts):
+            seen += count
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(upper)),))} {seen}")
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {total}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value_sum)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {total}")
+        return lines
+
+
+def _finite(value: float):
+    return None if value == float("inf") else value
+
+
+# =============================================================
+# PROMETHEUS EXPOSITION
+# =============================================================
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class _Labeled:
+    """Values keyed by a fixed tuple of label names."""
+
+    kind = "untyped"
+
+    def __init__(self, labelnames: Iterable[str] = ()):
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _add(self, amount: float, labels: Dict) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self, name: str, labels: Tuple = ()) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labelnames:
+            values = [((), 0.0)]
+        return [
+            f"{name}{_format_labels(labels + tuple(zip(self.labelnames, key)))} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Counter(_Labeled):
+    """Monotonic counter, optionally split by labels: `counter.inc(label="Tomato___healthy")`."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        self._add(amount, labels)
+
+
+class Gauge(_Labeled):
+    """Value that goes up and down, optionally split by labels."""
+
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        self._add(amount, labels)
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self._add(-amount, labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Counts the `with` block as in progress."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class LabeledHistogram:
+    """One Histogram per value of a single label, created on first use."""
+
+    kind = "histogram"
+
+    def __init__(self, labelname: str, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.labelname = labelname
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value: str) -> Histogram:
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(value, Histogram(self.buckets))
+        return child
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            children = sorted(self._children.items())
+        return {value: child.snapshot() for value, child in children}
+
+    def samples(self, name: str, labels: Tuple = ()) -> List[str]:
+        with self._lock:
+            children = sorted(self._children.items())
+        lines = []
+        for value, child in children:
+            lines.extend(child.samples(name, labels + ((self.labelname, value),)))
+        return lines
+
+
+class Callback:
+    """
+    Value read at scrape time from `fn`, for numbers other components
+    already keep (queue depths, cache counters). `fn` returns a number, or
+    a dict mapping label-value tuples to numbers when `labelnames` is set.
+    """
+
+    def __init__(self, fn: Callable, kind: str = "gauge", labelnames: Iterable[str] = ()):
+        self.fn = fn
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+
+    def samples(self, name: str, labels: Tuple = ()) -> List[str]:
+        values = self.fn()
+        if not self.labelnames:
+            values = {(): values}
+        return [
+            f"{name}{_format_labels(labels + tuple(zip(self.labelnames, key)))} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Registry:
+    """
+    Named metrics rendered in the Prometheus text format.
+
+    The same name may be registered several times with different constant
+    `labels` (e.g. one Histogram per batch scheduler); they are rendered as
+    one metric family.
+    """
+
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, str, list]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, documentation: str, metric, **labels):
+        with self._lock:
+            family = self._families.setdefault(name, (documentation, metric.kind, []))
+            family[2].append((metric, tuple(sorted(labels.items()))))
+        return metric
+
+    def unregister(self, *metrics) -> None:
+        """Drops every registration of `metrics` (e.g. a retired model's batch schedulers)."""
+        with self._lock:
+            for name, (documentation, kind, members) in list(self._families.items()):
+                members[:] = [(metric, labels) for metric, labels in members if metric not in metrics]
+                if not members:
+                    del self._families[name]
+
+    def render(self) -> str:
+        with self._lock:
+            families = [(name, doc, kind, list(members)) for name, (doc, kind, members) in self._families.items()]
+        lines = []
+        for name, documentation, kind, members in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric, labels in members:
+                lines.extend(metric.samples(name, labels))
+        return "\n".join(lines) + "\n"
+
+
+# =============================================================
+# SAMPLING PROFILER
+# =============================================================
+# Innermost frames of threads that are blocked waiting for work
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("connection.py", "_recv"),
+}
+
+class SamplingProfiler:
+    """
+    Low-overhead stack sampler for diagnosing slow requests.
+
+    While running, a daemon thread records the Python stack of every other
+    thread in this process every `interval` seconds into a ring buffer
+    (`window` seconds deep), skipping threads idling in a wait. When a request finishes slower than
+    `slow_seconds`, `record()` keeps the stacks sampled during its lifetime
+    in folded format ("thread;outer;...;inner count", flamegraph-ready).
+    Samples cover every thread, so concurrent requests show up too; with
+    process workers, the inference itself runs outside this process and
+    only the waiting is visible.
+    """
+
+    def __init__(self, interval: float = 0.005, slow_seconds: float = 1.0, window: float = 60.0,
+                 keep: int = 20, max_stacks: int = 50):
+        self.interval = interval
+        self.slow_seconds = slow_seconds
+        self.window = window
+        self.max_stacks = max_stacks
+        self.slow_requests = deque(maxlen=keep)
+
+        self._samples = deque()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = None, slow_seconds: float = None) -> None:
+        if interval is not None:
+            self.interval = max(0.001, interval)
+        if slow_seconds is not None:
+            self.slow_seconds = slow_seconds
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name="agriguard-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            self._samples.clear()
+
+    def record(self, request: str, started: float, finished: float) -> Optional[Dict]:
+        """Keeps the stacks of a request (perf_counter timestamps) if it was slow."""
+        duration = finished - started
+        if not self.running or duration < self.slow_seconds:
+            return None
+
+        with self._lock:
+            stacks = [stack for at, stack in self._samples if started <= at <= finished]
+        tally = _Tally(stacks)
+        dump = {
+            "request": request,
+            "duration_ms": 1000 * duration,
+            "at": time.time(),
+            "samples": len(stacks),
+            "stacks": [f"{stack} {count}" for stack, count in tally.most_common(self.max_stacks)],
+        }
+        self.slow_requests.append(dump)
+        return dump
+
+    def stats(self) -> Dict:
+        with self._lock:
+            buffered = len(self._samples)
+        return {
+            "running": self.running,
+            "interval_ms": 1000 * self.interval,
+            "slow_ms": 1000 * self.slow_seconds,
+            "buffered_samples": buffered,
+            "slow_requests": len(self.slow_requests),
+        }
+
+    def _sample_loop(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+                    continue
+                stacks.append(names.get(ident, str(ident)) + ";" + _fold(frame))
+            with self._lock:
+                self._samples.extend((now, stack) for stack in stacks)
+                cutoff = now - self.window
+                while self._samples and self._samples[0][0] < cutoff:
+                    self._samples.popleft()
+
+
+def _fold(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
@@ -0,0 +1,80 @@
+import os
+import hashlib
+import logging
+import torch
+import torch.nn as nn
+from torchvision import models
+
+logger = logging.getLogger(__name__)
+
+# =============================================================
+# MODEL SETUP (EfficientNetV2-S)
+# =============================================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(BASE_DIR, "models", "plant_disease_model.pth")
+CLASS_NAMES = [
+    'Apple___Apple_scab', 'Apple___Black_rot', 'Apple___Cedar_apple_rust', 'Apple___healthy',
+    'Blueberry___healthy', 'Cherry_(including_sour)___Powdery_mildew', 'Cherry_(including_sour)___healthy',
+    'Corn_(maize)___Cercospora_leaf_spot Gray_leaf_spot', 'Corn_(maize)___Common_rust_', 'Corn_(maize)___Northern_Leaf_Blight', 'Corn_(maize)___healthy',
+    'Grape___Black_rot', 'Grape___Esca_(Black_Measles)', 'Grape___Leaf_blight_(Isariopsis_Leaf_Spot)', 'Grape___healthy',
+    'Orange___Haunglongbing_(Citrus_greening)', 'Peach___Bacterial_spot', 'Peach___healthy',
+    'Pepper,_bell___Bacterial_spot', 'Pepper,_bell___healthy',
+    'Potato___Early_blight', 'Potato___Late_blight', 'Potato___healthy',
+    'Raspberry___healthy',
+    'Soybean___healthy',
+    'Squash___Powdery_mildew',
+    'Strawberry___Leaf_scorch', 'Strawberry___healthy',
+    'Tomato___Bacterial_spot', 'Tomato___Early_blight', 'Tomato___Late_blight', 'Tomato___Leaf_Mold',
+    'Tomato___Septoria_leaf_spot', 'Tomato___Spider_mites_Two-spotted_spider_mite', 'Tomato___Target_Spot',
+    'Tomato___Tomato_Yellow_Leaf_Curl_Virus', 'Tomato___Tomato_mosaic_virus', 'Tomato___healthy'
+]
+
+
+# Architectures a checkpoint may be trained on. Each keeps its convolutional
+# trunk in `model.features` (the Grad-CAM target) and ends its classifier
+# with the Linear layer that gets our head.
+DEFAULT_ARCH = "efficientnet_v2_s"
+ARCHITECTURES = {
+    "efficientnet_v2_s": models.efficientnet_v2_s,
+    "mobilenet_v2": models.mobilenet_v2,
+    "mobilenet_v3_large": models.mobilenet_v3_large,
+    "mobilenet_v3_small": models.mobilenet_v3_small,
+}
+
+
+def build_model(num_classes: int = len(CLASS_NAMES), arch: str = DEFAULT_ARCH) -> nn.Module:
+    """Instantiates the `arch` architecture (EfficientNetV2-S by default) with our classifier head."""
+    if arch not in ARCHITECTURES:
+        raise ValueError(f"Unknown architecture '{arch}', expected one of {list(ARCHITECTURES)}")
+    model = ARCHITECTURES[arch](weights=None)
+    model.classifier[-1] = nn.Linear(model.classifier[-1].in_features, num_classes)
+    return model
+
+
+def load_model(model_path: str = MODEL_PATH, device: torch.device = torch.device("cpu"),
+               num_classes: int = len(CLASS_NAMES), arch: str = DEFAULT_ARCH) -> nn.Module:
+    """
+    Builds the model, loads the trained weights and puts it in eval mode.
+
+    The architecture is created on the meta device (no random init) and the
+    checkpoint is memory-mapped with `weights_only=True`. On CPU the mapped
+    tensors become the parameters directly, so every process and replica
+    loading the same file shares its pages through the OS page cache
+    instead of holding a private copy.
+    """
+    with torch.device("meta"):
+        model = build_model(num_classes, arch)
+    state_dict = torch.load(model_path, map_location="cpu", mmap=True, weights_only=True)
+    model.load_state_dict(state_dict, assign=True)
+    model.to(device)
+    model.eval()
+    return model
+
+
+def model_version(model_path: str = MODEL_PATH) -> str:
+    """Short content hash of a checkpoint, used to tell trained weights apart."""
+    sha256_hash = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256_hash.update(chunk)
+    return sha256_hash.hexdigest()[:12]
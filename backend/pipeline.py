@@ -0,0 +1,303 @@
+import base64
+import io
+import threading
+import time
+import torch
+import numpy as np
+import cv2
+from PIL import Image
+from torchvision import transforms
+
+try:
+    from . import config
+    from .utils import UploadTooLarge, UploadRejected
+except ImportError:
+    try:
+        import config
+        from utils import UploadTooLarge, UploadRejected
+    except ImportError:
+        from backend import config
+        from backend.utils import UploadTooLarge, UploadRejected
+
+# Model input resolution (matches training)
+INPUT_SIZE = 160
+
+# Longest side of the decoded working image shared by all pipeline stages
+DECODE_MAX_SIDE = config.DECODE_MAX_SIDE
+
+# Largest image (in pixels, as declared by its header) we agree to decode
+MAX_IMAGE_PIXELS = config.MAX_IMAGE_PIXELS
+
+# Preprocessing Transform (PIL reference path; the server uses decode_image + to_input_tensor)
+transform = transforms.Compose([
+    transforms.Resize((INPUT_SIZE, INPUT_SIZE)),
+    transforms.ToTensor()
+])
+
+
+def decode_image(contents, max_side=DECODE_MAX_SIDE, max_pixels=MAX_IMAGE_PIXELS):
+    """
+    Decodes an upload exactly once into an RGB uint8 array whose longest
+    side is at most `max_side` (0 keeps full resolution).
+
+    JPEGs are decoded at reduced resolution straight from the DCT data
+    (PIL draft mode), so a 12 MP phone photo never materialises at full
+    size. Other formats are decoded normally and then downsampled. Images
+    whose header declares more than `max_pixels` pixels raise
+    UploadTooLarge before any pixel data is decoded; corrupt or truncated
+    files raise UploadRejected (400).
+    """
+    try:
+        return _decode(contents, max_side, max_pixels)
+    except UploadRejected:
+        raise
+    except (OSError, SyntaxError, ValueError) as e:
+        # PIL reports unreadable, truncated and corrupt files this way
+        raise UploadRejected(f"Could not decode image: {e}")
+
+
+def _decode(contents, max_side, max_pixels):
+    image = Image.open(io.BytesIO(contents))
+    if max_pixels and image.width * image.height > max_pixels:
+        raise UploadTooLarge(
+            f"Image is {image.width}x{image.height} ({image.width * image.height} pixels); "
+            f"the limit is {max_pixels}"
+        )
+
+    if max_side and image.format == "JPEG":
+        scale = max_side / max(image.size)
+        if scale < 1:
+            # draft() picks the smallest 1/2, 1/4 or 1/8 scale still >= the requested size
+            image.draft("RGB", (int(image.width * scale) + 1, int(image.height * scale) + 1))
+
+    image_np = np.asarray(image.convert("RGB"))
+
+    height, width = image_np.shape[:2]
+    if max_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image_np = cv2.resize(image_np, size, interpolation=cv2.INTER_AREA)
+
+    return image_np
+
+
+def resize_input(image_np, size=INPUT_SIZE):
+    """The (size, size, 3) uint8 image the model sees; training data is packed with this too."""
+    height, width = image_np.shape[:2]
+    interpolation = cv2.INTER_AREA if min(height, width) > size else cv2.INTER_LINEAR
+    return cv2.resize(image_np, (size, size), interpolation=interpolation)
+
+
+def to_input_tensor(image_np, size=INPUT_SIZE):
+    """Builds the (1, 3, size, size) float model input directly from an RGB uint8 array."""
+    resized = resize_input(image_np, size)
+    tensor = torch.from_numpy(resized).permute(2, 0, 1).float().div_(255.0)
+    return tensor.unsqueeze(0)
+
+# Grad-CAM Implementation
+class GradCAM:
+    """
+    Reusable Grad-CAM for one model replica.
+
+    The forward hook is registered once and only records activations while
+    `forward()` is running on the calling thread, so plain inference passes
+    through the same model pay nothing and keep nothing alive. The model's
+    parameters are frozen: autograd then only tracks the layers after
+    `target_layer`, and the gradient is taken w.r.t. the activations
+    directly instead of back-propagating through the whole network.
+    """
+
+    def __init__(self, model, target_layer):
+        self.model = model
+        self.target_layer = target_layer
+        self.gradients = None
+        self.activations = None
+
+        # Inference only: no parameter gradients are ever needed
+        self.model.requires_grad_(False)
+
+        self._lock = threading.Lock()
+        self._capture_thread = None
+        self._handle = self.target_layer.register_forward_hook(self.save_activation)
+
+    def save_activation(self, module, input, output):
+        if self._capture_thread != threading.get_ident():
+            return None
+        # Cut the graph here so the backward pass stops at the target layer
+        self.activations = output.detach().requires_grad_(True)
+        return self.activations
+
+    def remove(self):
+        """Detaches the hook from the target layer."""
+        self._handle.remove()
+
+    def forward(self, input_tensor, class_idx=None, timings=None):
+        """
+        Single forward+backward pass over a batch.
+
+        Returns (logits, heatmaps): logits as an (N, num_classes) tensor and
+        heatmaps as an (N, h, w) float32 array normalised to [0, 1], one per
+        image, for `class_idx` (an int, a sequence of N ints, or None for
+        each image's top class). If `timings` is a dict, the seconds spent
+        in the forward pass ("inference") and in the backward pass and
+        heatmap computation ("gradcam") are stored in it.
+        """
+        with self._lock:
+            self._capture_thread = threading.get_ident()
+            try:
+                started = time.perf_counter()
+                with torch.enable_grad():
+                    logits = self.model(input_tensor)
+                    forwarded = time.perf_counter()
+
+                    if class_idx is None:
+                        targets = logits.argmax(dim=1)
+                    else:
+                        targets = torch.as_tensor(class_idx, device=logits.device).reshape(-1)
+                        targets = targets.expand(logits.shape[0])
+
+                    # Samples don't interact in eval mode, so one backward of the
+                    # summed target logits yields every image's own gradients
+                    score = logits.gather(1, targets.view(-1, 1)).sum()
+                    (self.gradients,) = torch.autograd.grad(score, self.activations)
+
+                heatmaps = self._heatmaps(self.activations.detach(), self.gradients)
+                if timings is not None:
+                    timings["inference"] = forwarded - started
+                    timings["gradcam"] = time.perf_counter() - forwarded
+            finally:
+                self._capture_thread = None
+                self.activations = None
+                self.gradients = None
+
+        return logits.detach(), heatmaps
+
+    def generate_heatmap(self, input_tensor, class_idx):
+        _, heatmaps = self.forward(input_tensor, class_idx)
+        return heatmaps[0]
+
+    @staticmethod
+    def _heatmaps(activations, gradients):
+        # Pool gradients per image and channel, then weight the activations
+        weights = gradients.mean(dim=(2, 3), keepdim=True)
+        heatmaps = (activations * weights).mean(dim=1)
+        heatmaps = torch.relu(heatmaps)
+
+        # Normalize each heatmap by its own peak
+        peaks = heatmaps.amax(dim=(1, 2), keepdim=True)
+        heatmaps = torch.where(peaks > 0, heatmaps / peaks.clamp_min(1e-12), heatmaps)
+        return heatmaps.cpu().numpy().astype(np.float32)
+
+def segment_leaf(image_np):
+    """
+    Segments the leaf from the background using HSV color space.
+    Returns a binary mask (0 or 1) where 1 is the leaf.
+    """
+    # Convert to HSV
+    hsv = cv2.cvtColor(image_np, cv2.COLOR_RGB2HSV)
+    
+    # Define range for greens (healthy)
+    lower_green = np.array([25, 40, 40])
+    upper_green = np.array([90, 255, 255])
+    mask_green = cv2.inRange(hsv, lower_green, upper_green)
+    
+    # Define range for browns/yellows (diseased)
+    lower_brown = np.array([10, 40, 40])
+    upper_brown = np.array([25, 255, 255])
+    mask_brown = cv2.inRange(hsv, lower_brown, upper_brown)
+    
+    # Combine masks
+    mask = cv2.bitwise_or(mask_green, mask_brown)
+    
+    # Morphological operations to close holes and remove noise
+    kernel = np.ones((5,5), np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    
+    # Normalize to 0-1
+    return mask // 255
+
+def calculate_severity(heatmap, leaf_mask, threshold=0.5):
+    """
+    Estimate severity based on the percentage of the LEAF area 
+    that has activation above the threshold.
+    """
+    # Resize leaf mask to match heatmap if needed (though heatmap is usually resized to img)
+    if leaf_mask.shape != heatmap.shape:
+        leaf_mask = cv2.resize(leaf_mask, (heatmap.shape[1], heatmap.shape[0]), interpolation=cv2.INTER_NEAREST)
+    
+    # Binarize heatmap
+    disease_mask = (heatmap > threshold).astype(np.float32)
+    
+    # Intersect disease with leaf (ignore background activations)
+    valid_disease = disease_mask * leaf_mask
+    
+    leaf_area = np.sum(leaf_mask)
+    disease_area = np.sum(valid_disease)
+    
+    if leaf_area == 0:
+        return 0.0
+        
+    severity_score = disease_area / leaf_area
+    return float(min(severity_score, 1.0)) # Cap at 100%
+
+def blend_heatmap(image_np, heatmap, leaf_mask=None):
+    """Colour-mapped heatmap added onto the RGB image (masked to the leaf if given), as a BGR uint8 array."""
+    # Reuse the decoded RGB buffer; OpenCV's colormap and encoder work in BGR
+    img = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+    
+    # Resize heatmap to image size
+    heatmap = cv2.resize(heatmap, (img.shape[1], img.shape[0]))
+    
+    # Convert to RGB heatmap
+    heatmap = np.uint8(255 * heatmap)
+    heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
+    
+    # Apply leaf mask to heatmap if provided (optional, makes it look cleaner)
+    if leaf_mask is not None:
+        leaf_mask_resized = cv2.resize(leaf_mask, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_NEAREST)
+        # Expand dims for broadcasting
+        leaf_mask_3ch = np.stack([leaf_mask_resized]*3, axis=-1)
+        heatmap = heatmap * leaf_mask_3ch
+    
+    # Overlay
+    superimposed_img = heatmap * 0.4 + img
+    return np.clip(superimposed_img, 0, 255).astype(np.uint8)
+
+def overlay_heatmap(image_np, heatmap, leaf_mask=None):
+    """Heatmap overlay as a base64 JPEG string (the legacy embedded form)."""
+    superimposed_img = blend_heatmap(image_np, heatmap, leaf_mask)
+    
+    # Encode back to base64
+    _, buffer = cv2.imencode('.jpg', superimposed_img)
+    img_str = base64.b64encode(buffer).decode('utf-8')
+    return img_str
+
+# Binary overlay formats: file extension -> (OpenCV extension, quality flag or None)
+OVERLAY_FORMATS = {
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+    "jpg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "png": (".png", None),
+}
+
+OVERLAY_MEDIA_TYPES = {"webp": "image/webp", "jpg": "image/jpeg", "png": "image/png"}
+
+def encode_overlay(image_np, heatmap, leaf_mask=None, fmt="webp", quality=80, max_side=0):
+    """
+    Heatmap overlay as encoded image bytes.
+
+    The image is downsampled to `max_side` (0 keeps its size) before
+    blending, so a small overlay never pays for a full-resolution one.
+    """
+    height, width = image_np.shape[:2]
+    if max_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image_np = cv2.resize(image_np, size, interpolation=cv2.INTER_AREA)
+
+    extension, quality_flag = OVERLAY_FORMATS[fmt]
+    params = [quality_flag, int(quality)] if quality_flag is not None else []
+    ok, buffer = cv2.imencode(extension, blend_heatmap(image_np, heatmap, leaf_mask), params)
+    if not ok:
+        raise RuntimeError(f"Could not encode overlay as {fmt}")
+    return buffer.tobytes()
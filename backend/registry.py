@@ -0,0 +1,345 @@
+"""
+Versioned model checkpoints and the routing that decides which serve traffic.
+
+    backend/models/registry/
+        routing.json        {"active": "...", "candidate": "...", "percent": 10, "mode": "canary",
+                             "cascade": {"version": "...", "threshold": 0.9, "escalate": [...]}}
+        <version>/
+            model.pth       trained state_dict
+            model.json      class_names, arch, sha256, created, notes
+            model.onnx ...  exported engines (`backend.export --version`) live beside it
+
+    python -m backend.registry add path/to/model.pth --classes classes.json --activate
+    python -m backend.registry list
+    python -m backend.registry activate <version>
+    python -m backend.registry candidate <version> --percent 10 --mode canary
+    python -m backend.registry clear-candidate
+    python -m backend.registry cascade <version> --threshold 0.9 --escalate-diseased
+    python -m backend.registry clear-cascade
+
+Running servers poll `routing.json` (AGRIGUARD_MODEL_WATCH_SECONDS) and
+hot-swap to whatever it names, so one `activate` rolls every replica that
+shares the directory. Without an active version the legacy
+`plant_disease_model.pth` with CLASS_NAMES is served, as before.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    from .model import MODEL_PATH, CLASS_NAMES, DEFAULT_ARCH, ARCHITECTURES, load_model, model_version
+    from . import config
+except ImportError:
+    try:
+        from model import MODEL_PATH, CLASS_NAMES, DEFAULT_ARCH, ARCHITECTURES, load_model, model_version
+        import config
+    except ImportError:
+        from backend.model import MODEL_PATH, CLASS_NAMES, DEFAULT_ARCH, ARCHITECTURES, load_model, model_version
+        from backend import config
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = "model.pth"
+METADATA_NAME = "model.json"
+ROUTING_NAME = "routing.json"
+
+# How a candidate model gets traffic: "canary" answers its share of requests,
+# "shadow" runs beside the active model without affecting responses
+ROUTING_MODES = ("canary", "shadow")
+
+# Versions end up in cache keys, URLs and directory names
+VERSION_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+
+class ModelSpec:
+    """A servable checkpoint: its version, weights file, label list and architecture."""
+
+    def __init__(self, version: str, path: str, class_names, arch: str = DEFAULT_ARCH, legacy: bool = False,
+                 metadata: dict = None):
+        self.version = version
+        self.path = path
+        self.class_names = list(class_names)
+        self.arch = arch
+        self.legacy = legacy
+        self.metadata = metadata or {}
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "arch": self.arch,
+            "classes": len(self.class_names),
+            "legacy": self.legacy,
+            **{key: value for key, value in self.metadata.items() if key not in ("class_names", "arch")},
+        }
+
+
+def legacy_spec(model_path: str = MODEL_PATH) -> ModelSpec:
+    """The checkpoint served before the registry existed, versioned by its content hash."""
+    return ModelSpec(model_version(model_path), model_path, CLASS_NAMES, DEFAULT_ARCH, legacy=True)
+
+
+def diseased_classes(class_names) -> list:
+    """Every class that isn't a healthy leaf."""
+    return [name for name in class_names if not name.endswith("healthy")]
+
+
+def _write_json(path: str, data: dict) -> None:
+    """Writes `data` atomically, so readers never see a half-written file."""
+    # A unique temporary name, so concurrent writers (CLI, admin API) never share one
+    f = tempfile.NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=f".{os.path.basename(path)}.", suffix=".tmp", delete=False)
+    try:
+        with f:
+            json.dump(data, f, indent=2)
+        # Readable by replicas like a plainly created file (temporary files are private)
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, path)
+    except BaseException:
+        os.remove(f.name)
+        raise
+
+
+def _file_sha256(path: str) -> str:
+    sha256_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256_hash.update(chunk)
+    return sha256_hash.hexdigest()
+
+
+class ModelRegistry:
+    """Directory of versioned checkpoints plus the routing file servers follow."""
+
+    def __init__(self, root: str = None):
+        self.root = root or config.MODEL_REGISTRY_DIR
+
+    @property
+    def routing_path(self) -> str:
+        return os.path.join(self.root, ROUTING_NAME)
+
+    def versions(self) -> list:
+        """Metadata of every registered version, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        found = []
+        for name in os.listdir(self.root):
+            if VERSION_PATTERN.match(name) and os.path.exists(os.path.join(self.root, name, METADATA_NAME)):
+                try:
+                    found.append(self.spec(name).to_dict())
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Skipping unreadable model version {name}: {e}")
+        return sorted(found, key=lambda entry: (entry.get("created", 0), entry["version"]))
+
+    def spec(self, version: str) -> ModelSpec:
+        if not version or not VERSION_PATTERN.match(version):
+            raise ValueError(f"Invalid model version '{version}'")
+        directory = os.path.join(self.root, version)
+        metadata_path = os.path.join(directory, METADATA_NAME)
+        if not os.path.exists(metadata_path):
+            raise KeyError(f"Unknown model version '{version}'")
+        with open(metadata_path, "r") as f:
+            metadata = json.load(f)
+        return ModelSpec(
+            version, os.path.join(directory, CHECKPOINT_NAME), metadata["class_names"],
+            metadata.get("arch", DEFAULT_ARCH), metadata=metadata,
+        )
+
+    # =============================================================
+    # ROUTING
+    # =============================================================
+    def routing(self) -> dict:
+        routing = {"active": None, "candidate": None, "percent": 0.0, "mode": "canary", "cascade": None}
+        if os.path.exists(self.routing_path):
+            with open(self.routing_path, "r") as f:
+                routing.update(json.load(f))
+        return routing
+
+    def routing_stamp(self):
+        """Changes whenever routing.json is rewritten (None while there is none)."""
+        try:
+            return os.stat(self.routing_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def update_routing(self, **changes) -> dict:
+        """Validates and atomically writes new routing; returns it."""
+        routing = self.routing()
+        routing.update(changes)
+        for key in ("active", "candidate"):
+            if routing[key] is not None:
+                self.spec(routing[key])
+        if routing["mode"] not in ROUTING_MODES:
+            raise ValueError(f"Unknown routing mode '{routing['mode']}', expected one of {ROUTING_MODES}")
+        routing["percent"] = float(routing["percent"])
+        if not 0 <= routing["percent"] <= 100:
+            raise ValueError("percent must be between 0 and 100")
+        if routing["candidate"] is not None and routing["candidate"] == routing["active"]:
+            # Activating the candidate ends its run
+            routing["candidate"], routing["percent"] = None, 0.0
+        if routing["cascade"] is not None:
+            routing["cascade"] = self._check_cascade(routing["cascade"], routing["active"])
+
+        os.makedirs(self.root, exist_ok=True)
+        _write_json(self.routing_path, routing)
+        return routing
+
+    def _check_cascade(self, cascade: dict, active: str = None) -> dict:
+        first = self.spec(cascade["version"])
+        # Either stage may answer, so both must speak the same labels
+        second = self.spec(active) if active else legacy_spec()
+        if list(first.class_names) != list(second.class_names):
+            raise ValueError(
+                f"Model {first.version} has other classes than the active model {second.version}; "
+                f"a cascade's stages must share one class list"
+            )
+        threshold = float(cascade.get("threshold", 0.9))
+        if not 0 <= threshold <= 1:
+            raise ValueError("threshold must be between 0 and 1")
+        escalate = list(cascade.get("escalate") or [])
+        unknown = sorted(set(escalate) - set(first.class_names))
+        if unknown:
+            raise ValueError(f"Escalated classes unknown to model {first.version}: {unknown}")
+        return {"version": first.version, "threshold": threshold, "escalate": escalate}
+
+    def active_spec(self) -> ModelSpec:
+        version = self.routing()["active"]
+        return self.spec(version) if version else legacy_spec()
+
+    def candidate_spec(self):
+        version = self.routing()["candidate"]
+        return self.spec(version) if version else None
+
+    # =============================================================
+    # REGISTRATION
+    # =============================================================
+    def add(self, checkpoint: str, class_names=None, version: str = None, arch: str = DEFAULT_ARCH,
+            notes: str = "", verify: bool = True) -> ModelSpec:
+        """
+        Copies a trained checkpoint into the registry as a new version, with
+        its class list and architecture stored beside it. With `verify` the
+        weights are loaded once to prove they fit `arch` and the class count.
+        """
+        class_names = list(class_names or CLASS_NAMES)
+        if arch not in ARCHITECTURES:
+            raise ValueError(f"Unknown architecture '{arch}', expected one of {list(ARCHITECTURES)}")
+        if verify:
+            load_model(checkpoint, num_classes=len(class_names), arch=arch)
+
+        sha256 = _file_sha256(checkpoint)
+        version = version or f"{time.strftime('%Y%m%d-%H%M%S')}-{sha256[:8]}"
+        if not VERSION_PATTERN.match(version):
+            raise ValueError(f"Invalid model version '{version}'")
+        directory = os.path.join(self.root, version)
+        if os.path.exists(directory):
+            raise ValueError(f"Model version '{version}' already exists")
+
+        # Build the version in a scratch directory and rename it into place,
+        # so a watching server never sees a version without its weights
+        staging = os.path.join(self.root, f".{version}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        shutil.copyfile(checkpoint, os.path.join(staging, CHECKPOINT_NAME))
+        _write_json(os.path.join(staging, METADATA_NAME), {
+            "class_names": class_names,
+            "arch": arch,
+            "sha256": sha256,
+            "created": time.time(),
+            "source": os.path.abspath(checkpoint),
+            "notes": notes,
+        })
+        os.replace(staging, directory)
+        logger.info(f"Registered model version {version} ({arch}, {len(class_names)} classes)")
+        return self.spec(version)
+
+
+def _read_classes(path: str):
+    """A class list from a JSON array, or a text file with one class per line."""
+    if path is None:
+        return None
+    with open(path, "r") as f:
+        raw = f.read()
+    if raw.lstrip().startswith("["):
+        return json.loads(raw)
+    return [line.strip() for line in raw.splitlines() if line.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Manage versioned model checkpoints and traffic routing.")
+    parser.add_argument("--root", default=config.MODEL_REGISTRY_DIR, help="Registry directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="Register a trained checkpoint as a new version")
+    add.add_argument("checkpoint")
+    add.add_argument("--classes", help="JSON array or one-per-line file of class names (default: CLASS_NAMES)")
+    add.add_argument("--version", help="Version name (default: timestamp and hash)")
+    add.add_argument("--arch", default=DEFAULT_ARCH, choices=list(ARCHITECTURES))
+    add.add_argument("--notes", default="")
+    add.add_argument("--no-verify", action="store_true", help="Don't load the weights before registering")
+    add.add_argument("--activate", action="store_true", help="Serve it right away")
+
+    commands.add_parser("list", help="Registered versions and the current routing")
+
+    activate = commands.add_parser("activate", help="Make a version serve all traffic")
+    activate.add_argument("version")
+
+    candidate = commands.add_parser("candidate", help="Send a share of traffic to a version")
+    candidate.add_argument("version")
+    candidate.add_argument("--percent", type=float, default=10.0)
+    candidate.add_argument("--mode", choices=ROUTING_MODES, default="canary")
+
+    commands.add_parser("clear-candidate", help="Stop routing traffic to the candidate")
+
+    cascade = commands.add_parser("cascade", help="Score every image with a fast first-stage version first")
+    cascade.add_argument("version")
+    cascade.add_argument("--threshold", type=float, default=0.9,
+                         help="First-stage confidence at which its answer stands (see backend.calibrate)")
+    cascade.add_argument("--escalate", default="", help="Comma-separated classes always sent to the active model")
+    cascade.add_argument("--escalate-diseased", action="store_true",
+                         help="Also escalate every non-healthy class, so only healthy leaves stop early")
+
+    commands.add_parser("clear-cascade", help="Send every image straight to the active model")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    registry = ModelRegistry(args.root)
+    try:
+        if args.command == "add":
+            spec = registry.add(
+                args.checkpoint, _read_classes(args.classes), args.version, args.arch, args.notes,
+                verify=not args.no_verify,
+            )
+            if args.activate:
+                registry.update_routing(active=spec.version)
+            print(spec.version)
+        elif args.command == "list":
+            print(json.dumps({"versions": registry.versions(), "routing": registry.routing()}, indent=2))
+        elif args.command == "activate":
+            print(json.dumps(registry.update_routing(active=args.version), indent=2))
+        elif args.command == "candidate":
+            routing = registry.update_routing(candidate=args.version, percent=args.percent, mode=args.mode)
+            print(json.dumps(routing, indent=2))
+        elif args.command == "clear-candidate":
+            print(json.dumps(registry.update_routing(candidate=None, percent=0.0), indent=2))
+        elif args.command == "cascade":
+            escalate = [name.strip() for name in args.escalate.split(",") if name.strip()]
+            if args.escalate_diseased:
+                escalate += [name for name in diseased_classes(registry.spec(args.version).class_names)
+                             if name not in escalate]
+            cascade = {"version": args.version, "threshold": args.threshold, "escalate": escalate}
+            print(json.dumps(registry.update_routing(cascade=cascade), indent=2))
+        else:
+            print(json.dumps(registry.update_routing(cascade=None), indent=2))
+    except (KeyError, ValueError, OSError) as e:
+        parser.error(str(e))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
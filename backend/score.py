@@ -0,0 +1,395 @@
+"""
+Offline batch scoring of image directories (retrospective surveys).
+
+    python -m backend.score data/survey-2025 --output survey.csv
+    python -m backend.score data/survey-2025 --output survey.jsonl --explain --heatmaps survey-heatmaps
+    python -m backend.score data/survey-2025 --output survey.parquet --version 20261018-120000-1a2b3c4d
+
+Walks the directory tree, decodes images in a process pool and runs them
+through the model in batches, with the same decoding, preprocessing,
+inference, severity and recommendations as the API. Rows are appended to
+the output (CSV, JSONL, or a directory of Parquet part files) after every
+batch, so an interrupted run keeps what it scored; running the same command
+again skips every file whose SHA-256 is already in the output.
+
+`--explain` adds Grad-CAM severity (a slower forward+backward pass);
+`--heatmaps DIR` also writes each overlay image as DIR/<sha256>.<fmt>.
+"""
+import argparse
+import csv
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import torch
+
+try:
+    from .workers import _init_worker, forward_batch, forward_explain_batch, render_heatmap
+    from .dataset import to_model_input
+    from .pipeline import decode_image, resize_input, OVERLAY_FORMATS
+    from .registry import ModelRegistry
+    from .engines import ENGINES
+    from .export import find_images
+    from .utils import calculate_sha256, get_recommendation
+except ImportError:
+    try:
+        from workers import _init_worker, forward_batch, forward_explain_batch, render_heatmap
+        from dataset import to_model_input
+        from pipeline import decode_image, resize_input, OVERLAY_FORMATS
+        from registry import ModelRegistry
+        from engines import ENGINES
+        from export import find_images
+        from utils import calculate_sha256, get_recommendation
+    except ImportError:
+        from backend.workers import _init_worker, forward_batch, forward_explain_batch, render_heatmap
+        from backend.dataset import to_model_input
+        from backend.pipeline import decode_image, resize_input, OVERLAY_FORMATS
+        from backend.registry import ModelRegistry
+        from backend.engines import ENGINES
+        from backend.export import find_images
+        from backend.utils import calculate_sha256, get_recommendation
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("path", "integrity_hash", "prediction", "confidence", "recommendation", "severity", "model_version",
+           "heatmap_path", "error")
+OUTPUT_FORMATS = ("csv", "jsonl", "parquet")
+PROGRESS_SECONDS = 10.0
+
+
+# =============================================================
+# DECODE POOL
+# Module-level so they can be pickled for the (spawned) process pool.
+# =============================================================
+_done = frozenset()
+
+
+def _init_loader(done) -> None:
+    global _done
+    torch.set_num_threads(1)
+    _done = frozenset(done)
+
+
+def _load(path: str):
+    """(path, sha256, model input as uint8 HWC or None, error); already-scored files are not decoded."""
+    try:
+        with open(path, "rb") as f:
+            contents = f.read()
+    except OSError as e:
+        return path, None, None, str(e)
+    file_hash = calculate_sha256(contents)
+    if file_hash in _done:
+        return path, file_hash, None, None
+    try:
+        # Archived photos are trusted: no pixel limit
+        return path, file_hash, resize_input(decode_image(contents, max_pixels=0)), None
+    except Exception as e:
+        return path, file_hash, None, str(e)
+
+
+def _render(path: str, output_path: str, heatmap, fmt: str, quality: int, max_side: int) -> str:
+    with open(path, "rb") as f:
+        body = render_heatmap(f.read(), heatmap, fmt, quality, max_side)
+    with open(output_path, "wb") as f:
+        f.write(body)
+    return output_path
+
+
+# =============================================================
+# OUTPUT
+# =============================================================
+def output_format(path: str, requested: str = None) -> str:
+    if requested:
+        return requested
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if extension in (".parquet", ".pq"):
+        return "parquet"
+    raise ValueError(f"Can't tell the output format of {path}; pass --format {'|'.join(OUTPUT_FORMATS)}")
+
+
+def _parquet_parts(path: str):
+    return sorted(glob.glob(os.path.join(path, "part-*.parquet")))
+
+
+def scored_hashes(path: str, fmt: str) -> set:
+    """SHA-256 of every file already in the output (undecodable ones included: same bytes, same outcome)."""
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    if fmt == "csv":
+        with open(path, "r", newline="") as f:
+            done.update(row["integrity_hash"] for row in csv.DictReader(f) if row.get("integrity_hash"))
+    elif fmt == "jsonl":
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # Torn last line of an interrupted run
+                    continue
+                if row.get("integrity_hash"):
+                    done.add(row["integrity_hash"])
+    else:
+        import pyarrow.parquet as pq
+
+        for part in _parquet_parts(path):
+            try:
+                table = pq.read_table(part, columns=["integrity_hash"])
+            except Exception as e:
+                # A run killed before closing its part leaves it without a footer
+                logger.warning(f"Ignoring unreadable {part} ({e}); its images will be scored again")
+                continue
+            done.update(h for h in table.column("integrity_hash").to_pylist() if h)
+    return done
+
+
+class ResultWriter:
+    """Appends rows to the output, flushed after every batch."""
+
+    def __init__(self, path: str, fmt: str, parquet_rows: int = 4096, part_rows: int = 50_000):
+        self.path = path
+        self.fmt = fmt
+        self.rows = 0
+        if fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self._pa, self._pq = pa, pq
+            self._schema = pa.schema([
+                ("path", pa.string()), ("integrity_hash", pa.string()), ("prediction", pa.string()),
+                ("confidence", pa.float32()), ("recommendation", pa.string()), ("severity", pa.float32()),
+                ("model_version", pa.string()), ("heatmap_path", pa.string()), ("error", pa.string()),
+            ])
+            # Parquet files can't be appended to and are unreadable until
+            # closed: every run writes new parts, closed every `part_rows`
+            os.makedirs(path, exist_ok=True)
+            self._writer = None
+            self._part_rows = part_rows
+            self._buffer = []
+            self._parquet_rows = parquet_rows
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="" if fmt == "csv" else None)
+        if fmt == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=COLUMNS)
+            if new:
+                self._csv.writeheader()
+
+    def write(self, rows) -> None:
+        self.rows += len(rows)
+        if self.fmt == "parquet":
+            self._buffer.extend(rows)
+            # Row groups of a useful size; a crash loses at most the open part
+            if len(self._buffer) >= self._parquet_rows:
+                self._flush_parquet()
+            return
+        if self.fmt == "csv":
+            self._csv.writerows(rows)
+        else:
+            self._file.writelines(json.dumps(row) + "\n" for row in rows)
+        self._file.flush()
+
+    def _flush_parquet(self) -> None:
+        if not self._buffer:
+            return
+        if self._writer is None:
+            part = os.path.join(self.path, f"part-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.rows}.parquet")
+            self._writer = self._pq.ParquetWriter(part, self._schema)
+            self._written = 0
+        columns = {name: [row.get(name) for row in self._buffer] for name in COLUMNS}
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+        self._written += len(self._buffer)
+        self._buffer = []
+        if self._written >= self._part_rows:
+            self._writer.close()
+            self._writer = None
+
+    def close(self) -> None:
+        if self.fmt == "parquet":
+            self._flush_parquet()
+            if self._writer is not None:
+                self._writer.close()
+        else:
+            self._file.close()
+
+
+# =============================================================
+# SCORING
+# =============================================================
+def score_batch(batch, device, explain: bool, class_names, model_version: str):
+    """Rows for a batch of (path, hash, uint8 input); also returns each row's heatmap grid (or None)."""
+    inputs = to_model_input(torch.from_numpy(np.stack([image for _, _, image in batch])), device)
+    if explain:
+        probabilities, heatmaps, severities, _, _ = forward_explain_batch(inputs)
+    else:
+        probabilities, _ = forward_batch(inputs)
+        heatmaps = severities = [None] * len(batch)
+
+    confidences, indices = probabilities.max(dim=1)
+    rows = []
+    for (path, file_hash, _), confidence, index, severity in zip(batch, confidences.tolist(), indices.tolist(),
+                                                                 severities):
+        prediction = class_names[index]
+        rows.append({
+            "path": path,
+            "integrity_hash": file_hash,
+            "prediction": prediction,
+            "confidence": confidence,
+            "recommendation": get_recommendation(prediction),
+            "severity": None if severity is None else float(severity),
+            "model_version": model_version,
+            "heatmap_path": None,
+            "error": None,
+        })
+    return rows, heatmaps
+
+
+def _reap(renders: set) -> None:
+    """Drops finished overlay renders, logging the ones that failed."""
+    for future in [future for future in renders if future.done()]:
+        renders.discard(future)
+        if future.exception() is not None:
+            logger.warning(f"Heatmap overlay failed: {future.exception()}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Score every image under a directory with the plant disease model.")
+    parser.add_argument("directory", help="Root of the images to score (searched recursively)")
+    parser.add_argument("--output", required=True, help="Results file: .csv, .jsonl or .parquet (a directory of parts)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="Output format (default: from the extension)")
+    parser.add_argument("--version", help="Registered model version (default: the active one)")
+    parser.add_argument("--engine", default="eager", choices=list(ENGINES),
+                        help="Inference engine for classification (--explain always runs the eager model)")
+    parser.add_argument("--explain", action="store_true", help="Also compute Grad-CAM severity")
+    parser.add_argument("--heatmaps", help="Write heatmap overlays here (implies --explain)")
+    parser.add_argument("--heatmap-format", default="webp", choices=list(OVERLAY_FORMATS))
+    parser.add_argument("--heatmap-quality", type=int, default=80)
+    parser.add_argument("--heatmap-max-side", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Decoding processes")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads for inference (default: one per core)")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--max-images", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    explain = args.explain or bool(args.heatmaps)
+    try:
+        fmt = output_format(args.output, args.format)
+    except ValueError as e:
+        parser.error(str(e))
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("Parquet output needs pyarrow (pip install pyarrow); use .csv or .jsonl instead")
+    try:
+        spec = ModelRegistry().spec(args.version) if args.version else ModelRegistry().active_spec()
+    except (KeyError, ValueError) as e:
+        parser.error(str(e))
+
+    paths = [path for path, _ in find_images(args.directory, args.max_images)]
+    if not paths:
+        parser.error(f"No images found under {args.directory}")
+    done = scored_hashes(args.output, fmt)
+    if done:
+        logger.info(f"{len(done)} images already scored in {args.output}; skipping them")
+    if args.heatmaps:
+        os.makedirs(args.heatmaps, exist_ok=True)
+
+    # Same replica setup as an API worker, in this process
+    _init_worker(spec.path, args.device, args.engine, None, spec.class_names, spec.arch)
+    torch.set_num_threads(args.threads or os.cpu_count() or 1)
+    device = torch.device(args.device)
+
+    writer = ResultWriter(args.output, fmt)
+    started = time.perf_counter()
+    scored = skipped = failed = 0
+    next_report = started + PROGRESS_SECONDS
+    batch, renders = [], set()
+    # Decoded images waiting for inference are bounded by this window
+    window = max(args.batch_size * 4, args.workers * 4)
+
+    def flush():
+        nonlocal scored
+        rows, heatmaps = score_batch(batch, device, explain, spec.class_names, spec.version)
+        for row, heatmap in zip(rows, heatmaps):
+            done.add(row["integrity_hash"])
+            if args.heatmaps:
+                row["heatmap_path"] = os.path.join(args.heatmaps, f"{row['integrity_hash']}.{args.heatmap_format}")
+                renders.add(pool.submit(
+                    _render, row["path"], row["heatmap_path"], np.asarray(heatmap), args.heatmap_format,
+                    args.heatmap_quality, args.heatmap_max_side,
+                ))
+        writer.write(rows)
+        scored += len(rows)
+        batch.clear()
+
+    pool = ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_loader,
+        initargs=(done,),
+    )
+    try:
+        pending = set()
+        queued = iter(paths)
+        while True:
+            for path in queued:
+                pending.add(pool.submit(_load, path))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path, file_hash, image, error = future.result()
+                if error is not None:
+                    if file_hash is not None:
+                        done.add(file_hash)
+                    logger.warning(f"Could not score {path}: {error}")
+                    writer.write([{**dict.fromkeys(COLUMNS), "path": path, "integrity_hash": file_hash,
+                                   "model_version": spec.version, "error": error}])
+                    failed += 1
+                elif image is None or file_hash in done:
+                    skipped += 1
+                else:
+                    # Duplicates within this run are scored once
+                    done.add(file_hash)
+                    batch.append((path, file_hash, image))
+                    if len(batch) >= args.batch_size:
+                        flush()
+            _reap(renders)
+            if time.perf_counter() >= next_report:
+                next_report += PROGRESS_SECONDS
+                logger.info(f"Scored {scored} images ({scored / (time.perf_counter() - started):.1f}/s)")
+        if batch:
+            flush()
+        wait(renders)
+        _reap(renders)
+    finally:
+        writer.close()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    seconds = time.perf_counter() - started
+    logger.info(
+        f"Scored {scored} images in {seconds:.1f}s ({scored / max(seconds, 1e-9):.1f}/s); "
+        f"{skipped} already scored, {failed} failed -> {args.output}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,391 @@
+import asyncio
+import hashlib
+import json
+import logging
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Callable, Optional
+
+try:
+    from .batching import BatchScheduler
+    from .workers import InferenceExecutor, forward_batch, forward_explain_batch
+except ImportError:
+    try:
+        from batching import BatchScheduler
+        from workers import InferenceExecutor, forward_batch, forward_explain_batch
+    except ImportError:
+        from backend.batching import BatchScheduler
+        from backend.workers import InferenceExecutor, forward_batch, forward_explain_batch
+
+logger = logging.getLogger(__name__)
+
+
+class ModelOutput:
+    """What serving one preprocessed image produced, and which model (and cascade stage) decided it."""
+
+    __slots__ = ("prediction", "confidence", "heatmap", "severity", "timings", "model_version", "stage",
+                 "probabilities", "leaf_mask")
+
+    def __init__(self, prediction, confidence, heatmap=None, severity=None, timings=None, model_version=None,
+                 stage=None, probabilities=None, leaf_mask=None):
+        self.prediction = prediction
+        self.confidence = confidence
+        self.heatmap = heatmap
+        self.severity = severity
+        # Leaf pixels (1) of the model input the severity was measured on (explain tier only)
+        self.leaf_mask = leaf_mask
+        self.timings = timings or {}
+        self.model_version = model_version
+        self.stage = stage
+        # Every class's probability (classification tier only)
+        self.probabilities = probabilities
+
+
+class ModelDeployment:
+    """
+    One model version being served: its worker pool, both batch schedulers
+    and a count of the requests currently using it.
+
+    Requests hold a deployment for their whole lifetime (`serving()`), so a
+    model swap can route new traffic elsewhere and still let every request
+    already routed here finish before the pool is shut down (`drain()`).
+    """
+
+    def __init__(self, spec, kind: str = "thread", workers: int = None, device=None, engine: str = "eager",
+                 engine_path: str = None, max_batch_size: int = 8, max_wait_ms: float = 10.0):
+        self.spec = spec
+        self.executor = InferenceExecutor(
+            kind=kind,
+            workers=workers,
+            model_path=spec.path,
+            device=device,
+            engine=engine,
+            engine_path=engine_path,
+            class_names=spec.class_names,
+            arch=spec.arch,
+        )
+        # Concurrent /predict calls share forward passes through the scheduler
+        self.batcher = BatchScheduler(
+            forward_explain_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            executor=self.executor,
+            max_concurrent_batches=self.executor.workers,
+        )
+        # Classification-only tier: plain no_grad forward passes, no Grad-CAM
+        self.classify_batcher = BatchScheduler(
+            forward_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            executor=self.executor,
+            max_concurrent_batches=self.executor.workers,
+        )
+        # Metric registrations to drop once this deployment is retired
+        self.metrics = []
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def version(self) -> str:
+        return self.spec.version
+
+    @property
+    def class_names(self) -> list:
+        return self.spec.class_names
+
+    async def start(self) -> None:
+        """Starts the pool and warms up every worker; raises if the checkpoint can't be served."""
+        self.executor.start()
+        await self.executor.warmup()
+        await self.batcher.start()
+        await self.classify_batcher.start()
+
+    async def stop(self) -> None:
+        await self.classify_batcher.stop()
+        await self.batcher.stop()
+        await asyncio.to_thread(self.executor.shutdown)
+
+    @asynccontextmanager
+    async def serving(self):
+        """Marks one request as using this deployment until the block exits."""
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            yield self
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Waits for requests still using this deployment; False if some outlived `timeout`."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def top_class(self, probabilities):
+        top_prob, top_idx = probabilities.max(0)
+        return self.spec.class_names[top_idx.item()], top_prob.item()
+
+    async def explain(self, input_tensor) -> ModelOutput:
+        """Label, confidence, Grad-CAM heatmap and severity (batched with other in-flight requests)."""
+        probabilities, heatmap, severity, leaf_mask, timings = await self.batcher.submit(input_tensor)
+        label, score = self.top_class(probabilities)
+        return ModelOutput(label, score, heatmap, severity, timings, self.version, leaf_mask=leaf_mask)
+
+    async def classify(self, input_tensor) -> ModelOutput:
+        """Label and confidence only, from the classification tier."""
+        probabilities, timings = await self.classify_batcher.submit(input_tensor)
+        label, score = self.top_class(probabilities)
+        return ModelOutput(label, score, timings=timings, model_version=self.version, probabilities=probabilities)
+
+    def stats(self) -> dict:
+        return {**self.spec.to_dict(), "in_flight": self.in_flight, "workers": self.executor.stats()}
+
+
+class CascadeDeployment:
+    """
+    A fast first-stage model in front of the active one.
+
+    Every image is scored by `first` (with its own, much cheaper, Grad-CAM
+    on the explain tier). Its answer stands when the confidence reaches
+    `threshold` and the label isn't in `escalate`; otherwise the image goes
+    on to `second`. Quacks like a ModelDeployment for the request path;
+    `version` names the whole cascade, so cached results of different
+    cascade settings never mix.
+    """
+
+    def __init__(self, first: ModelDeployment, second: ModelDeployment, threshold: float, escalate=()):
+        self.first = first
+        self.second = second
+        self.threshold = threshold
+        self.escalate = frozenset(escalate)
+        settings = json.dumps([first.version, threshold, sorted(self.escalate)])
+        self.version = f"{second.version}+{hashlib.sha256(settings.encode()).hexdigest()[:8]}"
+        # Decoding and overlays run on the active model's (larger) pool
+        self.executor = second.executor
+
+    @property
+    def class_names(self) -> list:
+        return self.second.class_names
+
+    @asynccontextmanager
+    async def serving(self):
+        async with AsyncExitStack() as stack:
+            await stack.enter_async_context(self.first.serving())
+            await stack.enter_async_context(self.second.serving())
+            yield self
+
+    def decides(self, output: ModelOutput) -> bool:
+        return output.confidence >= self.threshold and output.prediction not in self.escalate
+
+    async def explain(self, input_tensor) -> ModelOutput:
+        return await self._run("explain", input_tensor)
+
+    async def classify(self, input_tensor) -> ModelOutput:
+        return await self._run("classify", input_tensor)
+
+    async def _run(self, tier: str, input_tensor) -> ModelOutput:
+        output = await getattr(self.first, tier)(input_tensor)
+        # First-stage durations get their own names in the stage metrics
+        timings = {f"first_stage_{stage}": seconds for stage, seconds in output.timings.items()}
+        if self.decides(output):
+            output.stage = "first"
+        else:
+            output = await getattr(self.second, tier)(input_tensor)
+            output.stage = "second"
+            timings.update(output.timings)
+        output.timings = timings
+        return output
+
+    def stats(self) -> dict:
+        return {
+            "first_stage": self.first.stats(),
+            "threshold": self.threshold,
+            "escalate": sorted(self.escalate),
+            "version": self.version,
+        }
+
+
+def _bucket(file_hash: str) -> float:
+    """Stable position of an upload in [0, 100), so the same image always takes the same route."""
+    return int(file_hash[:8], 16) % 10000 / 100
+
+
+class ModelRouter:
+    """
+    Holds the active deployment and an optional candidate, and swaps them
+    without dropping requests.
+
+    A "canary" candidate answers `percent` of uploads itself; a "shadow"
+    candidate only re-runs that share beside the active model for
+    comparison. Routing is by upload hash, so an image keeps hitting the
+    same model (and its cache entries) while the split is unchanged. With a
+    first-stage model set, traffic for the active model goes through a
+    CascadeDeployment (canary traffic goes straight to the candidate).
+
+    `deploy(spec, role)` builds an unstarted ModelDeployment for the
+    "active", "candidate" or "first_stage" role; `retire(deployment)` is called once a
+    replaced deployment has been stopped.
+    """
+
+    def __init__(self, deploy: Callable, retire: Callable = None, drain_seconds: float = 60.0):
+        self.deploy = deploy
+        self.retire = retire
+        self.drain_seconds = drain_seconds
+        self.active: Optional[ModelDeployment] = None
+        self.candidate: Optional[ModelDeployment] = None
+        self.first_stage: Optional[ModelDeployment] = None
+        self.cascade: Optional[CascadeDeployment] = None
+        self._cascade_settings = (1.0, ())
+        self.percent = 0.0
+        self.mode = "canary"
+        self.swaps = 0
+        self._lock = asyncio.Lock()
+        self._draining = set()
+
+    def route(self, file_hash: str) -> ModelDeployment:
+        """The deployment that answers this upload."""
+        candidate = self.candidate
+        if candidate is not None and self.mode == "canary" and _bucket(file_hash) < self.percent:
+            return candidate
+        return self.cascade or self.active
+
+    def shadow(self, file_hash: str) -> Optional[ModelDeployment]:
+        """The shadow candidate that should also see this upload, if any."""
+        candidate = self.candidate
+        if candidate is not None and self.mode == "shadow" and _bucket(file_hash) < self.percent:
+            return candidate
+        return None
+
+    async def activate(self, spec) -> bool:
+        """
+        Makes `spec` the active model. The new pool is loaded and warmed up
+        while the old one keeps serving, then traffic switches in one step
+        and the old pool drains in the background. Activating the candidate
+        ends its canary or shadow run. False if `spec` already serves.
+        """
+        async with self._lock:
+            if self.active is not None and self.active.version == spec.version:
+                return False
+            deployment = await self._start(spec, "active")
+
+            previous, self.active = self.active, deployment
+            self.swaps += 1
+            logger.info(f"Model {spec.version} is now active")
+            if previous is not None:
+                self._retire_later(previous)
+            if self.candidate is not None and self.candidate.version == spec.version:
+                self._retire_later(self.candidate)
+                self.candidate, self.percent = None, 0.0
+            self._rebuild_cascade()
+            return True
+
+    async def set_candidate(self, spec, percent: float, mode: str = "canary") -> None:
+        """Loads `spec` beside the active model (unless already loaded) and routes `percent` of traffic to it."""
+        async with self._lock:
+            if self.candidate is None or self.candidate.version != spec.version:
+                deployment = await self._start(spec, "candidate")
+                previous, self.candidate = self.candidate, deployment
+                if previous is not None:
+                    self._retire_later(previous)
+            self.percent = percent
+            self.mode = mode
+            logger.info(f"Model {spec.version} is the {mode} candidate for {percent:g}% of traffic")
+
+    async def set_cascade(self, spec, threshold: float, escalate=()) -> None:
+        """Puts `spec` in front of the active model as the first stage of a cascade."""
+        async with self._lock:
+            if self.first_stage is None or self.first_stage.version != spec.version:
+                deployment = await self._start(spec, "first_stage")
+                previous, self.first_stage = self.first_stage, deployment
+                if previous is not None:
+                    self._retire_later(previous)
+            self._cascade_settings = (threshold, tuple(escalate))
+            self._rebuild_cascade()
+            logger.info(f"Model {spec.version} is the first stage (threshold {threshold:g})")
+
+    async def clear_cascade(self) -> None:
+        async with self._lock:
+            previous, self.first_stage = self.first_stage, None
+            self._rebuild_cascade()
+            if previous is not None:
+                self._retire_later(previous)
+
+    def _rebuild_cascade(self) -> None:
+        if self.first_stage is None or self.active is None:
+            self.cascade = None
+            return
+        if list(self.first_stage.class_names) != list(self.active.class_names):
+            # The registry refuses such routing, but a hand-edited routing.json may not
+            logger.error(f"Cascade disabled: {self.first_stage.version} and {self.active.version} have other classes")
+            self.cascade = None
+            return
+        threshold, escalate = self._cascade_settings
+        self.cascade = CascadeDeployment(self.first_stage, self.active, threshold, escalate)
+
+    async def clear_candidate(self) -> None:
+        async with self._lock:
+            previous, self.candidate = self.candidate, None
+            self.percent = 0.0
+            if previous is not None:
+                self._retire_later(previous)
+
+    async def stop(self) -> None:
+        """Stops every deployment (on shutdown)."""
+        async with self._lock:
+            deployments = [d for d in (self.active, self.candidate, self.first_stage) if d is not None]
+            self.active = self.candidate = self.first_stage = self.cascade = None
+        draining = list(self._draining)
+        for task in draining:
+            task.cancel()
+        await asyncio.gather(*draining, return_exceptions=True)
+        for deployment in deployments:
+            await self._stop(deployment)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active.stats() if self.active is not None else None,
+            "candidate": self.candidate.stats() if self.candidate is not None else None,
+            "cascade": self.cascade.stats() if self.cascade is not None else None,
+            "percent": self.percent,
+            "mode": self.mode,
+            "swaps": self.swaps,
+            "draining": len(self._draining),
+        }
+
+    async def _start(self, spec, role: str) -> ModelDeployment:
+        logger.info(f"Loading {role} model {spec.version} ({spec.arch}) from {spec.path}...")
+        deployment = self.deploy(spec, role)
+        try:
+            await deployment.start()
+        except BaseException:
+            await self._stop(deployment)
+            raise
+        return deployment
+
+    def _retire_later(self, deployment: ModelDeployment) -> None:
+        task = asyncio.create_task(self._drain_and_stop(deployment))
+        self._draining.add(task)
+        task.add_done_callback(self._draining.discard)
+
+    async def _drain_and_stop(self, deployment: ModelDeployment) -> None:
+        try:
+            if not await deployment.drain(self.drain_seconds):
+                logger.warning(
+                    f"Model {deployment.version} still had {deployment.in_flight} request(s) "
+                    f"after {self.drain_seconds:g}s; stopping it anyway"
+                )
+        finally:
+            await self._stop(deployment)
+            logger.info(f"Model {deployment.version} retired")
+
+    async def _stop(self, deployment: ModelDeployment) -> None:
+        try:
+            await deployment.stop()
+        except Exception as e:
+            logger.error(f"Failed to stop model {deployment.version}: {e}")
+        if self.retire is not None:
+            self.retire(deployment)
@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+
+# Hue 10-25 (browns/yellows, diseased) and 25-90 (greens, healthy) are
+# contiguous, so the two inRange calls of segment_leaf fuse into one range
+LEAF_HSV_LOWER = np.array([10, 40, 40])
+LEAF_HSV_UPPER = np.array([90, 255, 255])
+
+# segment_leaf's 5x5 kernel is sized for photos of a few hundred pixels; at the
+# 160x160 model input the same neighbourhood is about 3x3
+MORPH_KERNEL = np.ones((3, 3), np.uint8)
+
+
+def segment_leaves(images):
+    """
+    Batched leaf segmentation.
+
+    `images` is an (N, H, W, 3) uint8 RGB stack (normally the 160x160 model
+    inputs, whose geometry matches the Grad-CAM grid). Returns (N, H, W)
+    uint8 masks where 1 is leaf. Same thresholds and morphology as
+    `segment_leaf` (kernel scaled to the input size), but the HSV conversion
+    and the fused threshold run once over the whole stack.
+    """
+    n, height, width, _ = images.shape
+    # Stacking images vertically keeps per-pixel ops exact and makes them one call
+    hsv = cv2.cvtColor(np.ascontiguousarray(images).reshape(n * height, width, 3), cv2.COLOR_RGB2HSV)
+    masks = cv2.inRange(hsv, LEAF_HSV_LOWER, LEAF_HSV_UPPER).reshape(n, height, width)
+
+    # Morphology must not bleed across image borders, so it stays per image
+    for i in range(n):
+        cv2.morphologyEx(masks[i], cv2.MORPH_CLOSE, MORPH_KERNEL, dst=masks[i])
+        cv2.morphologyEx(masks[i], cv2.MORPH_OPEN, MORPH_KERNEL, dst=masks[i])
+
+    masks //= 255
+    return masks
+
+
+def resize_masks_nearest(masks, shape):
+    """Nearest-neighbour resize of an (N, H, W) stack, sampling the same pixels as cv2.INTER_NEAREST."""
+    _, height, width = masks.shape
+    out_h, out_w = shape
+    rows = np.minimum((np.arange(out_h) * (height / out_h)).astype(np.int64), height - 1)
+    cols = np.minimum((np.arange(out_w) * (width / out_w)).astype(np.int64), width - 1)
+    return masks[:, rows[:, None], cols[None, :]]
+
+
+def calculate_severities(heatmaps, leaf_masks, threshold=0.5):
+    """
+    Batched `calculate_severity`: fraction of each leaf's area whose
+    heatmap activation is above `threshold`, as an (N,) float array.
+    """
+    heatmaps = np.asarray(heatmaps)
+    if leaf_masks.shape[1:] != heatmaps.shape[1:]:
+        leaf_masks = resize_masks_nearest(leaf_masks, heatmaps.shape[1:])
+
+    leaf = leaf_masks.astype(bool)
+    diseased = (heatmaps > threshold) & leaf
+
+    leaf_area = leaf.sum(axis=(1, 2))
+    disease_area = diseased.sum(axis=(1, 2))
+
+    severities = np.zeros(len(heatmaps), dtype=np.float64)
+    has_leaf = leaf_area > 0
+    severities[has_leaf] = disease_area[has_leaf] / leaf_area[has_leaf]
+    return np.minimum(severities, 1.0)  # Cap at 100%
@@ -0,0 +1,120 @@
+"""
+Continuous camera feeds over a WebSocket (see /stream in main.py).
+
+Each connection is a `FrameStream`. Frames go into a one-frame slot: a frame
+arriving before the previous one was picked up replaces it (and is counted
+as dropped), so a camera sending faster than the server infers always gets
+its newest frame scored instead of a growing backlog. Frames of all streams
+meet in the classification tier's batch scheduler, so concurrent streams
+share forward passes.
+
+Class probabilities are smoothed over time (an exponential moving average),
+which keeps the reported label from flickering between frames. Grad-CAM and
+severity only run when the client asks for them or when the smoothed label
+changes to a disease.
+"""
+import asyncio
+import secrets
+
+import numpy as np
+
+try:
+    from .registry import diseased_classes
+except ImportError:
+    try:
+        from registry import diseased_classes
+    except ImportError:
+        from backend.registry import diseased_classes
+
+
+class TemporalSmoother:
+    """
+    Exponential moving average of class probabilities. `alpha` is the weight
+    of the newest frame: 1 disables smoothing, smaller values react slower.
+    """
+
+    def __init__(self, alpha: float):
+        self.alpha = min(1.0, max(0.01, alpha))
+        self.probabilities = None
+
+    def update(self, probabilities) -> np.ndarray:
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        if self.probabilities is None or self.probabilities.shape != probabilities.shape:
+            # First frame, or a model with another class list took over
+            self.probabilities = probabilities.copy()
+        else:
+            self.probabilities += self.alpha * (probabilities - self.probabilities)
+        return self.probabilities
+
+    def reset(self) -> None:
+        self.probabilities = None
+
+
+class FrameStream:
+    """
+    State of one camera connection: the pending frame, the smoothed
+    probabilities, the label last reported and what to explain next.
+
+    `key` is a random hex id the router buckets like an upload hash, so a
+    whole stream stays on one model (and one smoothing history) during a
+    canary split.
+    """
+
+    def __init__(self, smoothing: float):
+        self.key = secrets.token_hex(32)
+        self.smoother = TemporalSmoother(smoothing)
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.label = None
+        self.explain_requested = False
+        self._frame = None
+        self._ready = asyncio.Event()
+
+    def put(self, contents: bytes) -> bool:
+        """Offers a frame; True if it replaced one that was never processed."""
+        self.received += 1
+        replaced = self._frame is not None
+        if replaced:
+            self.dropped += 1
+        self._frame = (self.received, contents)
+        self._ready.set()
+        return replaced
+
+    async def next_frame(self):
+        """(seq, contents) of the newest frame, waiting for one."""
+        while self._frame is None:
+            self._ready.clear()
+            await self._ready.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+    def update(self, probabilities, class_names):
+        """Smooths one frame's probabilities; returns the smoothed (label, confidence)."""
+        if len(probabilities) != len(class_names):
+            raise ValueError(f"Model returned {len(probabilities)} probabilities for {len(class_names)} classes")
+        self.processed += 1
+        smoothed = self.smoother.update(probabilities)
+        index = int(smoothed.argmax())
+        return class_names[index], float(smoothed[index])
+
+    def explain_trigger(self, label: str, class_names):
+        """
+        Why this frame needs Grad-CAM and severity: "request" when the client
+        asked, "change" when the smoothed label just became a disease, else None.
+        """
+        previous, self.label = self.label, label
+        if self.explain_requested:
+            self.explain_requested = False
+            return "request"
+        if label != previous and label in diseased_classes(class_names):
+            return "change"
+        return None
+
+    def reset(self) -> None:
+        """Forgets the smoothing history (e.g. the camera moved to another row)."""
+        self.smoother.reset()
+        self.label = None
+
+    def stats(self) -> dict:
+        return {"received": self.received, "processed": self.processed, "dropped": self.dropped}
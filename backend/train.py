@@ -0,0 +1,197 @@
+"""
+Trains the plant disease classifier on packed datasets (see backend/dataset.py).
+
+    python -m backend.dataset data/PlantVillage/train packed/train
+    python -m backend.dataset data/PlantVillage/valid packed/val --classes-from packed/train
+    python -m backend.train --train-data packed/train --val-data packed/val --workers 4
+    python -m backend.train ... --arch mobilenet_v3_small --register
+
+This is notebooks/train_model.ipynb as a script: same architecture, loss,
+optimizer, mixed precision and 160x160 inputs, but the loader reads
+pre-decoded uint8 batches instead of decoding every JPEG every epoch. A
+checkpoint (model, optimizer, scaler, history) is written atomically after
+every epoch to `--checkpoint-dir`; running the same command again resumes
+from it. The final weights go to `--output`, ready for
+`python -m backend.registry add` (or `--register`).
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader
+
+try:
+    from .model import ARCHITECTURES, DEFAULT_ARCH, build_model
+    from .dataset import PackedImageDataset, collate_packed, to_model_input
+    from .registry import ModelRegistry
+except ImportError:
+    try:
+        from model import ARCHITECTURES, DEFAULT_ARCH, build_model
+        from dataset import PackedImageDataset, collate_packed, to_model_input
+        from registry import ModelRegistry
+    except ImportError:
+        from backend.model import ARCHITECTURES, DEFAULT_ARCH, build_model
+        from backend.dataset import PackedImageDataset, collate_packed, to_model_input
+        from backend.registry import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = "last.pt"
+
+
+def make_loader(dataset, batch_size: int, workers: int, shuffle: bool, seed: int, epoch: int, pin_memory: bool):
+    # Seeded per epoch, so a resumed run sees the same order it would have
+    generator = torch.Generator().manual_seed(seed + epoch)
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        generator=generator,
+        num_workers=workers,
+        pin_memory=pin_memory,
+        persistent_workers=False,
+        collate_fn=collate_packed,
+    )
+
+
+def save_checkpoint(path: str, state: dict) -> None:
+    """Writes next to `path` and renames, so an interrupted save never clobbers the last good one."""
+    tmp_path = f"{path}.tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def run_epoch(model, loader, device, criterion=None, optimizer=None, scaler=None, amp: bool = False,
+              channels_last: bool = False):
+    """One pass over `loader`; trains when an optimizer is given. Returns (loss, accuracy %)."""
+    training = optimizer is not None
+    model.train(training)
+    correct, total, loss_sum = 0, 0, 0.0
+    with torch.set_grad_enabled(training):
+        for images, labels in loader:
+            inputs = to_model_input(images, device, channels_last)
+            labels = labels.to(device, non_blocking=True)
+            with torch.autocast(device_type=device.type, enabled=amp):
+                outputs = model(inputs)
+                loss = criterion(outputs, labels) if criterion is not None else None
+
+            if training:
+                optimizer.zero_grad(set_to_none=True)
+                scaler.scale(loss).backward()
+                scaler.step(optimizer)
+                scaler.update()
+
+            if loss is not None:
+                loss_sum += loss.item() * labels.size(0)
+            correct += outputs.argmax(1).eq(labels).sum().item()
+            total += labels.size(0)
+    return loss_sum / max(total, 1), 100 * correct / max(total, 1)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Train the plant disease classifier on packed datasets.")
+    parser.add_argument("--train-data", required=True, help="Packed training store (python -m backend.dataset)")
+    parser.add_argument("--val-data", required=True, help="Packed validation store")
+    parser.add_argument("--arch", default=DEFAULT_ARCH, choices=list(ARCHITECTURES))
+    parser.add_argument("--epochs", type=int, default=15)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1),
+                        help="DataLoader worker processes (0 loads in the training process)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--checkpoint-dir", default="checkpoints", help="Where the per-epoch checkpoint is kept")
+    parser.add_argument("--no-resume", action="store_true", help="Start over even if a checkpoint exists")
+    parser.add_argument("--output", default="plant_disease_model.pth", help="Final weights (state dict)")
+    parser.add_argument("--register", action="store_true", help="Add the final weights to the model registry")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    torch.manual_seed(args.seed)
+    device = torch.device(args.device)
+    amp = device.type == "cuda"
+    channels_last = device.type == "cuda"
+
+    try:
+        train_ds = PackedImageDataset(args.train_data)
+        val_ds = PackedImageDataset(args.val_data)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    if val_ds.classes != train_ds.classes:
+        parser.error("Train and validation stores have different class lists; pack the validation "
+                     "split with --classes-from <train store>")
+    class_names = train_ds.classes
+    logger.info(f"Classes: {len(class_names)} | train {len(train_ds)} | val {len(val_ds)} images")
+
+    model = build_model(len(class_names), args.arch).to(device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=args.lr)
+    scaler = torch.amp.GradScaler(device=device.type, enabled=amp)
+
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    checkpoint_path = os.path.join(args.checkpoint_dir, CHECKPOINT_NAME)
+    start_epoch, history = 0, []
+    if os.path.exists(checkpoint_path) and not args.no_resume:
+        state = torch.load(checkpoint_path, map_location=device, weights_only=False)
+        if state["arch"] != args.arch or state["class_names"] != class_names:
+            parser.error(f"{checkpoint_path} is from a different architecture or class list; use --no-resume")
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        scaler.load_state_dict(state["scaler"])
+        start_epoch, history = state["epoch"], state["history"]
+        torch.set_rng_state(state["rng"])
+        logger.info(f"Resuming from {checkpoint_path} after epoch {start_epoch}")
+
+    pin_memory = device.type == "cuda"
+    for epoch in range(start_epoch, args.epochs):
+        started = time.perf_counter()
+        train_loader = make_loader(train_ds, args.batch_size, args.workers, True, args.seed, epoch, pin_memory)
+        val_loader = make_loader(val_ds, args.batch_size, args.workers, False, args.seed, epoch, pin_memory)
+        train_loss, train_acc = run_epoch(model, train_loader, device, criterion, optimizer, scaler, amp, channels_last)
+        val_loss, val_acc = run_epoch(model, val_loader, device, criterion, amp=amp, channels_last=channels_last)
+        seconds = time.perf_counter() - started
+
+        history.append({
+            "epoch": epoch + 1, "train_loss": train_loss, "train_acc": train_acc,
+            "val_loss": val_loss, "val_acc": val_acc, "seconds": seconds,
+            "images_per_second": len(train_ds) / seconds,
+        })
+        logger.info(
+            f"Epoch {epoch + 1}/{args.epochs} | Train: {train_acc:.2f}% | Val: {val_acc:.2f}% | "
+            f"{seconds:.0f}s ({len(train_ds) / seconds:.0f} img/s)"
+        )
+        save_checkpoint(checkpoint_path, {
+            "epoch": epoch + 1,
+            "arch": args.arch,
+            "class_names": class_names,
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "scaler": scaler.state_dict(),
+            "history": history,
+            "rng": torch.get_rng_state(),
+        })
+
+    # Same format as the notebook's output: a plain state dict
+    model = model.to(memory_format=torch.contiguous_format)
+    state_dict = {key: value.detach().cpu().contiguous() for key, value in model.state_dict().items()}
+    save_checkpoint(args.output, state_dict)
+    with open(os.path.join(args.checkpoint_dir, "history.json"), "w") as f:
+        json.dump({"arch": args.arch, "class_names": class_names, "history": history}, f, indent=2)
+    logger.info(f"Saved: {args.output}")
+
+    if args.register:
+        spec = ModelRegistry().add(args.output, class_names, arch=args.arch, notes=f"trained on {args.train_data}")
+        logger.info(f"Registered as version {spec.version}; serve it with python -m backend.registry activate {spec.version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
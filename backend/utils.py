@@ -1,5 +1,8 @@
 import hashlib
-from typing import Dict
+import io
+import tarfile
+import zipfile
+from typing import Dict, List, Optional, Tuple
 
 def calculate_sha256(file_content: bytes) -> str:
     """Calculates the SHA256 hash of the file content."""
@@ -192,3 +195,140 @@ RECOMMENDATIONS: Dict[str, str] =  {
 def get_recommendation(label: str) -> str:
     """Returns a recommendation based on the disease label."""
     return RECOMMENDATIONS.get(label, "No specific recommendation available. Consult an agricultural expert.")
+
+
+# =============================================================
+# UPLOADS
+# =============================================================
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+# Leading bytes of the image formats we decode
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+)
+
+# zip, gzip, bzip2 and xz; plain tar is recognised by its "ustar" header
+ARCHIVE_SIGNATURES = (b"PK\x03\x04", b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00")
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class UploadRejected(ValueError):
+    """An upload refused before (or instead of) decoding; `status_code` is the HTTP status to answer with."""
+
+    status_code = 400
+
+
+class UploadTooLarge(UploadRejected):
+    status_code = 413
+
+
+class UnsupportedUpload(UploadRejected):
+    status_code = 415
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """Image format from the first bytes of a file, or None if it isn't one we decode."""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def _looks_like_archive(head: bytes) -> bool:
+    return head.startswith(ARCHIVE_SIGNATURES) or head[257:262] == b"ustar"
+
+
+async def read_upload(file, max_bytes: int, allow_archives: bool = False,
+                      chunk_size: int = UPLOAD_CHUNK_SIZE) -> Tuple[bytearray, str]:
+    """
+    Reads an UploadFile in chunks and returns (contents, sha256 hex digest).
+
+    The hash is computed as the chunks arrive, and the upload is refused as
+    soon as possible: from its declared size, from the magic bytes of the
+    first chunk (images, plus zip/tar archives with `allow_archives`), or
+    when the running total passes `max_bytes`. Contents are accumulated in
+    a single bytearray, so there is never more than one copy of the body.
+    """
+    declared = getattr(file, "size", None)
+    if declared is not None and declared > max_bytes:
+        raise UploadTooLarge(f"Upload is {declared} bytes; the limit is {max_bytes}")
+
+    digest = hashlib.sha256()
+    contents = bytearray()
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        if not contents and sniff_image_format(chunk) is None:
+            if not (allow_archives and _looks_like_archive(chunk)):
+                accepted = "JPEG, PNG, WebP, BMP or TIFF image" + (" or zip/tar archive" if allow_archives else "")
+                raise UnsupportedUpload(f"{file.filename or 'Upload'} is not a {accepted}")
+        if len(contents) + len(chunk) > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds the limit of {max_bytes} bytes")
+        digest.update(chunk)
+        contents += chunk
+
+    if not contents:
+        raise UploadRejected("Empty upload")
+    return contents, digest.hexdigest()
+
+
+# =============================================================
+# ARCHIVES (batch uploads)
+# =============================================================
+
+def is_archive(filename: str, contents: bytes) -> bool:
+    """True for zip or tar(.gz/.bz2/.xz) uploads, judged by magic bytes or extension."""
+    head = bytes(contents[:512])
+    if sniff_image_format(head) is not None:
+        return False
+    if _looks_like_archive(head):
+        return True
+    name = (filename or "").lower()
+    return name.endswith((".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz"))
+
+
+def extract_images(filename: str, contents: bytes, max_members: int = 1000,
+                   max_member_bytes: int = None, max_total_bytes: int = None) -> List[Tuple[str, bytes]]:
+    """
+    Returns (member name, bytes) for every image file inside a zip or tar archive.
+
+    Member sizes are checked against `max_member_bytes` and
+    `max_total_bytes` from the archive index, before anything is extracted.
+    """
+    images = []
+    total = 0
+
+    def admit(name, size):
+        nonlocal total
+        if len(images) >= max_members:
+            raise ValueError(f"Archive {filename} has more than {max_members} images")
+        if max_member_bytes and size > max_member_bytes:
+            raise UploadTooLarge(f"{name} in {filename} is {size} bytes; the limit is {max_member_bytes}")
+        total += size
+        if max_total_bytes and total > max_total_bytes:
+            raise UploadTooLarge(f"Images in {filename} exceed {max_total_bytes} bytes in total")
+
+    if zipfile.is_zipfile(io.BytesIO(contents)):
+        with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                admit(info.filename, info.file_size)
+                images.append((info.filename, archive.read(info)))
+        return images
+
+    with tarfile.open(fileobj=io.BytesIO(contents), mode="r:*") as archive:
+        for member in archive:
+            if not member.isfile() or not member.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            admit(member.name, member.size)
+            images.append((member.name, archive.extractfile(member).read()))
+    return images
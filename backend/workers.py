@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+try:
+    from .model import MODEL_PATH, CLASS_NAMES, DEFAULT_ARCH, load_model
+    from .engines import load_engine
+    from .pipeline import INPUT_SIZE, decode_image, to_input_tensor, GradCAM, encode_overlay
+    from .severity import segment_leaves, calculate_severities
+except ImportError:
+    try:
+        from model import MODEL_PATH, CLASS_NAMES, DEFAULT_ARCH, load_model
+        from engines import load_engine
+        from pipeline import INPUT_SIZE, decode_image, to_input_tensor, GradCAM, encode_overlay
+        from severity import segment_leaves, calculate_severities
+    except ImportError:
+        from backend.model import MODEL_PATH, CLASS_NAMES, DEFAULT_ARCH, load_model
+        from backend.engines import load_engine
+        from backend.pipeline import INPUT_SIZE, decode_image, to_input_tensor, GradCAM, encode_overlay
+        from backend.severity import segment_leaves, calculate_severities
+
+logger = logging.getLogger(__name__)
+
+WORKER_KINDS = ("thread", "process")
+
+# Each pool worker (thread or process) keeps its own model replica here
+_local = threading.local()
+
+
+def _init_worker(model_path: str, device_name: str, engine: str = "eager", engine_path: str = None,
+                 class_names=None, arch: str = DEFAULT_ARCH) -> None:
+    """Pool initializer: loads a private model replica (and inference engine) for this worker."""
+    class_names = class_names or CLASS_NAMES
+    torch.set_num_threads(1)
+    _local.device = torch.device(device_name)
+    _local.model = load_model(model_path, _local.device, len(class_names), arch)
+    # Serves classification-only batches; Grad-CAM needs the eager model's hooks
+    _local.engine = load_engine(engine, _local.model, _local.device, engine_path or None, model_path, class_names)
+    # Hooks are registered once per replica and reused for every request
+    # Every supported architecture keeps its trunk in model.features
+    _local.grad_cam = GradCAM(_local.model, _local.model.features[-1])
+
+
+def _worker_model():
+    model = getattr(_local, "model", None)
+    if model is None:
+        raise RuntimeError("Worker has no model loaded")
+    return model
+
+
+# =============================================================
+# WORKER TASKS
+# Module-level so they can be pickled for the process pool.
+# =============================================================
+# Every task also returns a dict of stage durations (seconds), measured here
+# so they are the same for thread and process workers.
+def prepare(contents: bytes, keep_image: bool = True):
+    """
+    Decodes an upload once and returns (input_tensor, image_np, timings):
+    the (1, 3, H, W) model input and the RGB working buffer that the overlay
+    reuses. `image_np` is None when `keep_image` is False (classification
+    only), so it isn't shipped between processes.
+    """
+    started = time.perf_counter()
+    image_np = decode_image(contents)
+    decoded = time.perf_counter()
+    input_tensor = to_input_tensor(image_np)
+    timings = {"decode": decoded - started, "preprocess": time.perf_counter() - decoded}
+    return input_tensor, (image_np if keep_image else None), timings
+
+
+def forward_batch(inputs: torch.Tensor):
+    """
+    Runs a stacked batch through this worker's inference engine.
+
+    Returns (probabilities, timings) with one timings dict per image, so
+    the batch scheduler hands each caller its batch's durations.
+    """
+    _worker_model()
+    started = time.perf_counter()
+    outputs = _local.engine(inputs)
+    probabilities = torch.nn.functional.softmax(outputs.float(), dim=1).cpu()
+    timings = {"inference": time.perf_counter() - started}
+    return probabilities, [timings] * len(inputs)
+
+
+def forward_explain_batch(inputs: torch.Tensor):
+    """
+    One forward+backward pass over a stacked batch, plus batched severity.
+
+    Returns (probabilities, heatmaps, severities, leaf_masks, timings):
+    class probabilities per image, the Grad-CAM heatmap of each image's top
+    class, its severity, the leaf mask and the batch's stage durations.
+    Segmentation runs on the model inputs themselves, the resolution whose
+    geometry the heatmap grid refers to.
+    """
+    _worker_model()
+    timings = {}
+    logits, heatmaps = _local.grad_cam.forward(inputs.to(_local.device), timings=timings)
+
+    started = time.perf_counter()
+    images = inputs.mul(255).round_().to(torch.uint8).permute(0, 2, 3, 1).numpy()
+    leaf_masks = segment_leaves(images)
+    severities = calculate_severities(heatmaps, leaf_masks)
+    timings["segmentation"] = time.perf_counter() - started
+
+    probabilities = torch.nn.functional.softmax(logits, dim=1).cpu()
+    return probabilities, heatmaps, severities, leaf_masks, [timings] * len(inputs)
+
+
+def warmup() -> bool:
+    """Runs one tiny batch so a worker's replica is loaded and allocated before real traffic."""
+    forward_explain_batch(torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE))
+    forward_batch(torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE))
+    return True
+
+
+def render_heatmap(contents: bytes, heatmap: np.ndarray, fmt: str = "webp", quality: int = 80,
+                   max_side: int = 0) -> bytes:
+    """
+    Encoded heatmap overlay for a stored upload, rendered on demand.
+
+    The leaf mask is recomputed from the model input exactly as in
+    `forward_explain_batch`, so the overlay matches the reported severity.
+    """
+    image_np = decode_image(contents)
+    model_image = to_input_tensor(image_np).mul(255).round_().to(torch.uint8).permute(0, 2, 3, 1).numpy()
+    leaf_mask = segment_leaves(model_image)[0]
+    return encode_overlay(image_np, np.asarray(heatmap, dtype=np.float32), leaf_mask, fmt, quality, max_side)
+
+
+class InferenceExecutor:
+    """
+    Runs decoding, inference and Grad-CAM off the asyncio event loop.
+
+    `kind="thread"` uses a thread pool, `kind="process"` a process pool
+    (spawned, so CUDA and torch's own threads are safe). Either way each
+    worker loads its own model replica in its initializer, so workers never
+    contend for a shared module or its hooks. Each pool serves one
+    checkpoint; a model swap starts a new pool beside the old one.
+    """
+
+    def __init__(self, kind: str = "thread", workers: int = None, model_path: str = MODEL_PATH, device=None,
+                 engine: str = "eager", engine_path: str = None, class_names=None, arch: str = DEFAULT_ARCH):
+        if kind not in WORKER_KINDS:
+            raise ValueError(f"Unknown worker kind '{kind}', expected one of {WORKER_KINDS}")
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.model_path = model_path
+        self.device = str(device or "cpu")
+        self.engine = engine
+        self.engine_path = engine_path or None
+        self.class_names = list(class_names or CLASS_NAMES)
+        self.arch = arch
+        self._executor = None
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def start(self) -> None:
+        if self.running:
+            return
+        initargs = (self.model_path, self.device, self.engine, self.engine_path, self.class_names, self.arch)
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=initargs,
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="agriguard-worker",
+                initializer=_init_worker,
+                initargs=initargs,
+            )
+        logger.info(f"Started {self.workers} {self.kind} worker(s)")
+
+    def shutdown(self) -> None:
+        if not self.running:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+
+    async def warmup(self) -> None:
+        """Starts every worker (running its initializer) and pushes a dummy batch through each."""
+        loop = asyncio.get_running_loop()
+        # Submitting one task per worker at once makes the pool spawn all of them
+        futures = [loop.run_in_executor(self._executor, warmup) for _ in range(self.workers)]
+        await asyncio.gather(*futures)
+        logger.info(f"Warmed up {self.workers} {self.kind} worker(s)")
+
+    async def run(self, fn, *args):
+        """Runs `fn(*args)` on a pool worker and awaits the result."""
+        if not self.running:
+            raise RuntimeError("Inference executor is not running")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def stats(self) -> dict:
+        return {"kind": self.kind, "workers": self.workers, "engine": self.engine, "running": self.running}
@@ -0,0 +1,162 @@
+"""
+In-process load generator for the FastAPI app.
+
+    python benchmarks/load.py [--endpoint /predict] [--concurrency 1 4 16] [--requests 64]
+    python benchmarks/load.py --output run.json --baseline previous.json
+
+Starts the app with its normal lifespan (model load, worker pool, batchers)
+and drives it through httpx's ASGI transport, so no server or network is
+involved. For each concurrency level, `--concurrency` clients send
+`--requests` uploads in total and the report gives throughput and
+p50/p95/p99 latency. Every upload is a distinct synthetic photo (or a real
+one from `--images`) so the prediction cache doesn't answer; `--same-image`
+measures the cached path instead.
+
+Server settings come from the usual AGRIGUARD_* environment variables and
+are recorded in the report. With `--baseline`, levels whose throughput
+dropped or whose p95 rose by more than `--tolerance` are listed under
+"regressions" and the exit code is 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.export import find_images
+from backend.main import app
+from benchmarks.report import environment, summarize, write_report
+from benchmarks.synthetic import sample_set
+
+ENDPOINTS = ("/predict", "/classify", "/predict?explain=false")
+
+
+async def run_level(client, endpoint, uploads, concurrency):
+    """Sends every upload once with `concurrency` clients; returns the level's report."""
+    pending = iter(uploads)
+    latencies = []
+    statuses = {}
+
+    async def client_loop():
+        for contents in pending:
+            started = time.perf_counter()
+            response = await client.post(endpoint, files={"file": ("leaf.jpg", contents, "image/jpeg")})
+            latencies.append(1000 * (time.perf_counter() - started))
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+
+    ok = statuses.get(200, 0)
+    return {
+        "concurrency": concurrency,
+        "requests": len(uploads),
+        "errors": len(uploads) - ok,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "duration_s": duration,
+        "throughput_rps": ok / duration if duration else 0.0,
+        "latency": summarize(latencies),
+    }
+
+
+async def run(args, uploads):
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            health = (await client.get("/health")).json()
+            if not health.get("ready"):
+                raise SystemExit(f"App is not ready: {health}")
+
+            levels = []
+            offset = args.warmup
+            await run_level(client, args.endpoint, uploads[:args.warmup], max(args.concurrency))
+            for concurrency in args.concurrency:
+                batch = uploads[offset:offset + args.requests]
+                offset += args.requests
+                levels.append(await run_level(client, args.endpoint, batch, concurrency))
+
+            health = (await client.get("/health")).json()
+    return levels, health
+
+
+def compare(levels, baseline, tolerance):
+    """Levels that got slower than in `baseline` by more than `tolerance` (a fraction)."""
+    previous = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    regressions = []
+    for level in levels:
+        before = previous.get(level["concurrency"])
+        if before is None:
+            continue
+        if level["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append({
+                "concurrency": level["concurrency"], "metric": "throughput_rps",
+                "baseline": before["throughput_rps"], "current": level["throughput_rps"],
+            })
+        if level["latency"].get("p95_ms", 0) > before["latency"].get("p95_ms", float("inf")) * (1 + tolerance):
+            regressions.append({
+                "concurrency": level["concurrency"], "metric": "p95_ms",
+                "baseline": before["latency"]["p95_ms"], "current": level["latency"]["p95_ms"],
+            })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="/predict")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=64, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=8)
+    parser.add_argument("--images", help="Directory of real photos to upload (default: synthetic)")
+    parser.add_argument("--width", type=int, default=1280, help="Synthetic photo size")
+    parser.add_argument("--height", type=int, default=960)
+    parser.add_argument("--same-image", action="store_true", help="Upload one photo repeatedly (cache hits)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    total = args.warmup + args.requests * len(args.concurrency)
+    if args.images:
+        paths = [path for path, _ in find_images(args.images)]
+        if not paths:
+            parser.error(f"No images found under {args.images}")
+        uploads = []
+        for path in paths[:1 if args.same_image else total]:
+            with open(path, "rb") as f:
+                uploads.append(f.read())
+    else:
+        rng = np.random.default_rng(args.seed)
+        uploads = sample_set(rng, 1 if args.same_image else total, sizes=((args.width, args.height),))
+    # Real photo sets smaller than the run are cycled (later rounds hit the cache)
+    uploads = [uploads[i % len(uploads)] for i in range(total)]
+
+    levels, health = asyncio.run(run(args, uploads))
+    report = {
+        "benchmark": "load",
+        "environment": environment(),
+        "endpoint": args.endpoint,
+        "upload": "same image" if args.same_image else (args.images or f"synthetic {args.width}x{args.height}"),
+        "levels": levels,
+        "server": {key: health.get(key) for key in ("model_version", "workers", "batching", "classify_batching", "cache")},
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(levels, json.load(f), args.tolerance)
+        exit_code = 1 if report["regressions"] else 0
+
+    write_report(report, args.output)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Shared helpers for the benchmark scripts: latency summaries, run metadata, JSON output."""
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def summarize(samples_ms):
+    """Latency summary (milliseconds) of a list of samples."""
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if samples.size == 0:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        "count": int(samples.size),
+        "mean_ms": float(samples.mean()),
+        "min_ms": float(samples.min()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(samples.max()),
+    }
+
+
+def environment():
+    """What a run was measured on, so two reports can be compared fairly."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in sorted(os.environ.items()) if key.startswith("AGRIGUARD_")},
+    }
+
+
+def write_report(report, path=None):
+    """Prints the report as JSON and, with `path`, also writes it there."""
+    text = json.dumps(report, indent=2)
+    print(text)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
@@ -0,0 +1,87 @@
+"""
+Compares the reference severity pipeline with the batched kernels.
+
+    python benchmarks/severity_consistency.py [--images DIR] [--count 60]
+
+Reference: segment_leaf at full decoded resolution + calculate_severity.
+Batched:   decode_image + to_input_tensor, then segment_leaves and
+           calculate_severities over the whole stack at model resolution.
+
+Both get the same heatmaps, so any difference comes from segmenting at a
+different resolution. Prints a JSON report (value drift and timings).
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.export import find_images
+from backend.pipeline import decode_image, to_input_tensor, segment_leaf, calculate_severity
+from backend.severity import segment_leaves, calculate_severities
+from benchmarks.synthetic import make_heatmaps, sample_set
+
+
+def load_images(directory, limit):
+    uploads = []
+    for path, _ in find_images(directory, limit):
+        with open(path, "rb") as f:
+            uploads.append(f.read())
+    return uploads
+
+
+def reference(uploads, heatmaps):
+    """Returns (severities, decode_seconds, severity_seconds)."""
+    started = time.perf_counter()
+    images = [np.array(Image.open(io.BytesIO(contents)).convert("RGB")) for contents in uploads]
+    decoded = time.perf_counter()
+    severities = [calculate_severity(heatmap, segment_leaf(image_np)) for image_np, heatmap in zip(images, heatmaps)]
+    return np.array(severities), decoded - started, time.perf_counter() - decoded
+
+
+def batched(uploads, heatmaps):
+    """Returns (severities, decode_seconds, severity_seconds)."""
+    started = time.perf_counter()
+    inputs = torch.cat([to_input_tensor(decode_image(contents)) for contents in uploads])
+    decoded = time.perf_counter()
+    images = inputs.mul(255).round_().to(torch.uint8).permute(0, 2, 3, 1).numpy()
+    severities = calculate_severities(heatmaps, segment_leaves(images))
+    return severities, decoded - started, time.perf_counter() - decoded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Directory of sample leaf photos (default: synthetic set)")
+    parser.add_argument("--count", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    uploads = load_images(args.images, args.count) if args.images else sample_set(rng, args.count)
+    heatmaps = make_heatmaps(rng, len(uploads))
+
+    old, old_decode, old_severity = reference(uploads, heatmaps)
+    new, new_decode, new_severity = batched(uploads, heatmaps)
+
+    diff = np.abs(old - new)
+    per_image = 1000 / len(uploads)
+    print(json.dumps({
+        "images": len(uploads),
+        "mean_abs_diff": float(diff.mean()),
+        "p95_abs_diff": float(np.percentile(diff, 95)),
+        "max_abs_diff": float(diff.max()),
+        "within_0.05": float((diff <= 0.05).mean()),
+        "reference_ms_per_image": {"decode": old_decode * per_image, "severity": old_severity * per_image},
+        "batched_ms_per_image": {"decode": new_decode * per_image, "severity": new_severity * per_image},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
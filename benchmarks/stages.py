@@ -0,0 +1,148 @@
+"""
+Times each stage of the /predict pipeline separately.
+
+    python benchmarks/stages.py [--images DIR] [--repeats 20] [--output stages.json]
+
+Runs on synthetic leaf photos at phone-camera sizes (VGA, 1.2 MP, 12 MP),
+on test_image.jpg, and on the first images of `--images DIR` if given.
+Every stage gets the output of the previous one, as in the server:
+
+    decode_full        PIL decode at full resolution (the original path)
+    decode             decode_image (reduced-size JPEG decode)
+    transform          torchvision `transform` (PIL reference preprocessing)
+    to_input_tensor    preprocessing used by the server
+    forward            eager model forward pass, batch of 1
+    generate_heatmap   GradCAM.generate_heatmap (forward + backward)
+    segment_leaf       full-image segmentation
+    segment_leaves     batched segmentation on the model input
+    calculate_severity
+    overlay_heatmap    colormap, blend and JPEG encode (includes base64)
+    base64             base64 encoding of the overlay JPEG alone
+    encode_overlay     binary WebP overlay at HEATMAP_MAX_SIDE (/heatmap/{hash}.webp)
+
+Without a trained checkpoint the model runs with random weights, which
+doesn't change its cost. Prints a JSON report.
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.export import find_images
+from backend.model import MODEL_PATH, CLASS_NAMES, build_model, load_model
+from backend import config
+from backend.pipeline import (
+    transform, decode_image, to_input_tensor, GradCAM, segment_leaf, calculate_severity, overlay_heatmap,
+    encode_overlay,
+)
+from backend.severity import segment_leaves
+from benchmarks.report import ROOT, environment, summarize, write_report
+from benchmarks.synthetic import encode_jpeg, make_leaf_image
+
+SYNTHETIC_SIZES = ((640, 480), (1280, 960), (4000, 3000))
+
+
+def time_stage(fn, repeats):
+    """Runs `fn` once untimed, then `repeats` times; returns (last result, summary)."""
+    result = fn()
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(1000 * (time.perf_counter() - started))
+    return result, summarize(samples)
+
+
+def profile_image(contents, model, grad_cam, repeats):
+    stages = {}
+
+    def stage(name, fn):
+        result, stages[name] = time_stage(fn, repeats)
+        return result
+
+    full = stage("decode_full", lambda: np.array(Image.open(io.BytesIO(contents)).convert("RGB")))
+    image_np = stage("decode", lambda: decode_image(contents))
+    pil_image = Image.fromarray(full)
+    stage("transform", lambda: transform(pil_image).unsqueeze(0))
+    input_tensor = stage("to_input_tensor", lambda: to_input_tensor(image_np))
+
+    def forward():
+        with torch.no_grad():
+            return model(input_tensor)
+
+    logits = stage("forward", forward)
+    class_idx = int(logits.argmax(dim=1).item())
+    heatmap = stage("generate_heatmap", lambda: grad_cam.generate_heatmap(input_tensor, class_idx))
+
+    leaf_mask = stage("segment_leaf", lambda: segment_leaf(image_np))
+    model_image = input_tensor.mul(255).round_().to(torch.uint8).permute(0, 2, 3, 1).numpy()
+    stage("segment_leaves", lambda: segment_leaves(model_image))
+    stage("calculate_severity", lambda: calculate_severity(heatmap, leaf_mask))
+
+    overlay_b64 = stage("overlay_heatmap", lambda: overlay_heatmap(image_np, heatmap, leaf_mask))
+    overlay_jpeg = base64.b64decode(overlay_b64)
+    stage("base64", lambda: base64.b64encode(overlay_jpeg).decode("utf-8"))
+    stage("encode_overlay", lambda: encode_overlay(
+        image_np, heatmap, leaf_mask, "webp", config.HEATMAP_QUALITY, config.HEATMAP_MAX_SIDE
+    ))
+
+    return {
+        "upload_bytes": len(contents),
+        "full_size": [full.shape[1], full.shape[0]],
+        "working_size": [image_np.shape[1], image_np.shape[0]],
+        "stages": stages,
+        "total_mean_ms": sum(
+            stages[name]["mean_ms"] for name in
+            ("decode", "to_input_tensor", "generate_heatmap", "segment_leaves", "encode_overlay")
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Directory of real photos to include")
+    parser.add_argument("--max-images", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=1, help="torch threads (the server uses 1 per worker)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    device = torch.device("cpu")
+    if os.path.exists(MODEL_PATH):
+        model, weights = load_model(MODEL_PATH, device), "checkpoint"
+    else:
+        model, weights = build_model(len(CLASS_NAMES)).eval(), "random"
+    grad_cam = GradCAM(model, model.features[-1])
+
+    rng = np.random.default_rng(args.seed)
+    samples = {f"synthetic_{w}x{h}": encode_jpeg(make_leaf_image(rng, w, h)) for w, h in SYNTHETIC_SIZES}
+    fixture = os.path.join(ROOT, "test_image.jpg")
+    if os.path.exists(fixture):
+        with open(fixture, "rb") as f:
+            samples["test_image.jpg"] = f.read()
+    if args.images:
+        for path, _ in find_images(args.images, args.max_images):
+            with open(path, "rb") as f:
+                samples[os.path.relpath(path, args.images)] = f.read()
+
+    write_report({
+        "benchmark": "stages",
+        "environment": environment(),
+        "weights": weights,
+        "repeats": args.repeats,
+        "images": {name: profile_image(contents, model, grad_cam, args.repeats) for name, contents in samples.items()},
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
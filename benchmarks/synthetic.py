@@ -0,0 +1,45 @@
+"""Synthetic leaf photos for benchmarks when no real sample set is at hand."""
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def make_leaf_image(rng, width=640, height=480):
+    """RGB uint8 image: a green leaf with brown/yellow lesions on a soil-coloured, noisy background."""
+    image = np.empty((height, width, 3), np.uint8)
+    image[:] = rng.integers(60, 110, size=3)
+    image = cv2.add(image, rng.integers(0, 40, size=(height, width, 3), dtype=np.uint8))
+
+    center = (int(width * rng.uniform(0.4, 0.6)), int(height * rng.uniform(0.4, 0.6)))
+    axes = (int(width * rng.uniform(0.25, 0.4)), int(height * rng.uniform(0.2, 0.35)))
+    green = tuple(int(c) for c in (rng.integers(30, 80), rng.integers(120, 200), rng.integers(30, 80)))
+    cv2.ellipse(image, center, axes, float(rng.uniform(0, 180)), 0, 360, green, -1)
+
+    for _ in range(int(rng.integers(0, 12))):
+        spot = (
+            int(center[0] + rng.uniform(-0.8, 0.8) * axes[0]),
+            int(center[1] + rng.uniform(-0.8, 0.8) * axes[1]),
+        )
+        brown = tuple(int(c) for c in (rng.integers(120, 180), rng.integers(80, 130), rng.integers(20, 60)))
+        cv2.circle(image, spot, int(rng.integers(3, max(4, width // 20))), brown, -1)
+
+    return image
+
+
+def encode_jpeg(image_np, quality=90):
+    buffer = io.BytesIO()
+    Image.fromarray(image_np).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def make_heatmaps(rng, count, grid=(5, 5)):
+    """Random Grad-CAM-like heatmaps normalised to [0, 1]."""
+    heatmaps = rng.random((count,) + grid).astype(np.float32)
+    return heatmaps / heatmaps.max(axis=(1, 2), keepdims=True)
+
+
+def sample_set(rng, count, sizes=((640, 480), (1280, 960), (4000, 3000))):
+    """`count` JPEG uploads cycling through `sizes` (the last is a 12 MP phone photo)."""
+    return [encode_jpeg(make_leaf_image(rng, *sizes[i % len(sizes)])) for i in range(count)]
@@ -22,7 +22,8 @@ function App() {
       // Use environment variable for API URL, fallback to localhost
       const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
-      const response = await fetch(`${API_URL}/predict`, {
+      // The raw heatmap grid and leaf mask are drawn over the photo in the browser (see HeatmapOverlay)
+      const response = await fetch(`${API_URL}/predict?heatmap=grid`, {
         method: 'POST',
         body: formData,
       });
@@ -32,7 +33,11 @@ function App() {
       }
 
       const data = await response.json();
-      setResult(data);
+      setResult({
+        ...data,
+        imageUrl: URL.createObjectURL(file),
+        heatmap_url: data.heatmap_url && `${API_URL}${data.heatmap_url}`,
+      });
     } catch (err) {
       setError(err.message);
     } finally {
@@ -41,6 +46,7 @@ function App() {
   };
 
   const resetAnalysis = () => {
+    if (result?.imageUrl) URL.revokeObjectURL(result.imageUrl);
     setResult(null);
     setError(null);
   };
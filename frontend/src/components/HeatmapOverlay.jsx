@@ -0,0 +1,98 @@
+import { useEffect, useRef } from 'react';
+
+// Longest side of the overlay drawn in the browser
+const MAX_SIDE = 512;
+
+// Same curve as OpenCV's COLORMAP_JET, which the server uses
+function jet(v) {
+    const channel = (offset) => Math.min(1, Math.max(0, 1.5 - Math.abs(4 * v - offset)));
+    return [channel(3) * 255, channel(2) * 255, channel(1) * 255];
+}
+
+// Bilinear sample of the grid at output pixel (x, y), with cv2.resize's pixel-centre convention
+function sample(grid, x, y, width, height) {
+    const rows = grid.length;
+    const cols = grid[0].length;
+    const gy = Math.min(rows - 1, Math.max(0, (y + 0.5) * (rows / height) - 0.5));
+    const gx = Math.min(cols - 1, Math.max(0, (x + 0.5) * (cols / width) - 0.5));
+    const y0 = Math.floor(gy);
+    const x0 = Math.floor(gx);
+    const y1 = Math.min(rows - 1, y0 + 1);
+    const x1 = Math.min(cols - 1, x0 + 1);
+    const fy = gy - y0;
+    const fx = gx - x0;
+    const top = grid[y0][x0] * (1 - fx) + grid[y0][x1] * fx;
+    const bottom = grid[y1][x0] * (1 - fx) + grid[y1][x1] * fx;
+    return top * (1 - fy) + bottom * fy;
+}
+
+// Nearest-neighbour sample of the leaf mask, like cv2.INTER_NEAREST on the server
+function insideLeaf(mask, x, y, width, height) {
+    const rows = mask.length;
+    const cols = mask[0].length;
+    const my = Math.min(rows - 1, Math.floor(y * (rows / height)));
+    const mx = Math.min(cols - 1, Math.floor(x * (cols / width)));
+    return mask[my][mx] > 0;
+}
+
+/**
+ * Grad-CAM overlay. With the raw heatmap grid, its leaf mask and the
+ * uploaded photo it is drawn here (no extra request); otherwise the
+ * server-rendered image at `heatmapUrl` is shown. Heat outside the leaf is
+ * left out, as on the server, so the picture matches the severity.
+ */
+function HeatmapOverlay({ grid, mask, imageUrl, heatmapUrl, alt }) {
+    const canvasRef = useRef(null);
+    const drawLocally = Boolean(grid && grid.length && mask && mask.length && imageUrl);
+
+    useEffect(() => {
+        if (!drawLocally) return;
+        const image = new Image();
+        image.onload = () => {
+            const canvas = canvasRef.current;
+            if (!canvas) return;
+            const scale = Math.min(1, MAX_SIDE / Math.max(image.naturalWidth, image.naturalHeight));
+            const width = Math.max(1, Math.round(image.naturalWidth * scale));
+            const height = Math.max(1, Math.round(image.naturalHeight * scale));
+            canvas.width = width;
+            canvas.height = height;
+
+            const ctx = canvas.getContext('2d');
+            ctx.drawImage(image, 0, 0, width, height);
+
+            const heat = ctx.createImageData(width, height);
+            for (let y = 0; y < height; y++) {
+                for (let x = 0; x < width; x++) {
+                    // Zero heat adds nothing in the 'lighter' blend below
+                    const [r, g, b] = insideLeaf(mask, x, y, width, height)
+                        ? jet(sample(grid, x, y, width, height))
+                        : [0, 0, 0];
+                    const i = (y * width + x) * 4;
+                    heat.data[i] = r;
+                    heat.data[i + 1] = g;
+                    heat.data[i + 2] = b;
+                    heat.data[i + 3] = 255;
+                }
+            }
+            const layer = document.createElement('canvas');
+            layer.width = width;
+            layer.height = height;
+            layer.getContext('2d').putImageData(heat, 0, 0);
+
+            // Additive blend at 40%, like the server's `heatmap * 0.4 + image`
+            ctx.globalCompositeOperation = 'lighter';
+            ctx.globalAlpha = 0.4;
+            ctx.drawImage(layer, 0, 0);
+            ctx.globalAlpha = 1;
+            ctx.globalCompositeOperation = 'source-over';
+        };
+        image.src = imageUrl;
+    }, [drawLocally, grid, mask, imageUrl]);
+
+    if (drawLocally) {
+        return <canvas ref={canvasRef} aria-label={alt} style={{ width: '100%', display: 'block' }} />;
+    }
+    return <img src={heatmapUrl} alt={alt} style={{ width: '100%', display: 'block' }} />;
+}
+
+export default HeatmapOverlay;
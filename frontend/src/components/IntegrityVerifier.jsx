@@ -6,6 +6,25 @@ function IntegrityVerifier({ onClose }) {
     const [expectedHash, setExpectedHash] = useState('');
     const [match, setMatch] = useState(null);
     const [calculating, setCalculating] = useState(false);
+    // What the server's ledger recorded for this hash (null: not checked yet)
+    const [record, setRecord] = useState(null);
+
+    const lookupLedger = async (hashHex) => {
+        const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+        try {
+            const response = await fetch(`${API_URL}/verify/${hashHex}`);
+            if (response.status === 404) {
+                setRecord({ found: false });
+                return;
+            }
+            if (!response.ok) throw new Error(`Verification failed: ${response.status}`);
+            const data = await response.json();
+            setRecord({ found: true, count: data.count, ...data.records[0] });
+        } catch (error) {
+            console.error("Ledger lookup failed:", error);
+            setRecord(null);
+        }
+    };
 
     const calculateHash = async (file) => {
         setCalculating(true);
@@ -15,6 +34,7 @@ function IntegrityVerifier({ onClose }) {
             const hashArray = Array.from(new Uint8Array(hashBuffer));
             const hashHex = hashArray.map(b => b.toString(16).padStart(2, '0')).join('');
             setHash(hashHex);
+            lookupLedger(hashHex);
             if (expectedHash) {
                 setMatch(hashHex === expectedHash);
             }
@@ -104,6 +124,23 @@ function IntegrityVerifier({ onClose }) {
                                 {match ? '✅ HASH MATCHED - FILE IS AUTHENTIC' : '❌ HASH MISMATCH - FILE MODIFIED'}
                             </div>
                         )}
+
+                        {record && (
+                            <div style={{ marginTop: '0.75rem', fontSize: '0.85rem', color: '#ccc' }}>
+                                {record.found ? (
+                                    <>
+                                        <div style={{ fontSize: '0.7rem', color: '#888', marginBottom: '0.25rem' }}>SERVER RECORD</div>
+                                        <div>
+                                            Diagnosed {record.prediction.replace(/_/g, ' ')} ({(record.confidence * 100).toFixed(1)}%)
+                                            {' '}by model {record.model_version} on {new Date(record.ts * 1000).toLocaleString()}
+                                        </div>
+                                        {record.count > 1 && <div style={{ color: '#888' }}>{record.count} diagnoses recorded for this file</div>}
+                                    </>
+                                ) : (
+                                    <div style={{ color: 'var(--danger)' }}>No diagnosis of this file is recorded on the server</div>
+                                )}
+                            </div>
+                        )}
                     </div>
                 )}
             </div>
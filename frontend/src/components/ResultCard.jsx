@@ -1,5 +1,6 @@
 import { useState, useRef, useEffect } from 'react';
 import IntegrityVerifier from './IntegrityVerifier';
+import HeatmapOverlay from './HeatmapOverlay';
 import html2canvas from 'html2canvas';
 import jsPDF from 'jspdf';
 
@@ -284,7 +285,7 @@ function ResultCard({ result, onReset }) {
                             paddingTop: isMobile ? '1.5rem' : '0',
                         }}
                     >
-                        {result.heatmap_b64 && (
+                        {(result.heatmap_grid || result.heatmap_url || result.heatmap_b64) && (
                             <div style={{ marginBottom: '1.75rem' }}>
                                 <h3
                                     style={{
@@ -305,10 +306,15 @@ function ResultCard({ result, onReset }) {
                                         position: 'relative',
                                     }}
                                 >
-                                    <img
-                                        src={`data:image/jpeg;base64,${result.heatmap_b64}`}
+                                    <HeatmapOverlay
+                                        grid={result.heatmap_grid}
+                                        mask={result.leaf_mask}
+                                        imageUrl={result.imageUrl}
+                                        heatmapUrl={
+                                            result.heatmap_url ||
+                                            `data:image/jpeg;base64,${result.heatmap_b64}`
+                                        }
                                         alt="Disease Heatmap"
-                                        style={{ width: '100%', display: 'block' }}
                                     />
                                     <div
                                         style={{
@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+
+from backend.admission import AdmissionController, RateLimiter, Rejected
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=1)
+        release = asyncio.Event()
+
+        async def job():
+            async with admission.slot():
+                await release.wait()
+
+        running = asyncio.ensure_future(job())
+        queued = asyncio.ensure_future(job())
+        await asyncio.sleep(0)
+        assert admission.in_flight == 1 and admission.queue_depth == 1
+        assert admission.saturated
+
+        with pytest.raises(Rejected) as rejected:
+            async with admission.slot():
+                pass
+        release.set()
+        await asyncio.gather(running, queued)
+        return admission, rejected.value
+
+    admission, rejected = _run(scenario())
+    assert rejected.status_code == 503
+    assert rejected.reason == "queue_full"
+    assert rejected.retry_after >= 1
+    assert admission.shed == {"queue_full": 1}
+    assert admission.admitted == 2
+    assert admission.in_flight == 0
+
+
+def test_queue_timeout_gives_up_and_frees_its_place():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=4)
+        release = asyncio.Event()
+
+        async def holder():
+            async with admission.slot():
+                await release.wait()
+
+        task = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as rejected:
+            async with admission.slot(timeout=0.01):
+                pass
+        depth = admission.queue_depth
+        release.set()
+        await task
+        return admission, rejected.value, depth
+
+    admission, rejected, depth = _run(scenario())
+    assert rejected.reason == "queue_timeout"
+    assert depth == 0
+    assert admission.in_flight == 0
+
+
+def test_slots_are_handed_over_in_arrival_order():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=8)
+        order = []
+
+        async def job(i):
+            async with admission.slot():
+                order.append(i)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(job(i) for i in range(5)))
+        return order
+
+    assert _run(scenario()) == [0, 1, 2, 3, 4]
+
+
+def test_unbounded_slots_queue_past_max_queue():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=0)
+        done = []
+
+        async def job(i):
+            async with admission.slot(bounded=False):
+                await asyncio.sleep(0)
+                done.append(i)
+
+        await asyncio.gather(*(job(i) for i in range(3)))
+        return done
+
+    assert _run(scenario()) == [0, 1, 2]
+
+
+def test_degraded_once_the_queue_reaches_the_threshold():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=8, degrade_depth=2)
+        release = asyncio.Event()
+
+        async def job():
+            async with admission.slot():
+                await release.wait()
+
+        tasks = [asyncio.ensure_future(job()) for _ in range(2)]
+        await asyncio.sleep(0)
+        before = admission.degraded
+        tasks.append(asyncio.ensure_future(job()))
+        await asyncio.sleep(0)
+        after = admission.degraded
+        release.set()
+        await asyncio.gather(*tasks)
+        return before, after, admission.degraded
+
+    assert _run(scenario()) == (False, True, False)
+
+
+def test_rate_limiter_allows_a_burst_then_asks_to_wait():
+    limiter = RateLimiter(rate=2.0, burst=3)
+    assert [limiter.acquire("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = limiter.acquire("a")
+    assert 0 < wait <= 0.5
+    # Buckets are per client
+    assert limiter.acquire("b") == 0.0
+
+
+def test_rate_limiter_disabled_and_bounded():
+    assert RateLimiter(rate=0, burst=1).acquire("a") == 0.0
+    limiter = RateLimiter(rate=1.0, burst=1, max_clients=2)
+    for client in ("a", "b", "c"):
+        limiter.acquire(client)
+    assert limiter.stats()["clients"] == 2
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+
+import torch
+
+from backend.batching import BatchScheduler
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_submits_share_a_batch_and_get_their_own_rows():
+    batches = []
+
+    def run_batch(inputs):
+        batches.append(inputs.shape[0])
+        # Each row is its input's marker value, so misrouted rows are visible
+        return inputs[:, 0, 0, :1] * 10
+
+    async def scenario():
+        scheduler = BatchScheduler(run_batch, max_batch_size=4, max_wait_ms=50)
+        await scheduler.start()
+        try:
+            tensors = [torch.full((1, 2, 2), float(i)) for i in range(4)]
+            return await asyncio.gather(*(scheduler.submit(t) for t in tensors))
+        finally:
+            await scheduler.stop()
+
+    rows = _run(scenario())
+    assert batches == [4]
+    assert [row.item() for row in rows] == [0.0, 10.0, 20.0, 30.0]
+
+
+def test_batches_are_capped_and_run_in_arrival_order():
+    order = []
+
+    def run_batch(inputs):
+        order.extend(int(v) for v in inputs[:, 0, 0, 0])
+        return inputs[:, 0, 0, :1]
+
+    async def scenario():
+        scheduler = BatchScheduler(run_batch, max_batch_size=3, max_wait_ms=20)
+        await scheduler.start()
+        try:
+            rows = await asyncio.gather(*(scheduler.submit(torch.full((1, 1, 1), float(i))) for i in range(7)))
+            return rows, scheduler.stats()
+        finally:
+            await scheduler.stop()
+
+    rows, stats = _run(scenario())
+    assert order == list(range(7))
+    assert [row.item() for row in rows] == list(range(7))
+    assert stats["batch_size"]["count"] == 3
+    assert stats["batch_size"]["sum"] == 7
+
+
+def test_tuple_outputs_are_split_per_caller():
+    def run_batch(inputs):
+        values = inputs[:, 0, 0, 0]
+        return values + 1, values * 2
+
+    async def scenario():
+        scheduler = BatchScheduler(run_batch, max_batch_size=2, max_wait_ms=50)
+        try:
+            return await asyncio.gather(
+                scheduler.submit(torch.full((1, 1, 1), 1.0)),
+                scheduler.submit(torch.full((1, 1, 1), 2.0)),
+            )
+        finally:
+            await scheduler.stop()
+
+    first, second = _run(scenario())
+    assert (first[0].item(), first[1].item()) == (2.0, 2.0)
+    assert (second[0].item(), second[1].item()) == (3.0, 4.0)
+
+
+def test_a_failing_batch_fails_every_caller_in_it():
+    def run_batch(inputs):
+        raise RuntimeError("model crashed")
+
+    async def scenario():
+        scheduler = BatchScheduler(run_batch, max_batch_size=2, max_wait_ms=50)
+        try:
+            return await asyncio.gather(
+                scheduler.submit(torch.zeros(1, 1, 1)),
+                scheduler.submit(torch.zeros(1, 1, 1)),
+                return_exceptions=True,
+            )
+        finally:
+            await scheduler.stop()
+
+    results = _run(scenario())
+    assert all(isinstance(r, RuntimeError) and str(r) == "model crashed" for r in results)
+
+
+def test_cancelled_callers_are_left_out_of_the_batch():
+    release = threading.Event()
+    sizes = []
+
+    def run_batch(inputs):
+        sizes.append(inputs.shape[0])
+        release.wait(5)
+        return inputs[:, 0, 0, :1]
+
+    async def scenario():
+        scheduler = BatchScheduler(run_batch, max_batch_size=4, max_wait_ms=1)
+        try:
+            # Occupies the only batch slot while the next callers queue up
+            busy = asyncio.ensure_future(scheduler.submit(torch.zeros(1, 1, 1)))
+            await asyncio.sleep(0.05)
+            gone = asyncio.ensure_future(scheduler.submit(torch.ones(1, 1, 1)))
+            kept = asyncio.ensure_future(scheduler.submit(torch.full((1, 1, 1), 2.0)))
+            await asyncio.sleep(0.05)
+            gone.cancel()
+            release.set()
+            return await busy, await kept
+        finally:
+            release.set()
+            await scheduler.stop()
+
+    busy, kept = _run(scenario())
+    assert kept.item() == 2.0
+    assert sizes == [1, 1]
@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import os
+
+from backend.cache import PredictionCache, UploadStore
+
+
+def _hash(i):
+    return hashlib.sha256(bytes([i])).hexdigest()
+
+
+def test_lru_eviction_by_entry_count():
+    cache = PredictionCache(max_entries=2)
+    cache.put("a", {"prediction": "x"})
+    cache.put("b", {"prediction": "y"})
+    assert cache.get("a") is not None  # "b" is now least recently used
+    cache.put("c", {"prediction": "z"})
+
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.evictions == 1
+
+
+def test_byte_budget_counts_nested_values():
+    small = {"prediction": "x"}
+    grid = {"prediction": "x", "heatmap_grid": [[0.1234] * 16] * 16}
+    cache = PredictionCache(max_entries=100, max_bytes=4096)
+    cache.put("grid", grid)
+    assert cache.stats()["bytes"] > 2000
+    for i in range(10):
+        cache.put(f"small{i}", small)
+    assert "grid" not in cache
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("backend.cache.time.time", lambda: now[0])
+    cache = PredictionCache(ttl_seconds=10)
+    cache.put("a", {"prediction": "x"})
+    now[0] += 5
+    assert cache.get("a") is not None
+    now[0] += 10
+    assert cache.get("a") is None
+    assert cache.expirations == 1
+
+
+def test_fallback_keys_count_one_lookup():
+    cache = PredictionCache()
+    cache.put("k:classify", {"prediction": "x"})
+    assert cache.get("k", "k:classify") == {"prediction": "x"}
+    assert cache.get("missing", "missing:classify") is None
+    assert cache.get("missing", count=False) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_persistence_round_trip(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = PredictionCache(persist_path=path)
+    cache.put("a", {"prediction": "x"})
+    cache.put("b", {"prediction": "y"})
+    cache.save()
+
+    restored = PredictionCache(persist_path=path)
+    assert restored.load() == 2
+    assert restored.get("b") == {"prediction": "y"}
+
+
+def test_upload_store_memory_lru():
+    async def scenario():
+        store = UploadStore(max_bytes=20)
+        for i in range(3):
+            await store.put(_hash(i), bytes([i]) * 10)
+        return store, await store.get(_hash(0)), await store.get(_hash(2))
+
+    store, evicted, kept = asyncio.run(scenario())
+    assert evicted is None
+    assert kept == bytes([2]) * 10
+    assert not store.has(_hash(0)) and store.has(_hash(1))
+
+
+def test_upload_store_prunes_files_beyond_the_disk_budget(tmp_path):
+    directory = str(tmp_path)
+
+    async def scenario():
+        store = UploadStore(max_bytes=10, directory=directory, max_disk_bytes=25)
+        for i in range(4):
+            await store.put(_hash(i), bytes([i]) * 10)
+        # Evicted from memory but still on disk
+        return store, await store.get(_hash(2))
+
+    store, contents = asyncio.run(scenario())
+    assert contents == bytes([2]) * 10
+    assert sorted(os.listdir(directory)) == sorted([_hash(2), _hash(3)])
+    assert not store.has(_hash(0))
+
+    # A restart indexes (and keeps within budget) what is left on disk
+    restarted = UploadStore(max_bytes=10, directory=directory, max_disk_bytes=10)
+    assert restarted.load() == 1
+    assert len(os.listdir(directory)) == 1
+
+
+def test_upload_store_expiry_deletes_files(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("backend.cache.time.time", lambda: now[0])
+    directory = str(tmp_path)
+
+    async def scenario():
+        store = UploadStore(directory=directory, ttl_seconds=10)
+        await store.put(_hash(1), b"leaf")
+        now[0] += 20
+        assert not store.has(_hash(1))
+        return await store.get(_hash(1))
+
+    assert asyncio.run(scenario()) is None
+    assert os.listdir(directory) == []
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from backend.ledger import IntegrityLedger, verify_chain
+
+
+def _append(ledger, n, start=0):
+    for i in range(start, start + n):
+        ledger.append(f"{i:064x}", "v1", "Tomato___healthy", 0.9, severity=0.1, tier="explain")
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "ledger.jsonl")
+
+
+def test_records_are_chained_and_verify(path):
+    ledger = IntegrityLedger(path, commit_interval_ms=1)
+    ledger.open()
+    _append(ledger, 5)
+    ledger.close()
+
+    report = verify_chain(path)
+    assert report["ok"] and report["records"] == 5
+
+    reopened = IntegrityLedger(path)
+    reopened.open(read_only=True)
+    try:
+        assert len(reopened) == 5
+        assert reopened.count(f"{3:064x}") == 1
+        assert reopened.lookup(f"{3:064x}")[0]["seq"] == 3
+    finally:
+        reopened.close()
+
+
+def test_editing_a_record_breaks_the_chain(path):
+    ledger = IntegrityLedger(path, commit_interval_ms=1)
+    ledger.open()
+    _append(ledger, 4)
+    ledger.close()
+
+    with open(path) as f:
+        lines = f.readlines()
+    record = json.loads(lines[1])
+    record["prediction"] = "Tomato___Late_blight"
+    lines[1] = json.dumps(record, separators=(",", ":")) + "\n"
+    with open(path, "w") as f:
+        f.writelines(lines)
+
+    report = verify_chain(path)
+    assert not report["ok"]
+    assert report["first_bad_seq"] == 1
+
+
+def test_torn_last_line_is_dropped_and_the_chain_continues(path):
+    ledger = IntegrityLedger(path, commit_interval_ms=1)
+    ledger.open()
+    _append(ledger, 3)
+    ledger.close()
+
+    # A crash in the middle of a write leaves a partial record without newline
+    with open(path, "ab") as f:
+        f.write(b'{"seq":3,"ts":1')
+
+    ledger = IntegrityLedger(path, commit_interval_ms=1)
+    ledger.open()
+    assert len(ledger) == 3
+    _append(ledger, 2, start=3)
+    ledger.close()
+
+    with open(path, "rb") as f:
+        assert f.read().count(b"\n") == 5
+    report = verify_chain(path)
+    assert report["ok"] and report["records"] == 5
+
+
+def test_second_writer_is_refused(path):
+    ledger = IntegrityLedger(path)
+    ledger.open()
+    try:
+        with pytest.raises(RuntimeError):
+            IntegrityLedger(path).open()
+    finally:
+        ledger.close()
@@ -0,0 +1,67 @@
+import numpy as np
+
+from backend.pipeline import calculate_severity, segment_leaf
+from backend.severity import calculate_severities, resize_masks_nearest, segment_leaves
+
+GREEN = (40, 160, 40)
+BROWN = (150, 100, 40)
+
+
+def _leaf_images():
+    images = np.zeros((3, 160, 160, 3), dtype=np.uint8)
+    images[0, 20:140, 20:140] = GREEN
+    images[1, 30:130, 40:120] = GREEN
+    images[1, 60:90, 60:90] = BROWN
+    # images[2] is background only
+    return images
+
+
+def test_segment_leaves_finds_leaf_pixels_per_image():
+    masks = segment_leaves(_leaf_images())
+    assert masks.shape == (3, 160, 160)
+    assert masks.dtype == np.uint8
+    assert masks[0, 80, 80] == 1 and masks[0, 5, 5] == 0
+    # Diseased (brown) tissue still counts as leaf
+    assert masks[1, 75, 75] == 1
+    assert masks[2].sum() == 0
+
+
+def test_segment_leaves_matches_the_single_image_version():
+    images = _leaf_images()
+    masks = segment_leaves(images)
+    for image, mask in zip(images, masks):
+        # Kernel sizes differ, so compare areas rather than exact borders
+        single = segment_leaf(image)
+        assert abs(int(mask.sum()) - int(single.sum())) <= 0.02 * max(1, int(single.sum()))
+
+
+def test_calculate_severities_matches_the_single_image_version():
+    rng = np.random.default_rng(0)
+    heatmaps = rng.random((3, 20, 20)).astype(np.float32)
+    masks = segment_leaves(_leaf_images())
+
+    batched = calculate_severities(heatmaps, masks)
+    assert batched.shape == (3,)
+    for heatmap, mask, severity in zip(heatmaps, masks, batched):
+        assert severity == np.float64(calculate_severity(heatmap, mask))
+    # No leaf means no severity rather than a division by zero
+    assert batched[2] == 0.0
+
+
+def test_severity_is_the_activated_share_of_the_leaf():
+    masks = np.zeros((1, 4, 4), dtype=np.uint8)
+    masks[0, :2] = 1
+    heatmaps = np.zeros((1, 4, 4), dtype=np.float32)
+    heatmaps[0, 0] = 0.9
+    heatmaps[0, 3] = 0.9  # outside the leaf
+    assert calculate_severities(heatmaps, masks)[0] == 0.5
+
+
+def test_resize_masks_nearest_samples_like_opencv():
+    import cv2
+
+    masks = (np.random.default_rng(1).random((2, 160, 160)) > 0.5).astype(np.uint8)
+    resized = resize_masks_nearest(masks, (20, 20))
+    for mask, small in zip(masks, resized):
+        expected = cv2.resize(mask, (20, 20), interpolation=cv2.INTER_NEAREST)
+        assert np.array_equal(small, expected)
@@ -5,8 +5,12 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 try:
-    from backend.main import app, model, device
+    from backend.main import app, device, registry
+    from backend.model import load_model
     print("Backend imported successfully.")
+    # The server loads the model during app startup, not at import time
+    spec = registry.active_spec()
+    model = load_model(spec.path, device, len(spec.class_names), spec.arch)
     if model is not None:
         print(f"Model loaded on {device}")
     else: